@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+A stand-in for gcc, so that benchmarks measure mem and not the
+compiler. It understands just enough of gcc's command line for
+mem.tasks.gcc:
+
+  fakecc [flags] -M -o - source       print make dependencies
+  fakecc [flags] -c -o target source  "compile"
+  fakecc [flags] -o target objs...    "link"
+
+Includes are found by scanning for #include "..." along the -I paths.
+Compiling sleeps FAKECC_DELAY seconds (default 0.01) to stand in for
+the compiler's work; the outputs are a function of the inputs.
+"""
+
+import hashlib
+import os
+import re
+import sys
+import time
+
+_INCLUDE = re.compile(r'^\s*#\s*include\s*"([^"]+)"', re.MULTILINE)
+
+
+def find_includes(source, paths, found):
+    f = open(source)
+    try:
+        text = f.read()
+    finally:
+        f.close()
+    for name in _INCLUDE.findall(text):
+        for d in [os.path.dirname(source)] + paths:
+            path = os.path.join(d, name)
+            if os.path.exists(path):
+                if path not in found:
+                    found.append(path)
+                    find_includes(path, paths, found)
+                break
+    return found
+
+
+def digest(paths):
+    h = hashlib.sha1()
+    for path in paths:
+        f = open(path, "rb")
+        try:
+            h.update(f.read())
+        finally:
+            f.close()
+    return h.hexdigest()
+
+
+def write(path, data):
+    f = open(path, "w")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
+def main(args):
+    paths = [a[2:] for a in args if a.startswith("-I")]
+    output = None
+    inputs = []
+    i = 0
+    while i < len(args):
+        if args[i] == "-o":
+            output = args[i + 1]
+            i += 1
+        elif not args[i].startswith("-"):
+            inputs.append(args[i])
+        i += 1
+
+    if "-M" in args:
+        deps = [inputs[0]] + find_includes(inputs[0], paths, [])
+        obj = os.path.splitext(os.path.basename(inputs[0]))[0] + ".o"
+        sys.stdout.write("%s: %s\n" % (obj, " \\\n  ".join(deps)))
+    elif "-c" in args:
+        time.sleep(float(os.environ.get("FAKECC_DELAY", "0.01")))
+        deps = inputs + find_includes(inputs[0], paths, [])
+        write(output, "object %s\n" % digest(deps))
+    else:
+        write(output, "program %s\n" % digest(inputs))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Microbenchmarks for the code a warm build spends its time in: the
+memoize hit path, Mem.get_hash, creating and hashing File objects,
+unpickling deps and restoring results. Sizes are those of real builds:
+deps lists of 10, 100 and 1000 files and an Env with 50 keys.
+
+  $ python benchmarks/micro.py                  # just report
+  $ python benchmarks/micro.py --save-baseline
+  $ python benchmarks/micro.py --check          # exit 1 on regressions
+
+Every benchmark reports operations per second and the allocations one
+operation leaves behind: memory blocks where sys.getallocatedblocks()
+exists, otherwise the objects the garbage collector tracks (lists,
+dicts, instances, ...). Python 2 can't count allocations that are
+freed again before the operation returns, so this is a net figure; it
+catches caches and structures that grow on every call.
+"""
+
+import gc
+import json
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import cPickle as pickle
+
+# memoize() hashes the file of a task's module, wherever we're run from
+__file__ = os.path.abspath(__file__)
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import mem
+from mem import nodes
+from mem.nodes import File
+from mem.util import Env
+
+SIZES = (10, 100, 1000)
+
+
+@mem.memoize
+def _task(target, deps):
+    mem.add_deps(deps)
+    return target
+
+
+class Context(object):
+    """a throw-away build root with 1000 source files"""
+    def __init__(self):
+        self.cwd = os.getcwd()
+        self.root = os.path.realpath(tempfile.mkdtemp(prefix="mem-micro-"))
+        os.chdir(self.root)
+        self.mem = mem.Mem(self.root)
+        self.paths = []
+        for i in range(max(SIZES)):
+            path = os.path.join(self.root, "f%d.c" % i)
+            f = open(path, "w")
+            f.write("int f%d(void) { return %d; }\n" % (i, i))
+            f.close()
+            self.paths.append(path)
+        self.files = [File(p) for p in self.paths]
+
+    def close(self):
+        self.mem.finish()
+        os.chdir(self.cwd)
+        mem.Mem.destroy()
+        shutil.rmtree(self.root)
+
+
+def _env(frozen):
+    env = Env(("VAR%d" % i, "value %d" % i) for i in range(40))
+    for i in range(10):
+        env["FLAGS%d" % i] = ["-O2", "-g", "-Wall", "-I/usr/include/x%d" % i]
+    if frozen:
+        env.freeze()
+    return env
+
+
+def benchmarks(ctx):
+    """(name, zero argument callable) for every benchmark"""
+    m = ctx.mem
+    result = []
+
+    for n in SIZES:
+        deps = ctx.files[:n]
+        result.append(("get_hash deps=%d" % n,
+                       lambda deps=deps: m.get_hash("tchash", deps)))
+    for frozen in (False, True):
+        env = _env(frozen)
+        result.append(("get_hash env=50%s" % (frozen and " frozen" or ""),
+                       lambda env=env: m.get_hash(
+                           "t_c_obj", "mem.tasks.gcc",
+                           ("a.o", ["a.c"]), {"env": env})))
+
+    path = ctx.paths[0]
+    result.append(("File() hashed", lambda: File(path)))
+    f = ctx.files[0]
+    result.append(("File.get_hash hashed", f.get_hash))
+
+    def rehash():
+        del nodes.File._hash_cache[path]
+        return f.get_hash()
+    result.append(("File.get_hash stat", rehash))
+
+    for n in SIZES:
+        data = pickle.dumps(ctx.files[:n])
+        result.append(("pickle.loads deps=%d" % n,
+                       lambda data=data: pickle.loads(data)))
+
+    result.append(("File.restore unchanged", f.restore))
+
+    for n in SIZES:
+        deps = ctx.files[:n]
+        target = "t%d.o" % n
+        _task(target, deps)
+        result.append(("memoize hit same build deps=%d" % n,
+                       lambda target=target, deps=deps: _task(target, deps)))
+
+        def new_build(target=target, deps=deps):
+            # what a no-op build does: nothing hashed, nothing called
+            m.calls.clear()
+            nodes.File._hash_cache.clear()
+            return _task(target, deps)
+        result.append(("memoize hit new build deps=%d" % n, new_build))
+
+    return result
+
+
+def _allocated():
+    if hasattr(sys, "getallocatedblocks"):
+        return sys.getallocatedblocks()
+    # allocating a tracked object counts up, freeing one counts down;
+    # only a collection resets it
+    return gc.get_count()[0]
+
+
+def _allocations(fn, number=100):
+    """what one call of fn leaves allocated, the mean of number calls"""
+    gc.collect()
+    gc.disable()
+    try:
+        before = _allocated()
+        for _ in xrange(number):
+            fn()
+        after = _allocated()
+    finally:
+        gc.enable()
+    return float(after - before) / number
+
+
+def measure(fn, min_time=0.2, repeat=3):
+    """ops/sec of fn, the best of repeat runs of about min_time each"""
+    timer = timeit.Timer(fn)
+    number = 1
+    t = timer.timeit(number)
+    while t < min_time / 10:
+        number *= 10
+        t = timer.timeit(number)
+    number = max(number, int(number * min_time / t))
+    return number / min(timer.repeat(repeat, number))
+
+
+def run(only=None, min_time=0.2, out=sys.stdout):
+    ctx = Context()
+    results = {}
+    try:
+        out.write("%-36s %14s %12s\n" % ("benchmark", "ops/sec",
+                                          "allocs/op"))
+        for name, fn in benchmarks(ctx):
+            if only and only not in name:
+                continue
+            ops = measure(fn, min_time)
+            allocs = _allocations(fn)
+            results[name] = {"ops_per_sec": ops, "allocations": allocs}
+            out.write("%-36s %14.0f %12.1f\n" % (name, ops, allocs))
+    finally:
+        ctx.close()
+    return results
+
+
+def compare(results, baseline, threshold, out=sys.stdout):
+    """returns the names of benchmarks that got slower than threshold"""
+    slower = []
+    out.write("%-36s %14s %14s %6s\n" %
+              ("benchmark", "baseline", "now", "ratio"))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before = baseline[name]["ops_per_sec"]
+        now = results[name]["ops_per_sec"]
+        ratio = before / max(now, 1e-9)
+        flag = ""
+        if ratio > threshold:
+            slower.append(name)
+            flag = "  SLOWER"
+        out.write("%-36s %14.0f %14.0f %6.2f%s\n" %
+                  (name, before, now, ratio, flag))
+    return slower
+
+
+def main(args):
+    parser = optparse.OptionParser(usage="micro.py [options]")
+    parser.add_option("-k", dest="only", metavar="TEXT",
+                      help="only run benchmarks whose name contains TEXT")
+    parser.add_option("--min-time", type="float", default=0.2,
+                      help="seconds every measurement runs at least")
+    parser.add_option("--output", metavar="FILE",
+                      help="write the results to FILE as JSON")
+    parser.add_option("--baseline", metavar="FILE",
+                      default=os.path.join(HERE, "micro-baseline.json"))
+    parser.add_option("--save-baseline", action="store_true")
+    parser.add_option("--check", action="store_true",
+                      help="compare against the baseline, exit 1 if "
+                      "something got slower than --threshold")
+    parser.add_option("--threshold", type="float", default=1.3,
+                      help="allowed slowdown, as a factor")
+    (options, args) = parser.parse_args(args)
+
+    results = run(options.only, options.min_time)
+    if options.output:
+        f = open(options.output, "w")
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.close()
+    if options.save_baseline:
+        f = open(options.baseline, "w")
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.close()
+    elif options.check:
+        baseline = json.load(open(options.baseline))
+        if compare(results, baseline, options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
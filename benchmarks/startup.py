@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Times how long runmem takes to get going: starting python, importing
+mem and evaluating the Memfiles of a project whose build() does
+nothing else. That's what every build pays, however little it has to
+do. These are timed, each in a fresh process:
+
+  python      python -c pass, for reference
+  import_mem  python -c "import mem"
+  memfiles    runmem --no-fast-path on a project of --dirs Memfiles
+  fast_path   runmem when nothing changed, see mem/noop.py
+
+  $ python benchmarks/startup.py --budget 150
+
+exits 1 if 'memfiles' takes longer than --budget milliseconds.
+"""
+
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+RUNMEM = os.path.join(REPO, "script", "runmem.py")
+
+MEMFILE_ROOT = """\
+import mem
+import mem.tasks.gcc
+
+def build():
+    for d in %(dirs)r:
+        mem.subdir(d).build()
+"""
+
+MEMFILE = """\
+import mem
+import mem.tasks.gcc
+
+def build():
+    pass
+"""
+
+SCENARIOS = ["python", "import_mem", "memfiles", "fast_path"]
+
+
+def _write(path, data):
+    d = os.path.dirname(path)
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    f = open(path, "w")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
+def generate(root, dirs):
+    names = ["d%d" % i for i in range(dirs)]
+    for name in names:
+        _write(os.path.join(root, name, "Memfile"), MEMFILE)
+    _write(os.path.join(root, "MemfileRoot"), MEMFILE_ROOT % {"dirs": names})
+
+
+def _time(args, cwd):
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.pathsep.join(
+        [REPO] + filter(None, [env.get("PYTHONPATH")]))
+    start = time.time()
+    p = subprocess.Popen(args, cwd=cwd, env=env, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT)
+    output = p.communicate()[0]
+    seconds = time.time() - start
+    if p.returncode != 0:
+        raise RuntimeError("%s failed:\n%s" % (" ".join(args), output))
+    return seconds
+
+
+def commands(root):
+    runmem = [sys.executable, RUNMEM, "--no-stats", "--no-server"]
+    return {"python": [sys.executable, "-c", "pass"],
+            "import_mem": [sys.executable, "-c", "import mem"],
+            "memfiles": runmem + ["--no-fast-path"],
+            "fast_path": runmem}
+
+
+def benchmark(dirs, repeat, out=sys.stdout):
+    """returns the median milliseconds of every scenario"""
+    root = tempfile.mkdtemp(prefix="mem-startup-")
+    try:
+        generate(root, dirs)
+        cmds = commands(root)
+        # compile the .pyc files and record the fast path's manifest
+        _time(cmds["memfiles"], root)
+        _time(cmds["fast_path"], root)
+        results = {}
+        for scenario in SCENARIOS:
+            times = sorted(_time(cmds[scenario], root)
+                           for _ in range(repeat))
+            results[scenario] = times[len(times) // 2] * 1000
+            out.write("%-11s %8.1fms\n" % (scenario, results[scenario]))
+        return results
+    finally:
+        shutil.rmtree(root)
+
+
+def main(args):
+    parser = optparse.OptionParser(usage="startup.py [options]")
+    parser.add_option("--dirs", type="int", default=20,
+                      help="number of Memfiles in the project")
+    parser.add_option("--repeat", type="int", default=11,
+                      help="run everything this often, report the median")
+    parser.add_option("--budget", type="float", metavar="MS",
+                      help="fail if 'memfiles' takes longer than MS")
+    parser.add_option("--output", metavar="FILE",
+                      help="write the results to FILE as JSON")
+    (options, args) = parser.parse_args(args)
+
+    results = benchmark(options.dirs, options.repeat)
+    if options.output:
+        _write(os.path.abspath(options.output), json.dumps(
+            {"python": sys.version.split()[0], "dirs": options.dirs,
+             "results": results}, indent=1))
+    if options.budget is not None and results["memfiles"] > options.budget:
+        print "memfiles took %.1fms, over the budget of %.1fms" % (
+            results["memfiles"], options.budget)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Benchmarks mem's build engine on generated projects.
+
+A project has N C files spread over a tree of mem.subdir() directories
+and M headers in include/, every C file including some of them and
+every header including a few more. It is compiled with fakecc.py, so
+the numbers are about mem, not about gcc. For every project size and
+concurrency these builds are timed:
+
+  cold          from scratch, empty cache
+  noop          nothing changed
+  touch_header  one header changed
+  restore       outputs deleted, everything comes from the cache
+
+  $ python benchmarks/synthetic.py --files 100,1000 --jobs 1,8 \\
+        --output results.json --baseline benchmarks/baseline.json
+
+With --baseline the results are compared against an earlier run and
+the exit status is 1 if a build got slower than --threshold allows.
+--save-baseline stores the results as the new baseline instead.
+"""
+
+import json
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+RUNMEM = os.path.join(REPO, "script", "runmem.py")
+
+SCENARIOS = ["cold", "noop", "touch_header", "restore"]
+
+# what runmem prints when the no-op fast path ends the build, which
+# leaves .mem/stats.json as the build before wrote it
+FAST_PATH = "nothing changed since the last build."
+
+MEMFILE_ROOT = """\
+import os
+import mem
+from mem.tasks.gcc import prog
+from mem.util import Env
+
+def build():
+    jobs = int(os.environ.get("BENCH_JOBS", "0"))
+    if jobs:
+        mem.Mem.instance().concurrency(jobs)
+    env = Env(CC=%(cc)r, CFLAGS=["-O2"], CPPPATH=[%(include)r],
+              BUILD_DIR="build").freeze()
+    objs = mem.subdir("src").build(env)
+    prog("app", objs, env=env)
+"""
+
+MEMFILE = """\
+import mem
+from mem.tasks.gcc import obj
+
+def build(env):
+    objs = obj(%(sources)r, env=env)
+    for d in %(subdirs)r:
+        objs += mem.subdir(d).build(env)
+    return objs
+"""
+
+
+def _write(path, data):
+    d = os.path.dirname(path)
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    f = open(path, "w")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
+def generate(root, files, headers, fanout=5, depth=3, branching=3, seed=0):
+    """write a project into root"""
+    rand = random.Random(seed)
+
+    cc = os.path.join(root, "fakecc")
+    _write(cc, "#!%s\n" % sys.executable +
+           open(os.path.join(HERE, "fakecc.py")).read())
+    os.chmod(cc, 0755)
+
+    include = os.path.join(root, "include")
+    for i in range(headers):
+        incs = rand.sample(range(i + 1, headers), min(2, headers - i - 1))
+        _write(os.path.join(include, "h%d.h" % i),
+               "".join('#include "h%d.h"\n' % j for j in incs) +
+               "int h%d(void);\n" % i)
+
+    # the tree of directories, breadth first
+    dirs = ["src"]
+    children = {}
+    level = ["src"]
+    for _ in range(depth - 1):
+        next_level = []
+        for d in level:
+            children[d] = ["d%d" % b for b in range(branching)]
+            next_level.extend(os.path.join(d, c) for c in children[d])
+        dirs.extend(next_level)
+        level = next_level
+
+    sources = dict((d, []) for d in dirs)
+    for i in range(files):
+        d = dirs[i % len(dirs)]
+        name = "f%d.c" % i
+        sources[d].append(name)
+        incs = rand.sample(range(headers), min(fanout, headers))
+        _write(os.path.join(root, d, name),
+               "".join('#include "h%d.h"\n' % j for j in incs) +
+               "int f%d(void) { return %d; }\n" % (i, i))
+
+    for d in dirs:
+        _write(os.path.join(root, d, "Memfile"),
+               MEMFILE % {"sources": sources[d],
+                          "subdirs": children.get(d, [])})
+    _write(os.path.join(root, "MemfileRoot"),
+           MEMFILE_ROOT % {"cc": cc, "include": include})
+
+
+def run_build(root, jobs):
+    """
+    run runmem in root, returns (seconds, the stats' totals), the
+    totals being None when the fast path skipped the build
+    """
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.pathsep.join(
+        [REPO] + filter(None, [env.get("PYTHONPATH")]))
+    env["BENCH_JOBS"] = str(jobs)
+    env["MEM_QUIET"] = "1"
+
+    start = time.time()
+    p = subprocess.Popen([sys.executable, RUNMEM, "--no-stats"], cwd=root,
+                         env=env, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT)
+    output = p.communicate()[0]
+    seconds = time.time() - start
+    if p.returncode != 0:
+        raise RuntimeError("build in %s failed:\n%s" % (root, output))
+    if FAST_PATH in output.splitlines():
+        return seconds, None
+
+    f = open(os.path.join(root, ".mem", "stats.json"))
+    try:
+        totals = json.load(f)["total"]
+    finally:
+        f.close()
+    return seconds, totals
+
+
+def _rmtree(path):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+
+def run_scenarios(root, jobs):
+    """time every scenario once, returns {scenario: (seconds, totals)}"""
+    times = {}
+    _rmtree(os.path.join(root, ".mem"))
+    _rmtree(os.path.join(root, "build"))
+    times["cold"] = run_build(root, jobs)
+    times["noop"] = run_build(root, jobs)
+
+    header = os.path.join(root, "include", "h0.h")
+    original = open(header).read()
+    _write(header, original + "/* touched */\n")
+    times["touch_header"] = run_build(root, jobs)
+    _write(header, original)
+
+    _rmtree(os.path.join(root, "build"))
+    times["restore"] = run_build(root, jobs)
+    return times
+
+
+def benchmark(files_list, jobs_list, headers, fanout, depth, branching,
+              repeat=1, keep=False, out=sys.stdout):
+    results = []
+    out.write("%6s %4s %-13s %9s %6s %6s\n" %
+              ("files", "jobs", "scenario", "seconds", "hits", "misses"))
+    row = "%6d %4d %-13s %9.3f %6s %6s\n"
+    for files in files_list:
+        root = tempfile.mkdtemp(prefix="mem-bench-")
+        try:
+            generate(root, files, headers, fanout, depth, branching)
+            for jobs in jobs_list:
+                best = {}
+                for _ in range(repeat):
+                    for scenario, run in run_scenarios(root, jobs).items():
+                        if (scenario not in best or
+                            run[0] < best[scenario][0]):
+                            best[scenario] = run
+                for scenario in SCENARIOS:
+                    seconds, totals = best[scenario]
+                    result = {"files": files, "headers": headers,
+                              "jobs": jobs, "scenario": scenario,
+                              "seconds": seconds,
+                              "fast_path": totals is None}
+                    if totals is None:
+                        result.update(hits=0, misses=0)
+                        out.write(row % (files, jobs, scenario, seconds,
+                                         "fast", "path"))
+                    else:
+                        result.update(
+                            hits=totals["hits"],
+                            misses=(totals["misses_new"] +
+                                    totals["misses_changed"]))
+                        out.write(row % (files, jobs, scenario, seconds,
+                                         result["hits"], result["misses"]))
+                    results.append(result)
+        finally:
+            if keep:
+                out.write("kept %s\n" % root)
+            else:
+                shutil.rmtree(root)
+    return results
+
+
+def _key(r):
+    return (r["files"], r["jobs"], r["scenario"])
+
+
+def compare(results, baseline, threshold, out=sys.stdout):
+    """print how results compare to baseline; returns the regressions"""
+    before = dict((_key(r), r) for r in baseline)
+    regressions = []
+    out.write("%6s %4s %-13s %9s %9s %6s\n" %
+              ("files", "jobs", "scenario", "baseline", "now", "ratio"))
+    for r in results:
+        b = before.get(_key(r))
+        if b is None:
+            continue
+        ratio = r["seconds"] / max(b["seconds"], 1e-6)
+        flag = ""
+        if ratio > threshold:
+            regressions.append(r)
+            flag = "  SLOWER"
+        out.write("%6d %4d %-13s %9.3f %9.3f %6.2f%s\n" %
+                  (r["files"], r["jobs"], r["scenario"], b["seconds"],
+                   r["seconds"], ratio, flag))
+    return regressions
+
+
+def _ints(option, opt, value, parser):
+    setattr(parser.values, option.dest, [int(v) for v in value.split(",")])
+
+
+def main(args):
+    parser = optparse.OptionParser(usage="synthetic.py [options]")
+    parser.add_option("--files", type="string", action="callback",
+                      callback=_ints, default=[100, 500],
+                      help="numbers of C files, comma separated")
+    parser.add_option("--jobs", type="string", action="callback",
+                      callback=_ints, default=[1, 4],
+                      help="Mem.concurrency() values, comma separated")
+    parser.add_option("--headers", type="int", default=50)
+    parser.add_option("--fanout", type="int", default=5,
+                      help="headers included by every C file")
+    parser.add_option("--depth", type="int", default=3,
+                      help="levels of mem.subdir() directories")
+    parser.add_option("--branching", type="int", default=3,
+                      help="subdirectories per directory")
+    parser.add_option("--repeat", type="int", default=1,
+                      help="run every build this often, keep the fastest")
+    parser.add_option("--output", metavar="FILE",
+                      help="write the results to FILE as JSON")
+    parser.add_option("--baseline", metavar="FILE",
+                      default=os.path.join(HERE, "baseline.json"))
+    parser.add_option("--save-baseline", action="store_true",
+                      help="store the results as the new baseline")
+    parser.add_option("--threshold", type="float", default=1.25,
+                      help="slowdown against the baseline that fails")
+    parser.add_option("--keep", action="store_true",
+                      help="don't delete the generated projects")
+    (options, args) = parser.parse_args(args)
+
+    results = benchmark(options.files, options.jobs, options.headers,
+                        options.fanout, options.depth, options.branching,
+                        options.repeat, options.keep)
+    data = {"python": sys.version.split()[0], "results": results}
+    if options.output:
+        _write(os.path.abspath(options.output), json.dumps(data, indent=1))
+
+    if options.save_baseline:
+        _write(options.baseline, json.dumps(data, indent=1))
+        return 0
+    if os.path.exists(options.baseline):
+        baseline = json.load(open(options.baseline))["results"]
+        if compare(results, baseline, options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
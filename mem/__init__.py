@@ -18,11 +18,14 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from __future__ import with_statement
+
+import optparse
 import os, sys
 
-import tasks, util, nodes
+import tasks, util, nodes, cachegc, trace, noop, buildclient
 
-from _mem import Mem
+from _mem import Mem, MEM_DIR, CODE_DIR
 
 import cPickle as pickle
 
@@ -41,6 +44,40 @@ def fail(*args, **kwargs):
 def inst():
     return Mem.instance()
 
+def _restore(o):
+    if (hasattr(o, "restore")):
+        o.restore()
+    elif (hasattr(o, "__iter__")):
+        for el in o:
+            _restore(el)
+
+def _lookup_or_run(mem, taskf, args, kwargs, tchash, span):
+    deps = None
+    try:
+        deps = mem._load_deps(tchash)
+        if not mem._validate_deps(deps):
+            # a dependency is gone, no need to look any further
+            raise KeyError(tchash)
+        rhash = mem.get_hash(tchash, deps)
+        result = mem._load_result(rhash)
+
+        _restore(result)
+        mem.store.touch("deps", tchash)
+        mem.store.touch("results", rhash)
+        mem._remember(tchash, deps, result)
+
+        mem.deps_stack().add_deps_if_in_memoize(deps)
+        span["cache"] = "hit"
+        mem.count("hits")
+        return result
+    except (KeyError, IOError):
+        span["cache"] = "miss"
+        if deps is None:
+            mem.count("misses_new")
+        else:
+            mem.count("misses_changed")
+        return mem._run_task(taskf, args, kwargs, tchash)
+
 # TODO: this function uses private functions from mem, but
 # must be outside of mem to be used as a decorator even before
 # the mem singleton was created.
@@ -49,33 +86,38 @@ def memoize(taskf):
         mem = Mem.instance()
         if mem is None:
             raise RuntimeError("Mem Singleton has not yet been created")
+        if mem.dry_run is not None:
+            return mem.dry_run.query(taskf, args, kwargs)
 
-        tchash = mem.get_hash(taskf.__name__, taskf.__module__,
-                               args, kwargs)
+        outer = mem._enter_task(taskf.__name__)
         try:
-            f = open(mem._deps_path(tchash), "rb")
-            deps = pickle.load(f)
-            f.close()
-
-            f = open(mem._results_path(mem.get_hash(tchash, deps)), "rb")
-            result = pickle.load(f)
-            f.close()
-
-            def restore(o):
-                if (hasattr(o, "restore")):
-                    o.restore()
-                elif (hasattr(o, "__iter__")):
-                    for el in o:
-                        restore(el)
-
-            restore(result)
-
-            mem.deps_stack().add_deps_if_in_memoize(deps)
-            return result
-        except IOError:
-            return mem._run_task(taskf, args, kwargs, tchash)
+            with trace.span(taskf.__name__, "task",
+                            target=args and args[0] or "") as span:
+                mem.count("lookups")
+                tchash = mem.get_hash(taskf.__name__, taskf.__module__,
+                                      args, kwargs)
+                try:
+                    (deps, result) = mem._begin_call(tchash)
+                except KeyError:
+                    pass
+                else:
+                    # the same call was already done during this build
+                    _restore(result)
+                    mem.deps_stack().add_deps_if_in_memoize(deps)
+                    span["cache"] = "done"
+                    mem.count("hits")
+                    return result
+
+                try:
+                    return _lookup_or_run(mem, taskf, args, kwargs, tchash,
+                                          span)
+                finally:
+                    mem._end_call(tchash)
+        finally:
+            mem._leave_task(outer)
 
     f.__module__ = taskf.__module__
+    f.__name__ = taskf.__name__
     return f
 
 
@@ -83,6 +125,14 @@ def subdir(*args, **kwargs):
     return Mem.instance().subdir(*args, **kwargs)
 
 
+def subdirs(*args, **kwargs):
+    return Mem.instance().subdirs(*args, **kwargs)
+
+
+def path(p):
+    return Mem.instance().path(p)
+
+
 def _find_root():
     d = os.path.abspath(os.curdir)
     while (not os.path.exists(os.path.join(d, "MemfileRoot"))):
@@ -93,32 +143,111 @@ def _find_root():
     return d
 
 # TODO: stupid name, rename this function!
-def do_build(root, build_callable):
+def do_build(root, build_callable, dry_run=False):
     os.chdir(root)
     mem = Mem(root)
+    if dry_run:
+        import dryrun
+        mem.dry_run = dryrun.Report(mem)
     try:
-        build_callable()
-    except KeyboardInterrupt:
-        print "-" * 50
-        print "build interrupted."
+        try:
+            build_callable()
+        except KeyboardInterrupt:
+            print "-" * 50
+            print "build interrupted."
+            mem.abort()
+    finally:
+        mem.finish()
+    return mem
 
 def import_memfile(f):
     return util.import_module(f, f)
 
+def _load_root(root):
+    util.code_cache = util.CodeCache(os.path.join(root, MEM_DIR, CODE_DIR))
+    mfr_mod = import_memfile(root + os.path.sep + "MemfileRoot")
+    sys.modules["MemfileRoot"] = mfr_mod
+    return mfr_mod
+
+def _option_parser():
+    parser = optparse.OptionParser(usage="runmem [options]")
+    parser.add_option("--trace", metavar="FILE",
+                      help="write a timeline of the build to FILE, in "
+                      "Chrome's trace event format")
+    parser.add_option("--no-stats", dest="stats", action="store_false",
+                      default=True,
+                      help="don't print cache statistics at the end (they "
+                      "are still saved in .mem/stats.json)")
+    parser.add_option("--no-fast-path", dest="fast_path",
+                      action="store_false", default=True,
+                      help="run build() even if nothing changed since the "
+                      "last build")
+    parser.add_option("--watch", action="store_true", default=False,
+                      help="stay around after the build and build again "
+                      "whenever one of the files it used changes")
+    parser.add_option("--no-server", dest="server", action="store_false",
+                      default=True,
+                      help="build in this process even if a build server "
+                      "is running")
+    parser.add_option("--dry-run", action="store_true", default=False,
+                      help="don't build, only tell which tasks would run "
+                      "and why")
+    return parser
+
 def main():
+    util.kill_processes_on_exit()
+    if sys.argv[1:2] == ["gc"]:
+        sys.exit(cachegc.main(_find_root(), sys.argv[2:]))
+    if sys.argv[1:2] == ["cache-server"]:
+        import cacheserver
+        sys.exit(cacheserver.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["build-server"]:
+        import buildserver
+        sys.path.append("./")
+        root = _find_root()
+        sys.exit(buildserver.main(root, sys.argv[2:], _option_parser(),
+                                  lambda: _load_root(root)))
+
+    parser = _option_parser()
+    (options, args) = parser.parse_args(sys.argv[1:])
+    if options.dry_run and options.watch:
+        parser.error("--dry-run and --watch don't go together")
+
     sys.path.append("./")
     root = _find_root()
-    mfr_mod = import_memfile(root + os.path.sep + "MemfileRoot")
-    sys.modules["MemfileRoot"] = mfr_mod
-    
-    # classes's __module__ will help tell us where we're installed
-    class WhereAreWe:
-        pass
-
-    mem_dir = os.path.dirname(sys.modules[WhereAreWe.__module__].__file__)
-    for f in os.listdir(os.path.join(mem_dir, "tasks")):
-        if not f.endswith(".py"):
-            continue
-        __import__("mem.tasks." + f[:-2])
-
-    do_build(root, mfr_mod.build)
+    if options.server and not options.watch and not options.dry_run:
+        code = buildclient.forward(root, sys.argv[1:])
+        if code is not None:
+            sys.exit(code)
+    mem_dir = os.path.join(root, MEM_DIR)
+    # a dry run leaves everything as it is, the fast path's manifest too
+    if not options.dry_run:
+        if options.fast_path and not options.trace and not options.watch:
+            if noop.unchanged(mem_dir, sys.argv[1:]):
+                print "nothing changed since the last build."
+                sys.exit(0)
+        noop.forget(mem_dir)
+    if not options.watch:
+        mfr_mod = _load_root(root)
+
+    if options.trace:
+        trace.start(os.path.abspath(options.trace))
+    try:
+        if options.watch:
+            import watch
+            sys.exit(watch.run(root, lambda: _load_root(root),
+                               sys.argv[1:], options.stats))
+        mem = do_build(root, mfr_mod.build, options.dry_run)
+    finally:
+        trace.stop()
+    if options.dry_run:
+        print "-" * 50
+        mem.dry_run.write()
+        sys.exit(mem.failed and 1 or 0)
+    if not mem.failed:
+        noop.record(mem, sys.argv[1:], util.imported_files)
+    if options.stats:
+        print "-" * 50
+        print mem.stats.table()
+    if mem.failed:
+        sys.exit(1)
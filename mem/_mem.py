@@ -18,6 +18,8 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from __future__ import with_statement
+
 import tasks
 
 import os
@@ -26,21 +28,28 @@ import sys
 
 import cPickle as pickle
 from cpu_count import cpu_count
-import hashlib
 import imp
 import os
 import sys
-import types
+import time
 
-import util, nodes
+import util, nodes, hashing, hashcache, durations, store, cachegc, blob
+import executor, trace, stats, jobserver
 
+import thread
 import threading
 
 
 MEM_DIR = ".mem"
-DEPS_DIR = "deps"
-RESULTS_DIR = "results"
 BLOB_DIR = "blob"
+CODE_DIR = "code"
+LOG_DIR = "logs"
+HASH_CACHE_FILE = "hashcache"
+DURATIONS_FILE = "durations"
+STATS_FILE = "stats.json"
+
+# the priority of submitted tasks that never ran before
+UNKNOWN_DURATION = float("inf")
 
 class DepsStack(object):
     def __init__(self):
@@ -67,6 +76,21 @@ class DepsStack(object):
         if len(self.deps) > 0:
             self.add_deps(ds)
 
+def _collect_files(o, found):
+    """
+    Add the Files in o, a deps list or a result, to found. Returns
+    False if o holds any other kind of node.
+    """
+    if isinstance(o, nodes.File):
+        found.add(str(o))
+    elif hasattr(o, "get_hash") or hasattr(o, "restore"):
+        return False
+    elif hasattr(o, "__iter__"):
+        for el in o:
+            if not _collect_files(el, found):
+                return False
+    return True
+
 class Singleton(object):
     """Singleton Pattern, straightforward implementation"""
 
@@ -84,6 +108,9 @@ class Singleton(object):
         Delete this Singleton object, allowing a new Singleton to be created.
         This is useful in testing
         """
+        it = cls.__dict__.get("__it__")
+        if getattr(it, "jobserver", None) is not None:
+            it.jobserver.close()
         del cls.__it__
         cls.__it__ = None
 
@@ -92,6 +119,7 @@ class Singleton(object):
         # build class would also hold File caches (via a reflector class
         # or similar). All those globals make me a bit sick.
         nodes.File._hash_cache = {}
+        nodes.File._hashing = {}
 
     @classmethod
     def instance(cls):
@@ -100,64 +128,290 @@ class Singleton(object):
     def init(self, *args, **kwds):
         pass
 
+class Subdir(object):
+    """
+    The Memfile of a subdir; its functions are called with the subdir
+    as the current directory (Mem.cwd) of the calling thread.
+    """
+    def __init__(self, mem, subdir, memfile="Memfile"):
+        def set_attr(attr, val):
+            object.__setattr__(self, attr, val)
+        set_attr("mem", mem)
+        set_attr("subdir", mem.path(subdir))
+        set_attr("memfile", os.path.join(self.subdir, memfile))
+        set_attr("mf", self._in_subdir(util.import_memfile, self.memfile))
+
+    def _in_subdir(self, f, *args, **kwargs):
+        outer = self.mem.cwd
+        self.mem.cwd = self.subdir
+        try:
+            return f(*args, **kwargs)
+        finally:
+            self.mem.cwd = outer
+
+    def __getattr__(self, memfunc):
+        if memfunc not in self.mf.__dict__:
+            raise AttributeError(
+                "requested method '%s()' doesn't exist in %s" %
+                (memfunc, self.memfile))
+        def f(*args, **kwargs):
+            return self._in_subdir(self.mf.__dict__[memfunc],
+                                   *args, **kwargs)
+        f.__name__ = memfunc
+        f.__module__ = self.memfile
+        return f
+
+    def __setattr__(self, attr, val):
+        setattr(self.mf, attr, val)
+
+
+class Subdirs(object):
+    """Subdir for many at once, see Mem.subdirs()"""
+    def __init__(self, mem, subdirs):
+        self.mem = mem
+        self.subdirs = subdirs
+
+    def __getattr__(self, memfunc):
+        funcs = [getattr(s, memfunc) for s in self.subdirs]
+        def f(*args, **kwargs):
+            return self.mem.gather([self.mem.submit(g, *args, **kwargs)
+                                    for g in funcs])
+        f.__name__ = memfunc
+        return f
+
+
 class Mem(Singleton):
-    def __init__(self, root):
+    def __init__(self, root, backend=None):
         self.root = root
-        self.cwd = root
 
         memdir = os.path.join(root, MEM_DIR)
         if not os.path.exists(memdir):
             os.mkdir(memdir)
+        self.mem_dir = memdir
 
-        self.deps_dir = os.path.join(memdir, DEPS_DIR)
-        self.results_dir = os.path.join(memdir, RESULTS_DIR)
+        self.store = backend or store.open_store(memdir)
         self.blob_dir = os.path.join(memdir, BLOB_DIR)
 
-        self.thread_limit = threading.Semaphore(cpu_count() * 2)
+        self.hash_cache = hashcache.HashCache(
+            os.path.join(memdir, HASH_CACHE_FILE))
+
+        self.gc_policy(os.environ.get("MEM_GC_MAX_BYTES"),
+                       os.environ.get("MEM_GC_MAX_AGE"))
+        self.blob_compression(os.environ.get("MEM_BLOB_CODEC"),
+                              os.environ.get("MEM_BLOB_MIN_SIZE",
+                                             blob.DEFAULT_MIN_COMPRESS_SIZE))
+        self.remote = None
+        # blobs downloaded from the remote cache; a file restored from
+        # one is checked against its hash, see verify_restored()
+        self.remote_blobs = set()
+        if os.environ.get("MEM_REMOTE_CACHE"):
+            self.remote_cache(os.environ["MEM_REMOTE_CACHE"])
+
+        self.executor = executor.Executor(cpu_count() * 2)
+        self.durations = durations.Durations(
+            os.path.join(memdir, DURATIONS_FILE))
+        self.stats = stats.Stats()
         self.local = threading.local()
 
+        self.hash_pool = None
+        self.hash_pool_lock = threading.Lock()
+
+        # memoized calls done during this build, and the ones in flight
+        self.calls = {}
+        self.calls_inflight = {}
+        self.calls_lock = threading.Lock()
+
         self.failed = False
+        # whether a subprocess ran outside of all memoized calls, see
+        # noop.record()
+        self.unmemoized_processes = False
+        # the dryrun.Report while doing a dry run
+        self.dry_run = None
+
+        self.jobserver = None
+        self.jobserver_lock = threading.Lock()
+
+    def _get_cwd(self):
+        return getattr(self.local, "cwd", self.root)
+
+    def _set_cwd(self, cwd):
+        self.local.cwd = cwd
+
+    # the directory relative paths are taken from; it is per thread so
+    # that Memfiles of several subdirs can be evaluated at once, the
+    # process's own cwd stays at the root
+    cwd = property(_get_cwd, _set_cwd)
+
+    def path(self, p):
+        """p relative to the current directory (cwd) of this thread"""
+        return os.path.join(self.cwd, p)
 
     def concurrency(self, threads):
         if (threads > 0):
-            self.thread_limit = threading.Semaphore(threads)
-
-
-    def subdir(self, *args, **kwargs):
-        class Subdir(object):
-            """
-            Import's the Memfile in subdir and return a wrapper that
-            allows methods on it to be called.
-            """
-            def __init__(self, mem, subdir, memfile="Memfile"):
-                def set_attr(attr, val):
-                    object.__setattr__(self, attr, val)
-                set_attr("mem", mem)
-                set_attr("orig_dir", os.path.abspath(os.curdir))
-                set_attr("subdir", os.path.join(self.orig_dir, subdir))
-                set_attr("memfile", os.path.join(self.subdir, memfile))
-                set_attr("mf", util.import_module(self.memfile, self.memfile))
-
-            def __getattr__(self, memfunc):
-                if memfunc not in self.mf.__dict__:
-                    raise AttributeError(
-                        "requested method '%s()' doesn't exist in %s" %
-                        (memfunc, os.path.join(self.orig_dir, self.memfile)))
-                def f(*args, **kwargs):
-                    os.chdir(self.subdir)
-                    self.mem.cwd = self.subdir
-                    try:
-                        result = self.mf.__dict__[memfunc](*args, **kwargs)
-                    finally:
-                        os.chdir(self.orig_dir)
-                        self.mem.cwd = self.orig_dir
-                    return result
-                return f
-
-            def __setattr__(self, attr, val):
-                setattr(self.mf, attr, val)
-
-        return Subdir(self, *args, **kwargs)
+            self.executor.resize(threads)
+            with self.jobserver_lock:
+                if self.jobserver is not None:
+                    self.jobserver.resize(self.executor.workers)
+
+    def get_jobserver(self):
+        """
+        The jobserver every subprocess takes a token from: make's when
+        runmem runs from make, otherwise our own for as many jobs as
+        there are workers; concurrency() resizes it.
+        """
+        with self.jobserver_lock:
+            if self.jobserver is None:
+                self.jobserver = (jobserver.from_environ(os.environ) or
+                                  jobserver.create(self.executor.workers))
+            return self.jobserver
+
+    def submit(self, task, *args, **kwargs):
+        """
+        Run task(*args, **kwargs) on the worker pool; returns a future
+        whose result() waits for it (see executor.py).
+
+        Tasks that took longest last time start first, as they most
+        likely are (or lead) the longest chain of the build. Tasks that
+        never ran go before all of them, nothing is known about them.
+        """
+        key = durations.task_key(task, args)
+        estimate = self.durations.get(key)
+        if estimate is None:
+            estimate = UNKNOWN_DURATION
+        return self.executor.submit_prioritized(
+            estimate, self._run_submitted, task, args, kwargs, key,
+            time.time(), self.cwd)
+
+    def gather(self, futures):
+        """wait for all the futures, returns their results in order"""
+        return self.executor.gather(futures)
+
+    def _run_submitted(self, task, args, kwargs, key, submitted, cwd):
+        if self.failed:
+            sys.exit(1)
+        self.count("wait_time", time.time() - submitted, task.__name__)
+        # like a thread of its own, a task starts with empty deps, but
+        # in the directory of whoever submitted it
+        outer = getattr(self.local, "deps_stack", None)
+        self.local.deps_stack = DepsStack()
+        outer_cwd = self.cwd
+        self.cwd = cwd
+        runs = self._task_runs()
+        start = time.time()
+        try:
+            result = task(*args, **kwargs)
+        finally:
+            self.cwd = outer_cwd
+            if outer is None:
+                del self.local.deps_stack
+            else:
+                self.local.deps_stack = outer
+        # all cache hits take no time and tell nothing about next time
+        if self._task_runs() > runs:
+            self.durations.record(key, time.time() - start)
+        return result
+
+    def current_task(self):
+        """the name of the memoized function this thread is in"""
+        return getattr(self.local, "task", stats.NO_TASK)
+
+    def _enter_task(self, name):
+        """make name the current task; returns the one to go back to"""
+        outer = self.current_task()
+        self.local.task = name
+        return outer
+
+    def _leave_task(self, outer):
+        self.local.task = outer
+
+    def count(self, field, value=1, task=None):
+        """add to a counter of the current task (or task), see stats.py"""
+        self.stats.add(task or self.current_task(), field, value)
+
+    def _task_runs(self):
+        """how many memoized tasks this thread has really run"""
+        return getattr(self.local, "task_runs", 0)
+
+    def gc_policy(self, max_bytes=None, max_age=None):
+        """
+        Collect garbage at the end of every build: keep the blob store
+        below max_bytes (eg 1 << 30 or "1G") and drop whatever wasn't
+        used within max_age (seconds or eg "30d"). Each build spends at
+        most cachegc.AUTO_TIME_LIMIT seconds on this.
+        """
+        self.gc_max_bytes = cachegc.parse_size(max_bytes)
+        self.gc_max_age = cachegc.parse_age(max_age)
+
+    def blob_compression(self, codec, min_size=blob.DEFAULT_MIN_COMPRESS_SIZE):
+        """
+        Compress files put into the blob store with codec ("zlib",
+        "bz2" or, if available, "lzma"; None turns compression off).
+        Files smaller than min_size bytes are stored as they are.
+        """
+        if codec and codec not in blob.CODECS:
+            raise ValueError("unknown blob codec '%s', choose from %s" %
+                             (codec, ", ".join(sorted(blob.CODECS))))
+        self.blob_codec = codec or None
+        self.blob_min_size = cachegc.parse_size(min_size)
+
+    def remote_cache(self, url, jobs=None, secret=None):
+        """
+        Share results with other machines through the remote cache at
+        url (see remote.py). Misses are looked up there, and whatever
+        this build produces is uploaded in the background. Only entries
+        signed with the shared key secret (default: $MEM_REMOTE_KEY)
+        are trusted.
+        """
+        # httplib takes a while to load, builds without a remote cache
+        # shouldn't wait for it
+        import remote
+        if jobs is None:
+            jobs = remote.DEFAULT_JOBS
+        if secret is None:
+            secret = remote.key_from_environ()
+        self.remote = remote.RemoteCache(url, secret, jobs)
+
+    def finish(self):
+        """
+        Write out the state that should survive this build. Called once
+        the build is done, whether it succeeded or not.
+        """
+        self.hash_cache.save()
+        if self.dry_run is None:
+            # a build cut short may not have seen all of its tasks
+            self.durations.save(prune=not self.failed)
+            self.stats.save(os.path.join(self.mem_dir, STATS_FILE))
+        self.executor.shutdown()
+        if self.hash_pool is not None:
+            self.hash_pool.close()
+            self.hash_pool = None
+        if self.remote is not None:
+            self.remote.wait()
+        # the stamps of what this build used go in first, so that the
+        # collection sees them as the most recently used
+        self.store.flush()
+        if self.dry_run is None and (self.gc_max_bytes is not None or
+                                     self.gc_max_age is not None):
+            cachegc.collect(self, self.gc_max_bytes, self.gc_max_age,
+                            time_limit=cachegc.AUTO_TIME_LIMIT)
+
+
+    def subdir(self, subdir, memfile="Memfile"):
+        """
+        Import the Memfile in subdir (relative to the current directory)
+        and return a wrapper that allows methods on it to be called.
+        """
+        return Subdir(self, subdir, memfile)
+
+    def subdirs(self, subdirs, memfile="Memfile"):
+        """
+        subdir() for several directories at once: their Memfiles are
+        imported concurrently, and calling a method on the result calls
+        it in every one of them concurrently, on the worker pool,
+        returning the list of their results.
+        """
+        futures = [self.submit(self.subdir, d, memfile) for d in subdirs]
+        return Subdirs(self, self.gather(futures))
 
 
     def fail(self, msg=None):
@@ -170,16 +424,18 @@ class Mem(Singleton):
         else:
             sys.stderr.write("build failed.\n")
 
-        self.failed = True
-
-        # Make sure all possible threads get released
-        if not self.thread_limit == None:
-            tmp = threading.activeCount()
-            for _ in range(tmp):
-                self.thread_limit.release()
-
+        self.abort()
         sys.exit(1)
 
+    def abort(self):
+        """
+        End the build as quickly as possible: the tasks still queued
+        don't start anymore and all running subprocesses get killed.
+        """
+        self.failed = True
+        self.executor.cancel()
+        util.kill_processes()
+
     def deps_stack(self):
         try:
             return self.local.deps_stack
@@ -194,48 +450,170 @@ class Mem(Singleton):
         self.deps_stack().add_deps(ds)
 
     def get_hash(self, *o):
-        def gh(objs):
-            if hasattr(objs, "get_hash"):
-                return objs.get_hash()
-            elif isinstance(objs, types.ModuleType):
-                return nodes.File(objs.__file__).get_hash()
-            elif hasattr(objs, "__iter__"):
-                if isinstance(objs, dict):
-                    return "\1" + "\0".join([gh(k) + "\3" + gh(objs[k])
-                                             for k in objs])
-                else:
-                    return "\1" + "\0".join([gh(obj) for obj in objs]) + "\1"
-            elif isinstance(objs, types.MethodType):
-                return ("\4%s\0%s\0%s" %
-                        (objs.__func__.__name__,
-                         objs.__module__,
-                         nodes.File(
-                            sys.modules[objs.__module__].__file__).get_hash()))
-            elif isinstance(objs, (types.FunctionType, types.TypeType)):
-                return ("\4%s\0%s\0%s" %
-                        (objs.__name__,
-                         objs.__module__,
-                         nodes.File(
-                            sys.modules[objs.__module__].__file__).get_hash()))
-            elif isinstance(objs, util.AutoHashable):
-                return "\5" + "\0".join([gh(getattr(objs, a))
-                                         for a in dir(objs)
-                                         if not a.startswith("__")])
-            elif isinstance(objs, (types.BuiltinMethodType,
-                                   types.BuiltinFunctionType,
-                                   self.__delattr__.__class__)):
-                return objs.__name__
-            else:
-                return pickle.dumps(objs, 2)
-        return hashlib.sha1(gh(o)).hexdigest()
+        return hashing.digest(o)
 
-    def _deps_path(self, tchash):
-        return os.path.join(self.deps_dir, tchash[:2], tchash[2:])
+    def _begin_call(self, tchash):
+        """
+        Return (deps, result) of the memoized call tchash if it was
+        already done during this build; if another thread is doing it
+        right now, wait for it. Otherwise raise KeyError: the caller
+        has to do the call itself and then call _end_call().
+        """
+        while True:
+            with self.calls_lock:
+                try:
+                    return self.calls[tchash]
+                except KeyError:
+                    pass
+                (done, owner) = self.calls_inflight.get(tchash, (None, None))
+                if done is None:
+                    self.calls_inflight[tchash] = (threading.Event(),
+                                                   thread.get_ident())
+                    raise KeyError(tchash)
+                if owner == thread.get_ident():
+                    raise RuntimeError("memoized call calls itself with "
+                                       "the same arguments")
+            # the owner may need our slot to finish
+            self.executor.wait_for(done)
+            if self.failed:
+                sys.exit(1)
+
+    def _end_call(self, tchash):
+        with self.calls_lock:
+            (done, owner) = self.calls_inflight.pop(tchash)
+        done.set()
+
+    def _remember(self, tchash, deps, result):
+        with self.calls_lock:
+            self.calls[tchash] = (deps, result)
+
+    def invalidate(self, paths):
+        """
+        Forget what this build learned about the files in paths: their
+        hashes and every memoized call that depends on or produced one
+        of them, so that the next build() in this process looks at
+        those again while all other calls count as done. Calls that
+        involve nodes other than Files are always forgotten, there is
+        no telling whether those changed. Returns how many calls were
+        forgotten.
+        """
+        paths = set(paths)
+        for p in paths:
+            nodes.File._hash_cache.pop(p, None)
+        dropped = 0
+        with self.calls_lock:
+            for tchash, (deps, result) in self.calls.items():
+                files = set()
+                if (not _collect_files(deps, files) or
+                    not _collect_files(result, files) or
+                    not files.isdisjoint(paths)):
+                    del self.calls[tchash]
+                    dropped += 1
+        return dropped
+
+    def rebuild(self):
+        """start another build with the same Mem, see watch.py"""
+        self.failed = False
+        self.unmemoized_processes = False
+        self.stats = stats.Stats()
 
-    def _results_path(self, rhash):
-        return os.path.join(self.results_dir, rhash[:2], rhash[2:])
+    def _get_hash_pool(self):
+        with self.hash_pool_lock:
+            if self.hash_pool is None:
+                from multiprocessing.pool import ThreadPool
+                self.hash_pool = ThreadPool(cpu_count())
+            return self.hash_pool
+
+    def _validate_deps(self, deps):
+        """
+        Hash the files among deps that weren't hashed yet, in parallel.
+        Returns False as soon as one of them turns out to be gone, as
+        that rules out a cache hit.
+
+        A changed file doesn't: the result for its current content may
+        be in the cache from an earlier build (think switching back and
+        forth between branches).
+        """
+        cached = nodes.File._hash_cache
+        files = [d for d in deps
+                 if isinstance(d, nodes.File) and d not in cached]
+        if len(files) < 2:
+            return True
+        task = self.current_task()
+        def get_hash(f):
+            outer = self._enter_task(task)
+            try:
+                return f.get_hash()
+            finally:
+                self._leave_task(outer)
+
+        with trace.span("hash batch", "hash", files=len(files)):
+            for h in self._get_hash_pool().imap_unordered(get_hash, files):
+                if h == nodes.NOT_FOUND:
+                    return False
+        return True
+
+    def _blob_path(self, h):
+        return os.path.join(self.blob_dir, h[:2], h[2:])
+
+    def _fetch(self, kind, key):
+        """get an entry from the store, or from the remote cache"""
+        try:
+            return self.store.get(kind, key)
+        except KeyError:
+            if self.remote is None:
+                raise
+        data = self.remote.get(kind, key)
+        self.store.put(kind, key, data)
+        return data
+
+    def _fetch_blobs(self, hashes):
+        """make sure the blobs are here, downloading them in parallel"""
+        if self.remote is None:
+            return
+        missing = [(h, self._blob_path(h)) for h in hashes
+                   if not os.path.exists(self._blob_path(h))]
+        for h in self.remote.fetch_blobs(missing):
+            self.store.put("blobs", h,
+                           str(os.path.getsize(self._blob_path(h))))
+            self.remote_blobs.add(h)
+
+    def verify_restored(self, f):
+        """
+        Raise IOError if File f, which was just restored, came from a
+        blob of the remote cache and doesn't have the content it should.
+        The blob is gone then, and so is f.
+        """
+        h = f._hash
+        if h not in self.remote_blobs:
+            return
+        if nodes.hash_contents(f, os.stat(f)) != h:
+            for path in (f, self._blob_path(h)):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            self.store.delete("blobs", h)
+            raise IOError("%s: the blob %s from the remote cache is corrupt" %
+                          (f, h))
+        self.remote_blobs.discard(h)
+
+    def _load_deps(self, tchash):
+        return pickle.loads(self._fetch("deps", tchash))
+
+    def _load_result(self, rhash):
+        try:
+            data = self.store.get("results", rhash)
+        except KeyError:
+            data = self._fetch("results", rhash)
+            try:
+                self._fetch_blobs(self._fetch("refs", rhash).split())
+            except KeyError:
+                pass
+        return pickle.loads(data)
 
     def _run_task(self, taskf, args, kwargs, tchash):
+        self.local.task_runs = self._task_runs() + 1
         self.deps_stack().call_start(self, taskf)
         result = taskf(*args, **kwargs)
         if self.failed:
@@ -243,26 +621,30 @@ class Mem(Singleton):
 
         deps = self.deps_stack().call_finish()
 
+        refs = []
         def store(o):
             if (hasattr(o, "store")):
-                o.store()
+                blob = o.store()
+                if blob:
+                    refs.append(blob)
             elif (hasattr(o, "__iter__")):
                 for el in o:
                     store(el)
 
         store(result)
 
-        fp = self._deps_path(tchash)
-        util.ensure_file_dir(fp)
-        f = open(fp, "wb")
-        pickle.dump(deps, f)
-        f.close()
-
-        fp = self._results_path(self.get_hash(tchash, deps))
-        util.ensure_file_dir(fp)
-        f = open(fp, "wb")
-        pickle.dump(result, f)
-        f.close()
+        rhash = self.get_hash(tchash, deps)
+        entries = [("refs", rhash, " ".join(refs)),
+                   ("results", rhash, pickle.dumps(result)),
+                   ("deps", tchash, pickle.dumps(deps))]
+        for kind, key, data in entries:
+            self.store.put(kind, key, data)
+
+        if self.remote is not None:
+            self.remote.upload([(h, self._blob_path(h)) for h in refs],
+                               entries)
+
+        self._remember(tchash, deps, result)
 
         return result
 
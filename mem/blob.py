@@ -0,0 +1,301 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Moving file contents in and out of the blob store.
+
+Copying every output into the store and back out again through Python
+buffers gets expensive for big files, so materialize() tries a list of
+cheaper strategies first:
+
+reflink   a copy-on-write clone (FICLONE); instant on btrfs, xfs, ...
+hardlink  share the inode; only ever done for files nobody may write
+          to, since writing to one would change the other
+kernel    let the kernel copy (copy_file_range(2), then sendfile(2))
+copy      plain read/write
+
+reflink and kernel are only tried on POSIX systems.
+
+Blobs can also be stored compressed (see store()). A compressed blob
+starts with a header naming its codec; blobs without one are plain
+copies of the file, so stores with mixed blobs keep working.
+"""
+
+import bz2
+import errno
+import os
+import shutil
+import stat
+import thread
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+import util
+
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+KERNEL = "kernel"
+COPY = "copy"
+
+DEFAULT_STRATEGIES = (REFLINK, HARDLINK, KERNEL, COPY)
+
+# these need fcntl and a libc
+_POSIX_ONLY = (REFLINK, KERNEL)
+
+# from linux/fs.h
+_FICLONE = 0x40049409
+
+_CHUNK = 1 << 20
+
+MAGIC = "\0MEMBLOB\0"
+
+# files smaller than this aren't worth compressing
+DEFAULT_MIN_COMPRESS_SIZE = 16 << 10
+
+CODECS = {
+    "zlib": (lambda: zlib.compressobj(6), zlib.decompressobj),
+    "bz2": (bz2.BZ2Compressor, bz2.BZ2Decompressor),
+}
+if lzma is not None:
+    CODECS["lzma"] = (lzma.LZMACompressor, lzma.LZMADecompressor)
+
+
+def _reflink(src, dst):
+    import fcntl
+    fsrc = open(src, "rb")
+    try:
+        fdst = open(dst, "wb")
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        finally:
+            fdst.close()
+    finally:
+        fsrc.close()
+
+
+def _hardlink(src, dst):
+    os.link(src, dst)
+
+
+_libc = None
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        import ctypes, ctypes.util
+        name = ctypes.util.find_library("c")
+        if name is None:
+            raise OSError(errno.ENOENT, "no libc found")
+        _libc = ctypes.CDLL(name, use_errno=True)
+    return _libc
+
+
+def _kernel_copy(src, dst):
+    import ctypes
+    libc = _get_libc()
+    size = os.path.getsize(src)
+    fsrc = open(src, "rb")
+    try:
+        fdst = open(dst, "wb")
+        try:
+            (ifd, ofd) = (fsrc.fileno(), fdst.fileno())
+            if hasattr(libc, "copy_file_range"):
+                call = lambda n: libc.copy_file_range(ifd, None, ofd, None,
+                                                      ctypes.c_size_t(n), 0)
+            else:
+                call = lambda n: libc.sendfile(ofd, ifd, None,
+                                               ctypes.c_size_t(n))
+
+            left = size
+            while left > 0:
+                n = call(min(left, 1 << 30))
+                if n < 0:
+                    e = ctypes.get_errno()
+                    raise OSError(e, os.strerror(e))
+                if n == 0:
+                    break
+                left -= n
+            if left > 0:
+                raise IOError("short copy of %s" % src)
+        finally:
+            fdst.close()
+    finally:
+        fsrc.close()
+
+
+def _copy(src, dst):
+    fsrc = open(src, "rb")
+    try:
+        fdst = open(dst, "wb")
+        try:
+            shutil.copyfileobj(fsrc, fdst, _CHUNK)
+        finally:
+            fdst.close()
+    finally:
+        fsrc.close()
+
+
+_STRATEGIES = {
+    REFLINK: _reflink,
+    HARDLINK: _hardlink,
+    KERNEL: _kernel_copy,
+    COPY: _copy,
+}
+
+
+def is_read_only(path):
+    return not (os.stat(path).st_mode &
+                (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _tmp_name(dst):
+    return "%s.%d.%d.tmp" % (dst, os.getpid(), thread.get_ident())
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def materialize(src, dst, strategies=DEFAULT_STRATEGIES, new_mtime=True):
+    """
+    Make dst a file with the content and mode of src, using the first
+    of strategies that works. Hard links are only used if src is read
+    only. With new_mtime dst is guaranteed to look freshly written,
+    even when it shares its inode with src.
+
+    dst is replaced atomically; returns the strategy that was used.
+    """
+    util.ensure_file_dir(dst)
+    tmp = _tmp_name(dst)
+    for strategy in strategies:
+        if strategy == HARDLINK and not is_read_only(src):
+            continue
+        if strategy in _POSIX_ONLY and os.name != "posix":
+            continue
+        try:
+            _STRATEGIES[strategy](src, tmp)
+        except (IOError, OSError, AttributeError, ImportError):
+            _unlink(tmp)
+            continue
+
+        if strategy == HARDLINK:
+            if new_mtime:
+                os.utime(tmp, None)
+        else:
+            shutil.copymode(src, tmp)
+        os.rename(tmp, dst)
+        return strategy
+
+    raise IOError(errno.EIO, "could not copy %s to %s" % (src, dst))
+
+
+def codec_of(path):
+    """return the codec a blob was compressed with, None if it wasn't"""
+    f = open(path, "rb")
+    try:
+        header = f.read(len(MAGIC) + 16)
+    finally:
+        f.close()
+    if not header.startswith(MAGIC) or "\n" not in header:
+        return None
+    return header[len(MAGIC):header.index("\n")]
+
+
+def _transcode(src, dst, coder, header="", skip=0):
+    """stream src through coder into dst, chunk by chunk"""
+    tmp = _tmp_name(dst)
+    fsrc = open(src, "rb")
+    try:
+        fdst = open(tmp, "wb")
+        try:
+            fdst.write(header)
+            fsrc.seek(skip)
+            data = fsrc.read(_CHUNK)
+            while data != "":
+                fdst.write(coder(data))
+                data = fsrc.read(_CHUNK)
+            fdst.write(coder(None))
+        finally:
+            fdst.close()
+        shutil.copymode(src, tmp)
+        os.rename(tmp, dst)
+    except:
+        _unlink(tmp)
+        raise
+    finally:
+        fsrc.close()
+
+
+def store(src, dst, strategies=DEFAULT_STRATEGIES, codec=None,
+          min_size=DEFAULT_MIN_COMPRESS_SIZE):
+    """
+    Put src into the blob store as dst. If a codec is given and src is
+    at least min_size bytes, the blob is compressed with it; this of
+    course rules out cloning or linking.
+    """
+    if codec is None or os.path.getsize(src) < min_size:
+        return materialize(src, dst, strategies, new_mtime=False)
+
+    try:
+        compressor = CODECS[codec][0]()
+    except KeyError:
+        raise ValueError("unknown blob codec '%s'" % codec)
+
+    def coder(data):
+        if data is None:
+            return compressor.flush()
+        return compressor.compress(data)
+
+    util.ensure_file_dir(dst)
+    _transcode(src, dst, coder, MAGIC + codec + "\n")
+    return codec
+
+
+def restore(src, dst, strategies=DEFAULT_STRATEGIES, new_mtime=True):
+    """the reverse of store(): write the file in blob src to dst"""
+    codec = codec_of(src)
+    if codec is None:
+        return materialize(src, dst, strategies, new_mtime)
+
+    try:
+        decompressor = CODECS[codec][1]()
+    except KeyError:
+        raise IOError(errno.EINVAL,
+                      "blob %s uses unavailable codec '%s'" % (src, codec))
+
+    def coder(data):
+        if data is None:
+            # zlib keeps some output back until flushed
+            return getattr(decompressor, "flush", str)()
+        return decompressor.decompress(data)
+
+    util.ensure_file_dir(dst)
+    _transcode(src, dst, coder, skip=len(MAGIC) + len(codec) + 1)
+    return codec
@@ -0,0 +1,92 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+The client side of the build server (see buildserver.py), kept apart
+from it so that runmem doesn't load the server to find out there is
+none.
+"""
+
+import json
+import os
+import socket
+import sys
+
+from _mem import MEM_DIR
+
+SOCKET_FILE = "server.sock"
+
+# Messages are JSON lines, but what goes through them (output, argv,
+# the environment) is bytes in no particular encoding. Every byte is
+# sent as the character with the same number, and turned back into
+# that byte on the other end.
+WIRE_ENCODING = "latin-1"
+
+
+def socket_path(root):
+    return os.path.join(root, MEM_DIR, SOCKET_FILE)
+
+
+def connect(path):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except socket.error:
+        s.close()
+        return None
+    return s
+
+
+def forward(root, argv, out=None, err=None):
+    """
+    Have the build server of root do the build runmem was asked for,
+    printing its output to out and err (sys.stdout and sys.stderr).
+    Returns runmem's exit code, or None if there is no server and the
+    build has to be done here.
+    """
+    out = out or sys.stdout
+    err = err or sys.stderr
+    path = socket_path(root)
+    if not os.path.exists(path):
+        return None
+    s = connect(path)
+    if s is None:
+        return None
+    try:
+        s.sendall(json.dumps({"argv": argv, "cwd": os.getcwd(),
+                              "env": dict(os.environ)},
+                             encoding=WIRE_ENCODING) + "\n")
+        f = s.makefile("rb")
+        while True:
+            line = f.readline()
+            if not line:
+                # the server went away (or restarted) before it was done
+                return None
+            msg = json.loads(line)
+            if "out" in msg:
+                out.write(msg["out"].encode(WIRE_ENCODING))
+                out.flush()
+            elif "err" in msg:
+                err.write(msg["err"].encode(WIRE_ENCODING))
+            elif "exit" in msg:
+                return msg["exit"]
+    finally:
+        s.close()
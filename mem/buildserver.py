@@ -0,0 +1,259 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+A build server: one process that keeps a Mem resident (see watch.py)
+and builds whenever a runmem asks it to, for editors and test runners
+that build many times a minute.
+
+   $ runmem build-server &
+   $ runmem                  # forwarded to the server
+
+runmem forwards its command line and environment over the Unix socket
+.mem/server.sock and prints what the server sends back, as the build
+goes (see buildclient.py). Only when there is no server it builds by
+itself; --no-server makes it do so anyway.
+
+Builds happen one after the other. Requests for the same build (same
+arguments, same environment) that are still waiting for their turn
+are merged into one; all the clients get its output.
+"""
+
+from __future__ import with_statement
+
+import fcntl
+import json
+import optparse
+import os
+import signal
+import socket
+import SocketServer
+import sys
+import threading
+import traceback
+
+import trace
+import watch
+
+from buildclient import socket_path, connect, WIRE_ENCODING
+
+def _key(argv, cwd, env):
+    return (tuple(argv), cwd, tuple(sorted(env.items())))
+
+
+class _Build(object):
+    """One build to be done, for one or more clients."""
+    def __init__(self, argv, cwd, env):
+        self.argv = argv
+        self.cwd = cwd
+        self.env = env
+        self.key = _key(argv, cwd, env)
+        self.clients = []
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def send(self, **msg):
+        line = json.dumps(msg, encoding=WIRE_ENCODING) + "\n"
+        with self.lock:
+            for c in self.clients[:]:
+                try:
+                    c.sendall(line)
+                except socket.error:
+                    # gone; the build is still good for the others
+                    self.clients.remove(c)
+
+    def finish(self, code):
+        self.send(exit=code)
+        self.done.set()
+
+
+class _Output(object):
+    """stands in for sys.stdout/sys.stderr during a build"""
+    def __init__(self, build, stream):
+        self.build = build
+        self.stream = stream
+        self.softspace = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        if data:
+            self.build.send(**{self.stream: data})
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class _Handler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.request.makefile("rb").readline())
+            argv = [a.encode(WIRE_ENCODING) for a in request["argv"]]
+            cwd = request["cwd"].encode(WIRE_ENCODING)
+            env = dict((k.encode(WIRE_ENCODING), v.encode(WIRE_ENCODING))
+                       for k, v in request["env"].items())
+        except (ValueError, KeyError, TypeError, AttributeError,
+                UnicodeError):
+            return
+        # the connection has to stay open until the build is done
+        self.server.enqueue(self.request, argv, cwd, env).done.wait()
+
+
+class BuildServer(SocketServer.ThreadingMixIn,
+                  SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, resident, parser):
+        SocketServer.UnixStreamServer.__init__(self, path, _Handler)
+        flags = fcntl.fcntl(self.fileno(), fcntl.F_GETFD)
+        fcntl.fcntl(self.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        self.path = path
+        self.resident = resident
+        self.parser = parser
+        self.queue = []
+        self.cond = threading.Condition()
+        self.stopping = False
+
+    def enqueue(self, client, argv, cwd, env):
+        """the build that client's request will be served by"""
+        key = _key(argv, cwd, env)
+        with self.cond:
+            for build in self.queue:
+                if build.key == key:
+                    break
+            else:
+                build = _Build(argv, cwd, env)
+                self.queue.append(build)
+                self.cond.notify()
+            with build.lock:
+                build.clients.append(client)
+        return build
+
+    def next(self):
+        """the next build to do, None once stop() was called"""
+        with self.cond:
+            while not self.queue and not self.stopping:
+                # time out now and then so that Ctrl-C gets through
+                self.cond.wait(0.5)
+            if self.stopping:
+                return None
+            return self.queue.pop(0)
+
+    def run(self):
+        """do the builds clients ask for, until interrupted or stopped"""
+        thread = threading.Thread(target=self.serve_forever, args=(0.1,))
+        thread.setDaemon(True)
+        thread.start()
+        try:
+            while True:
+                build = self.next()
+                if build is None:
+                    return
+                build.finish(self._build(build))
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+
+    def _build(self, build):
+        saved = (sys.stdout, sys.stderr, dict(os.environ))
+        sys.stdout = _Output(build, "out")
+        sys.stderr = _Output(build, "err")
+        os.environ.clear()
+        os.environ.update(build.env)
+        try:
+            try:
+                (options, args) = self.parser.parse_args(build.argv)
+            except SystemExit, e:
+                # a usage error, already reported
+                return e.code
+            if options.watch:
+                sys.stderr.write("--watch doesn't work with a build "
+                                 "server, use --no-server.\n")
+                return 2
+            self.resident.poll()
+            if options.trace:
+                trace.start(os.path.join(build.cwd, options.trace))
+            try:
+                if self.resident.build(build.argv, options.stats):
+                    return 0
+                return 1
+            finally:
+                trace.stop()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            traceback.print_exc()
+            return 1
+        finally:
+            (sys.stdout, sys.stderr, environ) = saved
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def close(self):
+        self.server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def main(root, args, parser, load_root):
+    """runmem build-server; parser parses the arguments of runmem"""
+    options, args = optparse.OptionParser(
+        usage="runmem build-server").parse_args(args)
+
+    path = socket_path(root)
+    if os.path.exists(path):
+        s = connect(path)
+        if s is not None:
+            s.close()
+            sys.stderr.write("a build server is running already.\n")
+            return 1
+        os.unlink(path)
+
+    def terminate(signum, frame):
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, terminate)
+
+    resident = watch.Resident(root, load_root)
+    server = BuildServer(path, resident, parser)
+    print "serving builds of %s on %s" % (root, path)
+    sys.stdout.flush()
+    try:
+        try:
+            server.run()
+        except KeyboardInterrupt:
+            pass
+    finally:
+        server.close()
+        resident.close()
+    return 0
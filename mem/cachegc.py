@@ -0,0 +1,298 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Garbage collection for the .mem cache.
+
+Blobs are evicted least recently used first (their stamps are renewed
+whenever a memoized call stores or restores them) until the blob store
+fits the byte budget and nothing is older than the age limit. Results
+whose blobs are gone are dropped, as are deps and results that weren't
+hit within the age limit.
+
+A collection can be given a time limit; it then stops where it is and
+the next one picks up from there. That is how the automatic collection
+at the end of every build stays out of the way. The store is read a
+page at a time (PAGE_SIZE entries, oldest or next after a cursor), so
+a collection costs the same however big the cache is, as long as it
+has nothing to do.
+"""
+
+import optparse
+import os
+import time
+
+import cPickle as pickle
+
+STATE_FILE = "gc"
+
+# time spent collecting at the end of a build, in seconds
+AUTO_TIME_LIMIT = 0.5
+
+# entries read from the store at once
+PAGE_SIZE = 1000
+
+# unreferenced blobs younger than this might belong to a build that is
+# still running
+GRACE_PERIOD = 3600
+
+_UNITS = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+_AGE_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parse_size(s):
+    """'100', '512k', '10G' -> bytes"""
+    if s is None:
+        return None
+    s = str(s).strip().lower().rstrip("b")
+    unit = s[-1:] if s[-1:] in _UNITS else ""
+    return int(float(s[:len(s) - len(unit)]) * _UNITS[unit])
+
+
+def parse_age(s):
+    """'3600', '12h', '30d' -> seconds"""
+    if s is None:
+        return None
+    s = str(s).strip().lower()
+    unit = s[-1:] if s[-1:] in _AGE_UNITS else ""
+    return float(s[:len(s) - len(unit)]) * _AGE_UNITS[unit]
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+class Collector(object):
+    def __init__(self, mem, time_limit=None):
+        self.mem = mem
+        self.store = mem.store
+        self.state_path = os.path.join(mem.mem_dir, STATE_FILE)
+        self.deadline = time_limit and time.time() + time_limit
+        self.removed = {"blobs": 0, "bytes": 0, "deps": 0, "results": 0}
+
+    def _check_time(self):
+        if self.deadline and time.time() > self.deadline:
+            raise _OutOfTime()
+
+    def _load_state(self):
+        try:
+            f = open(self.state_path, "rb")
+        except IOError:
+            return {}
+        try:
+            try:
+                return pickle.load(f)
+            except Exception:
+                return {}
+        finally:
+            f.close()
+
+    def _save_state(self, state):
+        f = open(self.state_path, "wb")
+        try:
+            pickle.dump(state, f, 2)
+        finally:
+            f.close()
+
+    def _remove_blob(self, h, size):
+        try:
+            os.unlink(self.mem._blob_path(h))
+        except OSError:
+            pass
+        self.store.delete("blobs", h)
+        self.removed["blobs"] += 1
+        self.removed["bytes"] += size
+
+    def _remove_result(self, rhash):
+        self.store.delete("results", rhash)
+        self.store.delete("refs", rhash)
+        self.removed["results"] += 1
+
+    def _blob_files(self):
+        for prefix in os.listdir(self.mem.blob_dir):
+            d = os.path.join(self.mem.blob_dir, prefix)
+            for rest in os.listdir(d):
+                yield prefix + rest, os.path.join(d, rest)
+
+    def index_blobs(self):
+        """add blobs stored before the blob index existed to it"""
+        if not os.path.isdir(self.mem.blob_dir):
+            return
+        indexed = set(self.store.keys("blobs"))
+        for h, path in self._blob_files():
+            if h not in indexed:
+                self.store.put("blobs", h, str(os.path.getsize(path)))
+
+    def index_refs(self):
+        """
+        Record the blobs of results stored before refs were recorded.
+        Returns False if some result couldn't be inspected.
+        """
+        refs = set(self.store.keys("refs"))
+        complete = True
+        for rhash in self.store.keys("results"):
+            if rhash in refs:
+                continue
+            try:
+                result = self.mem._load_result(rhash)
+            except Exception:
+                complete = False
+                continue
+
+            blobs = []
+            def walk(o):
+                if hasattr(o, "store"):
+                    blobs.append(o._hash)
+                elif hasattr(o, "__iter__"):
+                    for el in o:
+                        walk(el)
+            walk(result)
+            self.store.put("refs", rhash, " ".join(blobs))
+        return complete
+
+    def _oldest(self, kind):
+        """
+        (key, stamp) of kind, least recently used first, for as long as
+        the caller removes what it gets
+        """
+        last = None
+        while True:
+            page = self.store.by_age(kind, PAGE_SIZE)
+            if page == last:
+                # nothing was removed
+                return
+            for key, stamp in page:
+                yield key, stamp
+            if len(page) < PAGE_SIZE:
+                return
+            last = page
+
+    def evict_blobs(self, max_bytes, max_age):
+        cutoff = max_age and time.time() - max_age
+        total = self.store.total("blobs")
+        for h, stamp in self._oldest("blobs"):
+            too_old = cutoff and stamp < cutoff
+            if not too_old and (max_bytes is None or total <= max_bytes):
+                break
+            self._check_time()
+            try:
+                size = int(self.store.get("blobs", h))
+            except KeyError:
+                continue
+            self._remove_blob(h, size)
+            total -= size
+
+    def expire(self, max_age):
+        cutoff = time.time() - max_age
+        for kind in ("deps", "results"):
+            for key, stamp in self._oldest(kind):
+                if stamp >= cutoff:
+                    break
+                self._check_time()
+                if kind == "deps":
+                    self.store.delete("deps", key)
+                    self.removed["deps"] += 1
+                else:
+                    self._remove_result(key)
+
+    def drop_dangling(self):
+        """
+        Drop results of which at least one blob is gone. Goes through
+        the results once, starting where the last collection stopped.
+        """
+        state = self._load_state()
+        cursor = state.get("cursor", "")
+        try:
+            while True:
+                keys = self.store.keys("refs", cursor, PAGE_SIZE)
+                for rhash in keys:
+                    self._check_time()
+                    try:
+                        blobs = self.store.get("refs", rhash).split()
+                    except KeyError:
+                        continue
+                    for h in blobs:
+                        if not os.path.exists(self.mem._blob_path(h)):
+                            self._remove_result(rhash)
+                            break
+                    cursor = rhash
+                if len(keys) < PAGE_SIZE:
+                    break
+            cursor = ""
+        finally:
+            state["cursor"] = cursor
+            self._save_state(state)
+
+    def drop_unreferenced_blobs(self):
+        if not os.path.isdir(self.mem.blob_dir):
+            return
+        referenced = set()
+        for refs in self.store.get_many(
+            "refs", list(self.store.keys("refs"))).itervalues():
+            referenced.update(refs.split())
+
+        cutoff = time.time() - GRACE_PERIOD
+        for h, path in self._blob_files():
+            if h in referenced:
+                continue
+            st = os.stat(path)
+            if st.st_mtime < cutoff:
+                self._remove_blob(h, st.st_size)
+
+
+def collect(mem, max_bytes=None, max_age=None, time_limit=None, full=False):
+    """
+    Collect garbage in mem's cache, see the module docstring. A full
+    collection also indexes and removes blobs unknown to the store; it
+    has to look at every blob and is meant for 'mem gc'.
+    """
+    c = Collector(mem, time_limit)
+    try:
+        if full:
+            c.index_blobs()
+            refs_complete = c.index_refs()
+        c.evict_blobs(max_bytes, max_age)
+        if max_age:
+            c.expire(max_age)
+        c.drop_dangling()
+        if full and refs_complete:
+            c.drop_unreferenced_blobs()
+    except _OutOfTime:
+        pass
+    mem.store.flush()
+    return c.removed
+
+
+def main(root, args):
+    from _mem import Mem
+
+    parser = optparse.OptionParser(usage="mem gc [options]")
+    parser.add_option("--max-bytes", default=os.environ.get("MEM_GC_MAX_BYTES"),
+                      help="shrink the blob store to this size (eg 10G)")
+    parser.add_option("--max-age", default=os.environ.get("MEM_GC_MAX_AGE"),
+                      help="drop entries not used within this time (eg 30d)")
+    (options, args) = parser.parse_args(args)
+
+    mem = Mem(root)
+    removed = collect(mem, parse_size(options.max_bytes),
+                      parse_age(options.max_age), full=True)
+    print ("removed %(blobs)d blobs (%(bytes)d bytes), %(results)d results "
+           "and %(deps)d deps" % removed)
+    return 0
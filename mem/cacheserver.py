@@ -0,0 +1,204 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+A reference server for the remote cache protocol (see remote.py),
+keeping everything in a directory:
+
+   $ MEM_REMOTE_KEY=... mem cache-server --port 8765 /var/cache/mem
+
+It only takes PUTs signed with the team's shared key, and listens on
+localhost unless told otherwise (--bind). It's good enough for a team
+and for tests; anything speaking plain HTTP GET/PUT (nginx with WebDAV,
+S3 behind a proxy, ...) works too, since clients check what they
+download themselves.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import hmac
+import optparse
+import os
+import re
+import shutil
+import sys
+import thread
+import threading
+
+import remote
+
+_KEY = re.compile(r"^[0-9a-zA-Z]{3,128}$")
+
+
+class CacheHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _path(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 2:
+            return None
+        kind, key = parts
+        if kind not in remote.KINDS or not _KEY.match(key):
+            return None
+        return os.path.join(self.server.directory, kind, key[:2], key[2:])
+
+    def _reply(self, code, body=""):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        path = self._path()
+        if path is None:
+            return self._reply(400)
+        try:
+            f = open(path, "rb")
+        except IOError:
+            return self._reply(404)
+        try:
+            self.send_response(200)
+            self.send_header("Content-Length",
+                             str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            if self.command != "HEAD":
+                shutil.copyfileobj(f, self.wfile, 1 << 16)
+        finally:
+            f.close()
+
+    do_HEAD = do_GET
+
+    def do_PUT(self):
+        path = self._path()
+        try:
+            length = int(self.headers["Content-Length"])
+        except (KeyError, ValueError):
+            return self._reply(411)
+        if path is None:
+            self.rfile.read(length)
+            return self._reply(400)
+
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+        kind, key = self.path.strip("/").split("/")
+        signature = self.headers.get(remote.SIGNATURE_HEADER, "")
+        tmp = "%s.%d.%d.tmp" % (path, os.getpid(), thread.get_ident())
+        f = open(tmp, "wb")
+        try:
+            while length > 0:
+                data = self.rfile.read(min(length, 1 << 16))
+                if not data:
+                    break
+                f.write(data)
+                length -= len(data)
+        finally:
+            f.close()
+        if length > 0:
+            os.unlink(tmp)
+            return self._reply(400)
+        if not self._signed(kind, key, tmp, signature):
+            os.unlink(tmp)
+            return self._reply(403)
+        os.rename(tmp, path)
+        self._reply(201)
+
+    def _signed(self, kind, key, path, signature):
+        """whether the upload in path was made with our key"""
+        secret = self.server.secret
+        f = open(path, "rb")
+        try:
+            if kind != "blob":
+                # the signature is stored with the entry, for clients
+                return (remote.unsign(secret, kind, key, f.read())
+                        is not None)
+            mac = remote.signer(secret, kind, key)
+            for data in iter(lambda: f.read(1 << 16), ""):
+                mac.update(data)
+        finally:
+            f.close()
+        return hmac.compare_digest(mac.hexdigest(), signature)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+
+class CacheServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, directory, secret, address=("127.0.0.1", 0),
+                 quiet=False):
+        if not secret:
+            raise ValueError("a cache server needs a shared key")
+        BaseHTTPServer.HTTPServer.__init__(self, address, CacheHandler)
+        self.directory = directory
+        self.secret = secret
+        self.quiet = quiet
+
+    def url(self):
+        host, port = self.server_address[:2]
+        if host in ("", "0.0.0.0"):
+            host = "localhost"
+        return "http://%s:%d" % (host, port)
+
+    def start(self, poll_interval=0.1):
+        """serve from a background thread, returns the thread"""
+        t = threading.Thread(target=self.serve_forever, args=(poll_interval,))
+        t.setDaemon(True)
+        t.start()
+        return t
+
+
+def main(args):
+    parser = optparse.OptionParser(
+        usage="mem cache-server [options] DIRECTORY")
+    parser.add_option("--bind", default="127.0.0.1",
+                      help="address to listen on (default: %default)")
+    parser.add_option("--port", type="int", default=8765)
+    parser.add_option("--key-file",
+                      help="read the shared key from this file rather "
+                      "than $%s" % remote.KEY_VARIABLE)
+    parser.add_option("-q", "--quiet", action="store_true")
+    (options, args) = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error("exactly one directory expected")
+
+    if options.key_file:
+        secret = open(options.key_file).read().strip()
+    else:
+        secret = os.environ.get(remote.KEY_VARIABLE)
+    if not secret:
+        sys.stderr.write("mem cache-server: no shared key, set $%s or "
+                         "use --key-file\n" % remote.KEY_VARIABLE)
+        return 2
+
+    server = CacheServer(args[0], secret, (options.bind, options.port),
+                         options.quiet)
+    print "serving %s on %s" % (args[0], server.url())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
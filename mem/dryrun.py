@@ -0,0 +1,208 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Dry runs, runmem --dry-run: the Memfiles are evaluated as usual, but
+memoized tasks are only looked up in the cache, they never run. Each
+one is reported as a hit, a miss along with why (mostly which of its
+dependencies changed), or unknown: a task that gets the result of a
+miss as an argument can't even be looked up, there is no telling what
+that result is going to be.
+
+Commands that Memfiles run outside of memoized tasks don't run either,
+they are reported as skipped (see util.popen()).
+"""
+
+from __future__ import with_statement
+
+import os
+import sys
+import threading
+
+import nodes
+
+HIT = "hit"
+MISS = "miss"
+UNKNOWN = "unknown"
+SKIPPED = "skipped"
+
+# how many file names a reason lists at most
+MAX_NAMES = 3
+
+
+class Unknown(str):
+    """
+    Stands in for the result of a task that would run. It is the task's
+    target, so that Memfiles can carry on with it, but any memoized
+    call it is passed to can only be unknown as well.
+    """
+    def __new__(cls, value, call):
+        s = str.__new__(cls, value)
+        s.call = call
+        return s
+
+    def mem_digest(self):
+        raise _UnknownInput(self)
+
+
+class _UnknownInput(Exception):
+    def __init__(self, unknown):
+        Exception.__init__(self, unknown.call)
+        self.unknown = unknown
+
+
+def _files(o, found):
+    """collect the Files in o, a task's result"""
+    if isinstance(o, nodes.File):
+        found.append(o)
+    elif hasattr(o, "__iter__"):
+        for el in o:
+            _files(el, found)
+    return found
+
+
+class Report(object):
+    """
+    What a dry run found, in the order the tasks were looked up. Set as
+    Mem.dry_run, memoize() then calls query() instead of the task.
+    """
+    def __init__(self, mem):
+        self.mem = mem
+        self.entries = []
+        # tchash -> result, the same call is reported once
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def _name(self, path):
+        path = str(path)
+        if path.startswith(self.mem.root + os.path.sep):
+            return path[len(self.mem.root) + 1:]
+        return path
+
+    def _names(self, paths):
+        names = [self._name(p) for p in paths[:MAX_NAMES]]
+        if len(paths) > MAX_NAMES:
+            names.append("%d more" % (len(paths) - MAX_NAMES))
+        return ", ".join(names)
+
+    def query(self, taskf, args, kwargs):
+        """what memoize() would return, without running taskf"""
+        target = args and args[0] or taskf.__name__
+        call = "%s(%s)" % (taskf.__name__, self._name(target))
+        try:
+            tchash = self.mem.get_hash(taskf.__name__, taskf.__module__,
+                                       args, kwargs)
+        except _UnknownInput, e:
+            return self._add(None, UNKNOWN, call,
+                             "needs the result of " + e.unknown.call,
+                             Unknown(target, call))
+        with self.lock:
+            if tchash in self.calls:
+                return self.calls[tchash]
+
+        (status, reason, result) = self._lookup(tchash)
+        if status == MISS:
+            result = Unknown(target, call)
+        return self._add(tchash, status, call, reason, result)
+
+    def _add(self, tchash, status, call, reason, result):
+        with self.lock:
+            if tchash in self.calls:
+                return self.calls[tchash]
+            if tchash is not None:
+                self.calls[tchash] = result
+            self.entries.append((status, call, reason))
+        return result
+
+    def skip(self, args):
+        """report the command args, which a real build would run"""
+        if not isinstance(args, (str, unicode)):
+            args = " ".join(args)
+        self._add(None, SKIPPED, args, "outside of memoized calls", None)
+
+    def _lookup(self, tchash):
+        """(status, reason, result) of the call tchash"""
+        mem = self.mem
+        try:
+            deps = mem._load_deps(tchash)
+        except (KeyError, IOError):
+            return (MISS, "new", None)
+        if mem._validate_deps(deps):
+            try:
+                result = mem._load_result(mem.get_hash(tchash, deps))
+            except (KeyError, IOError):
+                pass
+            else:
+                # a real build would restore these from the cache
+                missing = [f for f in _files(result, [])
+                           if f.get_hash() != f._hash]
+                if missing:
+                    # and whatever depends on them sees them as restored
+                    for f in missing:
+                        nodes.File._hash_cache[f] = f._hash
+                    return (HIT, "restores " + self._names(missing), result)
+                return (HIT, "", result)
+        return (MISS, self._changes(deps), None)
+
+    def _changes(self, deps):
+        """why deps, as they were last time, make a miss now"""
+        gone = []
+        changed = []
+        others = False
+        seen = set()
+        for d in deps:
+            if not isinstance(d, nodes.File):
+                others = True
+                continue
+            if d in seen:
+                continue
+            seen.add(d)
+            h = d.get_hash()
+            if h == nodes.NOT_FOUND:
+                gone.append(d)
+            elif h != d._hash:
+                changed.append(d)
+        reasons = []
+        if gone:
+            reasons.append("gone: " + self._names(gone))
+        if changed:
+            reasons.append("changed: " + self._names(changed))
+        if reasons:
+            return "; ".join(reasons)
+        if others:
+            return "a dependency other than a file changed"
+        return "result no longer in the cache"
+
+    def count(self, status):
+        return len([e for e in self.entries if e[0] == status])
+
+    def write(self, out=None):
+        out = out or sys.stdout
+        for (status, call, reason) in self.entries:
+            if reason:
+                out.write("%-8s %s  (%s)\n" % (status, call, reason))
+            else:
+                out.write("%-8s %s\n" % (status, call))
+        out.write("-" * 50 + "\n")
+        out.write("dry run: %d up to date, %d would run, %d unknown" %
+                  (self.count(HIT), self.count(MISS), self.count(UNKNOWN)))
+        if self.count(SKIPPED):
+            out.write(", %d skipped" % self.count(SKIPPED))
+        out.write("\n")
@@ -0,0 +1,73 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from __future__ import with_statement
+
+from picklefile import PickledDict
+
+
+def task_key(f, args):
+    """
+    What identifies a task across builds: the function and its target,
+    when the first positional argument is one (a path). The other
+    arguments are left out on purpose: changing them hardly changes how
+    long a task takes, and some of them (an Env, a list of objects)
+    would make for huge keys.
+    """
+    target = args and args[0]
+    if not isinstance(target, basestring):
+        target = ""
+    return "%s.%s(%s)" % (f.__module__, f.__name__, target)
+
+
+class Durations(PickledDict):
+    """
+    Remembers how long tasks took (wall time, in seconds) the last time
+    they actually ran, so that the next build can start the longest
+    ones first. Tasks the last complete build didn't submit are
+    forgotten.
+    """
+    def __init__(self, path):
+        PickledDict.__init__(self, path)
+        # the keys submitted during this build
+        self.seen = set()
+
+    def get(self, key):
+        """the last duration of task key, None if it never ran"""
+        with self.lock:
+            self.seen.add(key)
+        return self.entries.get(key)
+
+    def record(self, key, seconds):
+        with self.lock:
+            self.seen.add(key)
+            self.entries[key] = seconds
+            self.dirty = True
+
+    def save(self, prune=False):
+        """write the durations; prune: drop the tasks not seen"""
+        with self.lock:
+            if prune:
+                for key in set(self.entries).difference(self.seen):
+                    del self.entries[key]
+                    self.dirty = True
+            self.seen = set()
+        PickledDict.save(self)
@@ -0,0 +1,274 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+A bounded pool of worker threads for the tasks of a build.
+
+Tasks that are submitted get queued and return a Future. A task that
+waits for another one helps instead of just blocking: if nobody picked
+the other task up yet, it runs it itself. A task that really has to
+block gives up its slot while it waits, so tasks that wait for other
+tasks can never starve the pool.
+
+Queued tasks start highest priority first, see TaskQueue.
+"""
+
+from __future__ import with_statement
+
+import heapq
+import itertools
+import sys
+import threading
+import time
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+
+
+class TaskQueue(object):
+    """
+    The tasks waiting for a worker. Higher priorities come first, tasks
+    of equal priority in the order they were submitted. Mem uses the
+    estimated time until a task and whatever waits for it are done.
+    """
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, future, priority=0):
+        heapq.heappush(self.heap, (-priority, self.counter.next(), future))
+
+    def pop(self):
+        return heapq.heappop(self.heap)[2]
+
+
+class Future(object):
+    def __init__(self, executor, fn, args, kwargs):
+        self.executor = executor
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.state = PENDING
+        self.finished = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        return self.state == DONE
+
+    def result(self):
+        """wait for the task and return its result, or raise its exception"""
+        self.executor._wait(self)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        self.executor._wait(self)
+        return self._exc_info and self._exc_info[1]
+
+
+class Executor(object):
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self.cond = threading.Condition()
+        self.queue = TaskQueue()
+        self.local = threading.local()
+
+        # threads running a task right now, pool threads, idle pool
+        # threads and pool threads blocked on another task
+        self.running = 0
+        self.threads = 0
+        self.idle = 0
+        self.blocked = 0
+        self.stopping = False
+        # pool threads that left, for shutdown() to join
+        self.exited = []
+
+    def resize(self, workers):
+        with self.cond:
+            self.workers = max(1, workers)
+            self.cond.notify_all()
+
+    def submit(self, fn, *args, **kwargs):
+        return self.submit_prioritized(0, fn, *args, **kwargs)
+
+    def submit_prioritized(self, priority, fn, *args, **kwargs):
+        future = Future(self, fn, args, kwargs)
+        with self.cond:
+            self.stopping = False
+            self.queue.push(future, priority)
+            self._spawn_if_needed()
+            self.cond.notify_all()
+        return future
+
+    def gather(self, futures):
+        """wait for all futures, return their results in order"""
+        return [f.result() for f in futures]
+
+    def cancel(self):
+        """
+        Drop all queued tasks, they never start; waiting for one raises
+        SystemExit. Tasks submitted later are queued as usual.
+        """
+        with self.cond:
+            while self.queue:
+                future = self.queue.pop()
+                if future.state == PENDING:
+                    future._exc_info = (SystemExit, SystemExit(1), None)
+                    future.fn = future.args = future.kwargs = None
+                    future.state = DONE
+                    future.finished.set()
+            self.cond.notify_all()
+
+    def shutdown(self, timeout=1.0):
+        """
+        Let idle pool threads exit and wait up to timeout seconds for
+        them; the pool restarts on submit(). Daemon threads still around
+        when the interpreter exits die noisily.
+        """
+        end = time.time() + timeout
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+            while self.threads > self.running + self.blocked:
+                left = end - time.time()
+                if left <= 0:
+                    break
+                self.cond.wait(left)
+            (exited, self.exited) = (self.exited, [])
+        for t in exited:
+            t.join(max(0, end - time.time()))
+
+    def _spawn_if_needed(self):
+        """called with cond held"""
+        # idle threads that were just notified haven't taken their task
+        # yet, so each of them only covers one queued task
+        if (len(self.queue) > self.idle and
+            self.threads - self.blocked < self.workers):
+            t = threading.Thread(target=self._worker)
+            t.setDaemon(True)
+            self.threads += 1
+            t.start()
+
+    def _next(self):
+        """called with cond held: claim a queued task, or return None"""
+        while self.queue and self.running < self.workers:
+            future = self.queue.pop()
+            if future.state == PENDING:
+                future.state = RUNNING
+                self.running += 1
+                return future
+        return None
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                future = self._next()
+                while future is None:
+                    if self.stopping or (self.threads - self.blocked >
+                                         self.workers):
+                        self.threads -= 1
+                        self.exited.append(threading.currentThread())
+                        self.cond.notify_all()
+                        return
+                    self.idle += 1
+                    self.cond.wait()
+                    self.idle -= 1
+                    future = self._next()
+            self._execute(future)
+            with self.cond:
+                self.running -= 1
+                self.cond.notify_all()
+
+    def _execute(self, future):
+        self.local.depth = getattr(self.local, "depth", 0) + 1
+        try:
+            future._result = future.fn(*future.args, **future.kwargs)
+        except:
+            future._exc_info = sys.exc_info()
+        self.local.depth -= 1
+        future.fn = future.args = future.kwargs = None
+        future.state = DONE
+        future.finished.set()
+
+    def _wait(self, future):
+        if future.state == DONE:
+            return
+        # a thread that is running a task holds a slot; other threads
+        # leave the work to the pool, which keeps to the priorities
+        if getattr(self.local, "depth", 0) > 0:
+            with self.cond:
+                if future.state == PENDING:
+                    # nobody got to it yet, run it right here
+                    future.state = RUNNING
+                    run_here = True
+                else:
+                    run_here = False
+                    self._release_slot()
+            if run_here:
+                self._execute(future)
+                return
+            self._block(future.finished)
+            self._reclaim_slot()
+        else:
+            self._block(future.finished)
+
+    def wait_for(self, event):
+        """
+        Wait for event (a threading.Event) that some other task sets,
+        like a task waits for another one: without holding a slot.
+        """
+        if event.isSet():
+            return
+        has_slot = getattr(self.local, "depth", 0) > 0
+        if has_slot:
+            with self.cond:
+                self._release_slot()
+        self._block(event)
+        if has_slot:
+            self._reclaim_slot()
+
+    def _release_slot(self):
+        """called with cond held: give the slot to somebody else"""
+        self.running -= 1
+        self.blocked += 1
+        self._spawn_if_needed()
+        self.cond.notify_all()
+
+    def _reclaim_slot(self):
+        with self.cond:
+            self.blocked -= 1
+            while self.running >= self.workers:
+                self.cond.wait()
+            self.running += 1
+
+    def _block(self, event):
+        if isinstance(threading.currentThread(), threading._MainThread):
+            # an untimed wait can't be interrupted with ^C
+            while not event.isSet():
+                event.wait(0.1)
+        else:
+            event.wait()
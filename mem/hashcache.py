@@ -0,0 +1,66 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import with_statement
+
+import time
+
+from picklefile import PickledDict
+
+
+class HashCache(PickledDict):
+    """
+    Remembers file hashes across builds, keyed by the stat information
+    of the file (inode, size, mtime and mode). As long as none of those
+    change we trust the hash we computed last time instead of reading
+    the whole file again.
+
+    Like git's index, this is subject to the "racy timestamp" problem: a
+    file that is modified again within the granularity of its mtime
+    looks unchanged. We therefore only remember hashes of files whose
+    mtime lies in an earlier second than the moment we hashed them;
+    everything else is simply hashed again next time.
+    """
+    @staticmethod
+    def _key(st):
+        return (st.st_ino, st.st_size, st.st_mtime, st.st_mode)
+
+    def lookup(self, path, st):
+        """return the remembered hash of path or None if st doesn't match"""
+        try:
+            key, h = self.entries[str(path)]
+        except KeyError:
+            return None
+        if key != self._key(st):
+            return None
+        return h
+
+    def record(self, path, st, h, now=None):
+        if now is None:
+            now = time.time()
+        if int(st.st_mtime) >= int(now):
+            # racy; the file could still change without its stat
+            # changing. Don't trust it.
+            return
+        with self.lock:
+            # plain str keys; File objects can't be unpickled before
+            # the Mem singleton is fully set up
+            self.entries[str(path)] = (self._key(st), h)
+            self.dirty = True
@@ -0,0 +1,115 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Hashing of task arguments, which is how memoized calls are keyed.
+
+Every value is encoded as a type tag followed by its length-prefixed
+content, so different values never encode the same. Dicts and sets are
+encoded in sorted order, so their keys are stable no matter in which
+order they were filled. Objects can provide a precomputed digest with a
+'mem_digest()' method, like a frozen util.Env does.
+"""
+
+import hashlib
+import sys
+import types
+
+import cPickle as pickle
+
+import nodes
+import util
+
+_method_wrapper = type(object().__delattr__)
+
+
+def _module_hash(modname):
+    return nodes.File(sys.modules[modname].__file__).get_hash()
+
+
+def _encode(o, out):
+    if hasattr(o, "mem_digest"):
+        out.append("D%s" % o.mem_digest())
+    elif hasattr(o, "get_hash"):
+        h = o.get_hash()
+        out.append("H%d:%s" % (len(h), h))
+    elif isinstance(o, str):
+        out.append("s%d:" % len(o))
+        out.append(o)
+    elif isinstance(o, unicode):
+        o = o.encode("utf-8")
+        out.append("u%d:" % len(o))
+        out.append(o)
+    elif isinstance(o, bool):
+        out.append(o and "T" or "F")
+    elif isinstance(o, (int, long)):
+        out.append("i%d;" % o)
+    elif isinstance(o, float):
+        out.append("f%r;" % o)
+    elif o is None:
+        out.append("N")
+    elif isinstance(o, types.ModuleType):
+        out.append("m%s" % nodes.File(o.__file__).get_hash())
+    elif isinstance(o, dict):
+        items = sorted((encode(k), encode(v)) for k, v in o.iteritems())
+        out.append("d%d:" % len(items))
+        for k, v in items:
+            out.append(k)
+            out.append(v)
+    elif isinstance(o, (set, frozenset)):
+        items = sorted(encode(el) for el in o)
+        out.append("S%d:" % len(items))
+        out.extend(items)
+    elif isinstance(o, (list, tuple)):
+        out.append("%s%d:" % (isinstance(o, list) and "l" or "t", len(o)))
+        for el in o:
+            _encode(el, out)
+    elif isinstance(o, types.MethodType):
+        _encode(("method", o.__func__.__name__, o.__module__,
+                 _module_hash(o.__module__)), out)
+    elif isinstance(o, (types.FunctionType, types.TypeType,
+                        types.ClassType)):
+        _encode(("function", o.__name__, o.__module__,
+                 _module_hash(o.__module__)), out)
+    elif isinstance(o, util.AutoHashable):
+        _encode(("auto", [(a, getattr(o, a)) for a in dir(o)
+                          if not a.startswith("__")]), out)
+    elif isinstance(o, (types.BuiltinMethodType, types.BuiltinFunctionType,
+                        _method_wrapper)):
+        _encode(("builtin", o.__name__), out)
+    elif hasattr(o, "__iter__"):
+        out.append("I")
+        _encode(list(o), out)
+    else:
+        # last resort, an object we know nothing about
+        data = pickle.dumps(o, 2)
+        out.append("p%d:" % len(data))
+        out.append(data)
+
+
+def encode(o):
+    """the canonical encoding of o, as a string"""
+    out = []
+    _encode(o, out)
+    return "".join(out)
+
+
+def digest(o):
+    return hashlib.sha1(encode(o)).hexdigest()
@@ -0,0 +1,301 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+The GNU make jobserver: a pipe holding one byte, a token, per job that
+may run besides the first. Whoever wants to start another job takes a
+token out and puts it back once the job is done; every make (and gcc
+-flto=jobserver, and cargo...) that finds the pipe in MAKEFLAGS does
+the same, so nested builds share one budget.
+
+Mem takes a token for every subprocess it starts (see util.popen()).
+When runmem runs from make, it uses make's jobserver; otherwise it is
+the jobserver itself, for all of its subprocesses. Where there are no
+pipes to share (win32) that is a LocalJobServer, for mem alone.
+"""
+
+from __future__ import with_statement
+
+import errno
+import os
+import re
+import select
+import sys
+import threading
+
+_AUTH = re.compile(r"--jobserver-(?:auth|fds)=(\S+)")
+_JOBS = re.compile(r"(^|\s)-j\d*(?=\s|$)")
+
+
+def strip_flags(flags):
+    """MAKEFLAGS flags without the jobserver and -j"""
+    return " ".join(_JOBS.sub(" ", _AUTH.sub("", flags)).split())
+
+
+def _is_open(fd):
+    import fcntl
+    try:
+        fcntl.fcntl(fd, fcntl.F_GETFD)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def _cloexec(fd):
+    """keeps fd, which is only ours, from the subprocesses"""
+    import fcntl
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    return fd
+
+
+def from_environ(environ):
+    """the jobserver MAKEFLAGS in environ tells about, or None"""
+    if os.name != "posix":
+        return None
+    auth = None
+    for m in _AUTH.finditer(environ.get("MAKEFLAGS", "")):
+        auth = m.group(1)
+    if auth is None:
+        return None
+    if auth.startswith("fifo:"):
+        try:
+            fd = os.open(auth[len("fifo:"):], os.O_RDWR)
+        except OSError, e:
+            _unavailable(e.strerror)
+            return None
+        return JobServer(fd, fd, owned=True)
+    try:
+        (r, w) = [int(fd) for fd in auth.split(",")]
+    except ValueError:
+        _unavailable("can't parse --jobserver-auth=%s" % auth)
+        return None
+    if r < 0 or w < 0:
+        # make's way of saying there is none
+        return None
+    if not (_is_open(r) and _is_open(w)):
+        _unavailable("its pipe isn't open, add '+' to the make rule "
+                     "running runmem")
+        return None
+    return JobServer(r, w)
+
+
+def _unavailable(why):
+    sys.stderr.write("mem: warning: jobserver unavailable (%s), "
+                     "using our own.\n" % why)
+
+
+def create(jobs):
+    """a new jobserver for jobs jobs at once"""
+    if os.name != "posix":
+        return LocalJobServer(jobs)
+    (r, w) = os.pipe()
+    os.write(w, "+" * (jobs - 1))
+    return JobServer(r, w, owned=True, jobs=jobs)
+
+
+class JobServer(object):
+    def __init__(self, read_fd, write_fd, owned=False, jobs=None):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        # whether we made (or opened) the pipe and so close it
+        self.owned = owned
+        self.jobs = jobs
+        # reads that don't block even when another process gets the
+        # token first: our own open file of the pipe, if /proc has it
+        try:
+            self.poll_fd = _cloexec(os.open("/proc/self/fd/%d" % read_fd,
+                                            os.O_RDONLY | os.O_NONBLOCK))
+        except OSError:
+            self.poll_fd = None
+        # wakes up the thread reading a token when one is released here
+        (self.wake_r, self.wake_w) = [_cloexec(fd) for fd in os.pipe()]
+
+        self.cond = threading.Condition()
+        # everybody holds one job without a token; ours is free
+        self.implicit_free = True
+        # tokens read but not handed out yet, threads in acquire(), and
+        # whether one of them is reading
+        self.tokens = []
+        self.waiting = 0
+        self.reading = False
+        # tokens to take out of circulation, after resize() shrank us
+        self.excess = 0
+
+    def acquire(self):
+        """
+        Wait for a token, returns it for release(). The first job
+        doesn't need one, None stands for that.
+        """
+        with self.cond:
+            self.waiting += 1
+            try:
+                while True:
+                    if self.implicit_free:
+                        self.implicit_free = False
+                        return None
+                    if self.tokens:
+                        return self.tokens.pop()
+                    if self.reading:
+                        self.cond.wait()
+                        continue
+                    # only one thread reads, the others wait for it
+                    self.reading = True
+                    self.cond.release()
+                    try:
+                        token = self._read()
+                    finally:
+                        self.cond.acquire()
+                        self.reading = False
+                        self.cond.notify_all()
+                    if token and self.excess:
+                        self.excess -= 1
+                    elif token:
+                        self.tokens.append(token)
+            finally:
+                self.waiting -= 1
+                if not self.waiting:
+                    # nobody needs those anymore
+                    for token in self.tokens:
+                        os.write(self.write_fd, token)
+                    del self.tokens[:]
+
+    def _read(self):
+        """a token, or None when woken up by release()"""
+        fd = self.poll_fd
+        if fd is None:
+            fd = self.read_fd
+        while True:
+            try:
+                (ready, _, _) = select.select([fd, self.wake_r], [], [])
+                if self.wake_r in ready:
+                    os.read(self.wake_r, 1 << 10)
+                    return None
+                token = os.read(fd, 1)
+            except (OSError, select.error), e:
+                if e.args[0] in (errno.EINTR, errno.EAGAIN):
+                    # somebody else got it first
+                    continue
+                raise
+            if token:
+                return token
+
+    def release(self, token):
+        with self.cond:
+            if token is None:
+                self.implicit_free = True
+            elif self.excess:
+                self.excess -= 1
+                return
+            elif self.waiting:
+                self.tokens.append(token)
+            else:
+                os.write(self.write_fd, token)
+                return
+            self.cond.notify_all()
+            if self.reading:
+                os.write(self.wake_w, "!")
+
+    def resize(self, jobs):
+        """
+        Our own jobserver: allow jobs jobs from now on. Tokens that are
+        too many now are taken out as they come back.
+        """
+        if self.jobs is None:
+            # make's, not ours to change
+            return
+        with self.cond:
+            self.excess += self.jobs - jobs
+            self.jobs = jobs
+            if self.excess < 0:
+                os.write(self.write_fd, "+" * -self.excess)
+                self.excess = 0
+            while self.excess and self.tokens:
+                self.tokens.pop()
+                self.excess -= 1
+            while self.excess and self.poll_fd is not None:
+                try:
+                    if not os.read(self.poll_fd, 1):
+                        break
+                except OSError:
+                    # none left in the pipe
+                    break
+                self.excess -= 1
+
+    def environ(self, environ):
+        """environ for a child, telling it about this jobserver"""
+        if self.jobs is None:
+            # make's, the children learn about it like we did
+            return environ
+        flags = strip_flags(environ.get("MAKEFLAGS", ""))
+        auth = "%d,%d" % (self.read_fd, self.write_fd)
+        environ = dict(environ)
+        environ["MAKEFLAGS"] = " ".join(flags.split() + [
+            "-j%d" % self.jobs, "--jobserver-fds=" + auth,
+            "--jobserver-auth=" + auth])
+        return environ
+
+    def close(self):
+        for fd in (self.poll_fd, self.wake_r, self.wake_w):
+            if fd is not None:
+                os.close(fd)
+        if self.owned:
+            os.close(self.read_fd)
+            if self.write_fd != self.read_fd:
+                os.close(self.write_fd)
+
+
+class LocalJobServer(object):
+    """
+    The same budget as a JobServer, but for this process alone: the
+    subprocesses don't learn about it.
+    """
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.semaphore = threading.Semaphore(jobs)
+        self.lock = threading.Lock()
+        self.excess = 0
+
+    def acquire(self):
+        self.semaphore.acquire()
+
+    def release(self, token):
+        with self.lock:
+            if self.excess:
+                self.excess -= 1
+                return
+        self.semaphore.release()
+
+    def resize(self, jobs):
+        with self.lock:
+            self.excess += self.jobs - jobs
+            self.jobs = jobs
+            while self.excess < 0:
+                self.semaphore.release()
+                self.excess += 1
+            while self.excess and self.semaphore.acquire(False):
+                self.excess -= 1
+
+    def environ(self, environ):
+        return environ
+
+    def close(self):
+        pass
@@ -22,6 +22,8 @@ from __future__ import with_statement
 
 from _mem import Mem
 import util
+import blob
+import trace
 
 
 import hashlib
@@ -30,6 +32,8 @@ import cPickle as pickle
 import types
 import shutil
 import sys
+import threading
+import time
 
 import exceptions
 class NodeError(exceptions.Exception):
@@ -40,9 +44,37 @@ class NodeError(exceptions.Exception):
         return self.msg
 
 
+# hash of files that don't exist
+NOT_FOUND = "NOT FOUND"
+
+
+def hash_contents(path, st):
+    """the hash of a file's content and mode; st is its stat"""
+    f = open(path, "rb")
+    s = hashlib.sha1()
+    s.update("blob %d %d\0" % (st[os.path.stat.ST_SIZE],
+                               st[os.path.stat.ST_MODE]))
+    data = f.read(1<<16)
+    while data != '':
+        s.update(data) # 64k blocks
+        data = f.read(1<<16)
+    f.close()
+    return s.hexdigest()
+
+
 class File(str):
     _hash_cache = {}
 
+    # files currently being hashed, each with an Event that is set when
+    # done; so threads that need the same file wait instead of hashing
+    # it once more
+    _hashing = {}
+    _hashing_lock = threading.Lock()
+
+    # how to copy the file into and out of the blob store, see
+    # blob.materialize(). Tasks can pass their own to the constructor.
+    materialize = blob.DEFAULT_STRATEGIES
+
     def __new__(self, file, *args, **kwargs):
 	import mem
         path = os.path.join(Mem.instance().cwd, file)
@@ -52,8 +84,10 @@ class File(str):
             raise NodeError("%s does not exist!" % path)
         return str.__new__(self, path)
 
-    def __init__(self, file, filehash=None):
+    def __init__(self, file, filehash=None, materialize=None):
         self._hash = filehash or self.get_hash()
+        if materialize is not None:
+            self.materialize = tuple(materialize)
 
     def __repr__(self):
         return "File('%s', hash='%s')" % (self, self._hash)
@@ -87,10 +121,10 @@ class File(str):
         return self.get_hash() != self._hash
 
     def _store_path(self):
-        h = self._hash
-        return os.path.join(Mem.instance().blob_dir, h[:2], h[2:])
+        return Mem.instance()._blob_path(self._hash)
 
     def restore(self):
+        Mem.instance().store.touch("blobs", self._hash)
         if not self.exists():
             self._restore()
         elif self._is_changed():
@@ -114,45 +148,97 @@ class File(str):
         #
         # If sometimes copy2 should be used (I can't think of one, but there
         # might be use cases in c development?) we should subclass this.
-        shutil.copy(self._store_path(), self)
+        if not os.path.exists(self._store_path()):
+            Mem.instance()._fetch_blobs([self._hash])
+        with trace.span("restore", "blob", path=self) as s:
+            s["strategy"] = blob.restore(self._store_path(), self,
+                                         self.materialize)
+            s["bytes"] = size = os.path.getsize(self)
+        Mem.instance().verify_restored(self)
+        Mem.instance().count("bytes_restored", size)
+        # whatever was hashed before is gone now
+        File._hash_cache[self] = self._hash
         return self
 
     def store(self):
+        """copy the file into the blob store, return the blob's hash"""
+        mem = Mem.instance()
         spath = self._store_path()
         util.ensure_file_dir(spath)
         if os.path.exists(self._store_path()):
-            return
-        shutil.copy2(self, spath)
+            mem.store.touch("blobs", self._hash)
+            return self._hash
+        with trace.span("store", "blob", path=self) as s:
+            s["strategy"] = blob.store(self, spath, self.materialize,
+                                       mem.blob_codec, mem.blob_min_size)
+            s["bytes"] = size = os.path.getsize(self)
+        mem.count("bytes_stored", size)
+        mem.store.put("blobs", self._hash, str(os.path.getsize(spath)))
+        return self._hash
 
     def get_hash(self):
         try:
             return File._hash_cache[self]
         except KeyError:
+            pass
+
+        with File._hashing_lock:
+            try:
+                return File._hash_cache[self]
+            except KeyError:
+                pass
+            done = File._hashing.get(self)
+            if done is None:
+                done = File._hashing[self] = threading.Event()
+                mine = True
+            else:
+                mine = False
+
+        if not mine:
+            done.wait()
+            try:
+                return File._hash_cache[self]
+            except KeyError:
+                # hashing failed in the other thread; try ourselves
+                return self.get_hash()
+
+        try:
             h = self._compute_hash()
             File._hash_cache[self] = h
-            return h
+        finally:
+            with File._hashing_lock:
+                del File._hashing[self]
+            done.set()
+        return h
 
     def _compute_hash(self):
-        if not self.exists():
+        try:
+            st = self.stat()
+        except OSError:
             # if the file doesn't exist, hash to something unique
             # so that cache lookup will fail
-            return "NOT FOUND"
-	f = open(self, "rb")
-        s = hashlib.sha1()
-        st = self.stat()
-        s.update("blob %d %d\0" % (st[os.path.stat.ST_SIZE],
-                                   st[os.path.stat.ST_MODE]))
-        data = f.read(1<<16)
-        while data != '':
-            s.update(data) # 64k blocks
-            data = f.read(1<<16)
-        f.close()
-        return s.hexdigest()
+            return NOT_FOUND
+
+        cache = Mem.instance().hash_cache
+        h = cache.lookup(self, st)
+        if h is None:
+            start = time.time()
+            with trace.span("hash", "hash", path=self, bytes=st.st_size):
+                h = self._hash_contents(st)
+            Mem.instance().count("hash_time", time.time() - start)
+            cache.record(self, st, h)
+        return h
+
+    def _hash_contents(self, st):
+        return hash_contents(self, st)
 
     def __getstate__(self):
         """return the part of the state to pickle when acting as a result"""
-        return {"path": self,
-                "hash": self._hash}
+        d = {"path": self,
+             "hash": self._hash}
+        if "materialize" in self.__dict__:
+            d["materialize"] = self.materialize
+        return d
 
     def __setstate__(self, d):
         """return the part of the state to pickle when acting as a result"""
@@ -160,6 +246,8 @@ class File(str):
         # is not needed and is definitively wrong, since strings
         # are immutable. Added an assert instead
         self._hash = d["hash"]
+        if "materialize" in d:
+            self.materialize = d["materialize"]
         assert(self == d['path'])
 
 
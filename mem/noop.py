@@ -0,0 +1,210 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+The no-op fast path: a build that changes nothing shouldn't have to
+run build() just to find out.
+
+After every successful build runmem records a manifest of everything
+the build depended on: the dependencies and results of all memoized
+calls, the Memfiles and every Python module that was loaded, along
+with the command line and the environment. The next runmem first
+checks the manifest by stat, hashing only dependencies whose stat
+changed; if nothing did, it is done without even importing the
+MemfileRoot. The manifest also has the directories all those files are
+in, so that a file that appears (think glob.glob() in a Memfile) or
+goes away runs build() too.
+
+Work done outside of memoized calls is skipped as well, except for
+subprocesses: a build that ran one outside of a memoized call records
+no manifest. 'runmem --no-fast-path' always runs build().
+"""
+
+import hashlib
+import os
+import sys
+import time
+
+import cPickle as pickle
+
+import jobserver
+import nodes
+
+MANIFEST_FILE = "noop"
+
+# environment variables that differ between shells without meaning
+# anything to a build
+_VOLATILE = ("_", "OLDPWD", "PWD", "SHLVL")
+# make's flags: the jobserver in them is new every time (make 4.4 even
+# names a new fifo), and -j doesn't change what gets built
+_MAKE_FLAGS = ("MAKEFLAGS", "MFLAGS")
+
+
+def context_digest(argv):
+    """what besides files could make build() do something else"""
+    env = sorted((k, k in _MAKE_FLAGS and jobserver.strip_flags(v) or v)
+                 for k, v in os.environ.items() if k not in _VOLATILE)
+    return hashlib.sha1(repr((argv, env, sys.version))).hexdigest()
+
+
+def _stat_key(st):
+    return (st.st_ino, st.st_size, st.st_mtime, st.st_mode)
+
+
+class _NotAFile(Exception):
+    pass
+
+
+def _files(o, found):
+    """collect the Files in a deps list or result"""
+    if isinstance(o, nodes.File):
+        found[str(o)] = o._hash
+    elif hasattr(o, "get_hash") or hasattr(o, "restore"):
+        # some other kind of node; we can't check those by stat
+        raise _NotAFile()
+    elif hasattr(o, "__iter__"):
+        for el in o:
+            _files(el, found)
+
+
+def _listing(path):
+    return hashlib.sha1(repr(sorted(os.listdir(path)))).hexdigest()
+
+
+def module_files():
+    """the sources of all loaded python modules"""
+    paths = set()
+    for m in sys.modules.values():
+        path = getattr(m, "__file__", None)
+        if not path:
+            continue
+        if path.endswith((".pyc", ".pyo")):
+            path = path[:-1]
+        paths.add(os.path.abspath(path))
+    return paths
+
+
+def record(mem, argv, extra_files=()):
+    """write the manifest for the build mem just did"""
+    path = os.path.join(mem.mem_dir, MANIFEST_FILE)
+    if mem.unmemoized_processes:
+        # nothing tells when those should run again, so always do
+        forget(mem.mem_dir)
+        return False
+    files = {}
+    try:
+        for deps, result in mem.calls.values():
+            _files(deps, files)
+            _files(result, files)
+    except _NotAFile:
+        forget(mem.mem_dir)
+        return False
+
+    now = time.time()
+    entries = []
+    for p in sorted(module_files().union(extra_files).union(files)):
+        try:
+            st = os.stat(p)
+        except OSError:
+            continue
+        # like the hash cache, don't trust a stat within the same
+        # second the file may still change in
+        racy = int(st.st_mtime) >= int(now)
+        h = files.get(p)
+        if h is None and racy:
+            h = nodes.hash_contents(p, st)
+        entries.append((p, _stat_key(st), racy, h))
+
+    # a directory's stat changes whenever a file in it comes or goes,
+    # or the build itself writes one; its listing tells those apart
+    dirs = []
+    for p in sorted(set(os.path.dirname(p) for p in
+                        set(extra_files).union(files))):
+        try:
+            st = os.stat(p)
+            listing = _listing(p)
+        except OSError:
+            continue
+        dirs.append((p, _stat_key(st), int(st.st_mtime) >= int(now),
+                     listing))
+
+    manifest = {"context": context_digest(argv),
+                "digest": hashlib.sha1(repr(entries)).hexdigest(),
+                "files": entries,
+                "dirs": dirs}
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    f = open(tmp, "wb")
+    try:
+        pickle.dump(manifest, f, 2)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+    return True
+
+
+def forget(mem_dir):
+    try:
+        os.unlink(os.path.join(mem_dir, MANIFEST_FILE))
+    except OSError:
+        pass
+
+
+def load(mem_dir):
+    try:
+        f = open(os.path.join(mem_dir, MANIFEST_FILE), "rb")
+    except IOError:
+        return None
+    try:
+        try:
+            return pickle.load(f)
+        except Exception:
+            return None
+    finally:
+        f.close()
+
+
+def unchanged(mem_dir, argv):
+    """True if the last build recorded a manifest and nothing changed"""
+    manifest = load(mem_dir)
+    if (manifest is None or "dirs" not in manifest or
+        manifest["context"] != context_digest(argv)):
+        return False
+    for path, key, racy, listing in manifest["dirs"]:
+        try:
+            st = os.stat(path)
+            if (racy or _stat_key(st) != key) and _listing(path) != listing:
+                return False
+        except OSError:
+            return False
+    for path, key, racy, h in manifest["files"]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if racy or _stat_key(st) != key:
+            if h is None:
+                return False
+            try:
+                if nodes.hash_contents(path, st) != h:
+                    return False
+            except IOError:
+                return False
+    return True
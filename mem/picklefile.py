@@ -0,0 +1,75 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+A dict that is kept in a pickle file between builds, for the state
+that is too small for the store and fine to lose: the hash cache and
+the task durations.
+"""
+
+from __future__ import with_statement
+
+import os
+import threading
+
+import cPickle as pickle
+
+
+class PickledDict(object):
+    """
+    self.entries, loaded from path and written back by save() if they
+    changed, which subclasses note in self.dirty (holding self.lock).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            f = open(self.path, "rb")
+        except IOError:
+            return {}
+        try:
+            try:
+                entries = pickle.load(f)
+            except Exception:
+                # a corrupt file is no reason to fail the build
+                return {}
+        finally:
+            f.close()
+
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            tmp = "%s.%d.tmp" % (self.path, os.getpid())
+            f = open(tmp, "wb")
+            try:
+                pickle.dump(self.entries, f, 2)
+            finally:
+                f.close()
+            os.rename(tmp, self.path)
+            self.dirty = False
@@ -0,0 +1,309 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+A remote cache shared between machines.
+
+The protocol is plain HTTP: every entry lives at <url>/<kind>/<key>,
+where kind is one of the store tables (deps, results, refs) or "blob"
+for the content of a file, keyed by its hash. GET returns the entry or
+404, PUT stores it. Since keys are hashes of the content (or of what
+produced it), entries never change and can be cached forever.
+
+Entries are unpickled, so only those made by someone holding the shared
+key (MEM_REMOTE_KEY) are ever used: each one starts with an HMAC of its
+kind, key and data, which is checked after every download. Blobs are
+checked against their hash instead, once restored (see
+Mem.verify_restored()). Every PUT is signed as well, in an
+X-Mem-Signature header, so that a server knowing the key can turn away
+everybody else.
+
+See cacheserver.py for a reference server.
+"""
+
+from __future__ import with_statement
+
+import hashlib
+import hmac
+import httplib
+import os
+import socket
+import sys
+import threading
+import thread
+import urlparse
+import Queue
+
+# concurrent connections for uploads and for downloads
+DEFAULT_JOBS = 4
+
+KINDS = ("deps", "results", "refs", "blob")
+
+# where the shared key comes from
+KEY_VARIABLE = "MEM_REMOTE_KEY"
+
+SIGNATURE_HEADER = "X-Mem-Signature"
+
+# the length of a signature, in hex digits
+_SIGNATURE_SIZE = 64
+
+
+class RemoteError(Exception):
+    pass
+
+
+def signer(secret, kind, key):
+    """an HMAC for the entry kind/key; update() it with the data"""
+    return hmac.new(secret, "%s/%s\0" % (kind, key), hashlib.sha256)
+
+
+def sign(secret, kind, key, data):
+    """data, as it is stored on the remote: signed"""
+    mac = signer(secret, kind, key)
+    mac.update(data)
+    return mac.hexdigest() + data
+
+
+def unsign(secret, kind, key, signed):
+    """the data in signed, or None if the signature doesn't check out"""
+    (signature, data) = (signed[:_SIGNATURE_SIZE], signed[_SIGNATURE_SIZE:])
+    mac = signer(secret, kind, key)
+    mac.update(data)
+    if not hmac.compare_digest(mac.hexdigest(), signature):
+        return None
+    return data
+
+
+def key_from_environ():
+    """the shared key, ValueError if there is none"""
+    secret = os.environ.get(KEY_VARIABLE)
+    if not secret:
+        raise ValueError("a remote cache needs a shared key in $%s" %
+                         KEY_VARIABLE)
+    return secret
+
+
+class RemoteCache(object):
+    def __init__(self, url, secret, jobs=DEFAULT_JOBS, timeout=30):
+        u = urlparse.urlsplit(url)
+        if u.scheme != "http":
+            raise ValueError("remote cache url must be http://, not %s" % url)
+        if not secret:
+            raise ValueError("a remote cache needs a shared key")
+        self.url = url
+        self.secret = secret
+        self.netloc = u.netloc
+        self.prefix = u.path.rstrip("/")
+        self.timeout = timeout
+        self.jobs = jobs
+        self.local = threading.local()
+
+        self.download_limit = threading.Semaphore(jobs)
+        self.uploads = Queue.Queue()
+        self.broken = False
+        self.workers = []
+        for _ in range(jobs):
+            t = threading.Thread(target=self._upload_worker)
+            t.setDaemon(True)
+            t.start()
+            self.workers.append(t)
+
+    #
+    # transport
+    #
+
+    def _conn(self):
+        try:
+            return self.local.conn
+        except AttributeError:
+            self.local.conn = httplib.HTTPConnection(self.netloc,
+                                                     timeout=self.timeout)
+            return self.local.conn
+
+    def _request(self, method, kind, key, body=None, headers={}):
+        """returns the response; the caller has to read it completely"""
+        assert kind in KINDS
+        path = "%s/%s/%s" % (self.prefix, kind, key)
+        for attempt in (1, 2):
+            conn = self._conn()
+            try:
+                conn.request(method, path, body, headers)
+                return conn.getresponse()
+            except (httplib.HTTPException, socket.error), e:
+                # the server may have closed our keep-alive connection
+                conn.close()
+                del self.local.conn
+                if attempt == 2 or body is not None:
+                    raise RemoteError("%s %s: %s" % (method, path, e))
+
+    def _failed(self, e):
+        if not self.broken:
+            sys.stderr.write("remote cache %s unusable, ignoring it: %s\n" %
+                             (self.url, e))
+        self.broken = True
+
+    #
+    # downloads
+    #
+
+    def get(self, kind, key):
+        """return the entry; KeyError if the remote doesn't have it"""
+        if self.broken:
+            raise KeyError(key)
+        try:
+            r = self._request("GET", kind, key)
+            data = r.read()
+        except RemoteError, e:
+            self._failed(e)
+            raise KeyError(key)
+        if r.status != 200:
+            raise KeyError(key)
+        data = unsign(self.secret, kind, key, data)
+        if data is None:
+            # not ours, don't even look at it
+            self._untrusted(kind, key)
+            raise KeyError(key)
+        return data
+
+    def _untrusted(self, kind, key):
+        sys.stderr.write("remote cache %s: ignoring %s/%s, it isn't signed "
+                         "with our key\n" % (self.url, kind, key))
+
+    def fetch_blob(self, h, path):
+        """download blob h into path; returns False if it wasn't there"""
+        if self.broken:
+            return False
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+        with self.download_limit:
+            tmp = "%s.%d.%d.tmp" % (path, os.getpid(), thread.get_ident())
+            try:
+                r = self._request("GET", "blob", h)
+                if r.status != 200:
+                    r.read()
+                    return False
+                f = open(tmp, "wb")
+                try:
+                    data = r.read(1 << 16)
+                    while data:
+                        f.write(data)
+                        data = r.read(1 << 16)
+                finally:
+                    f.close()
+                os.rename(tmp, path)
+                return True
+            except (RemoteError, httplib.HTTPException, socket.error), e:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+                self._failed(e)
+                return False
+
+    def fetch_blobs(self, blobs):
+        """
+        download several blobs in parallel, jobs at a time; blobs is a
+        list of (hash, path) tuples. Returns the hashes that could be
+        fetched.
+        """
+        todo = Queue.Queue()
+        for blob in blobs:
+            todo.put(blob)
+        fetched = []
+        def fetch():
+            while True:
+                try:
+                    (h, path) = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                if self.fetch_blob(h, path):
+                    fetched.append(h)
+
+        threads = [threading.Thread(target=fetch)
+                   for _ in range(min(self.jobs, len(blobs)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return fetched
+
+    #
+    # uploads
+    #
+
+    def _has(self, kind, key):
+        r = self._request("HEAD", kind, key)
+        r.read()
+        return r.status == 200
+
+    def _put(self, kind, key, body, length, signature):
+        r = self._request("PUT", kind, key, body,
+                          {"Content-Length": str(length),
+                           SIGNATURE_HEADER: signature})
+        r.read()
+        if r.status not in (200, 201, 204):
+            raise RemoteError("PUT %s/%s: %d %s" %
+                              (kind, key, r.status, r.reason))
+
+    def _upload(self, blobs, entries):
+        # blobs go first, so nobody can see a result whose files
+        # aren't there yet
+        for h, path in blobs:
+            if self._has("blob", h):
+                continue
+            f = open(path, "rb")
+            try:
+                mac = signer(self.secret, "blob", h)
+                for data in iter(lambda: f.read(1 << 16), ""):
+                    mac.update(data)
+                f.seek(0)
+                self._put("blob", h, f, os.fstat(f.fileno()).st_size,
+                          mac.hexdigest())
+            finally:
+                f.close()
+        for kind, key, data in entries:
+            data = sign(self.secret, kind, key, data)
+            self._put(kind, key, data, len(data),
+                      data[:_SIGNATURE_SIZE])
+
+    def _upload_worker(self):
+        while True:
+            job = self.uploads.get()
+            try:
+                if not self.broken:
+                    self._upload(*job)
+            except (RemoteError, httplib.HTTPException, socket.error), e:
+                self._failed(e)
+            except (IOError, OSError), e:
+                # a local blob went away; not the remote's fault
+                sys.stderr.write("not uploading to remote cache: %s\n" % e)
+            self.uploads.task_done()
+
+    def upload(self, blobs, entries):
+        """
+        Queue an upload of the blobs (list of (hash, path)) and then the
+        table entries (list of (kind, key, data)). Returns immediately.
+        """
+        if not self.broken:
+            self.uploads.put((blobs, entries))
+
+    def wait(self):
+        """wait for all queued uploads"""
+        self.uploads.join()
@@ -0,0 +1,112 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Counters per task function, to tell a build that missed the cache
+from one that was just slow. Mem keeps one Stats per build; runmem
+prints its table at the end and it is saved as .mem/stats.json.
+
+Work done outside of any memoized call is counted under NO_TASK.
+"""
+
+from __future__ import with_statement
+
+import json
+import os
+import threading
+
+NO_TASK = "(no task)"
+
+# name, heading, how to show it
+FIELDS = [
+    ("lookups", "lookups", "%d"),
+    ("hits", "hits", "%d"),
+    ("misses_new", "new", "%d"),
+    ("misses_changed", "changed", "%d"),
+    ("bytes_restored", "restored", "%s"),
+    ("bytes_stored", "stored", "%s"),
+    ("hash_time", "hashing", "%.2fs"),
+    ("subprocess_time", "subproc", "%.2fs"),
+    ("wait_time", "waiting", "%.2fs"),
+]
+
+
+def _size(n):
+    for unit in ("", "k", "M", "G"):
+        if n < 1024:
+            break
+        n /= 1024.0
+    return ("%d%s" if unit == "" else "%.1f%s") % (n, unit)
+
+
+class Stats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tasks = {}
+
+    def add(self, task, field, value=1):
+        with self.lock:
+            try:
+                counters = self.tasks[task]
+            except KeyError:
+                counters = self.tasks[task] = dict((f[0], 0) for f in FIELDS)
+            counters[field] += value
+
+    def get(self, task, field):
+        return self.tasks.get(task, {}).get(field, 0)
+
+    def totals(self):
+        totals = dict((f[0], 0) for f in FIELDS)
+        for counters in self.tasks.values():
+            for field in totals:
+                totals[field] += counters[field]
+        return totals
+
+    def table(self):
+        """the summary printed at the end of a build"""
+        def row(name, counters):
+            cells = []
+            for field, heading, fmt in FIELDS:
+                value = counters[field]
+                if field.startswith("bytes_"):
+                    value = _size(value)
+                cells.append((fmt % value).rjust(max(len(heading), 8)))
+            return name.ljust(width) + " " + " ".join(cells)
+
+        names = sorted(self.tasks)
+        width = max([len(n) for n in names] + [len("total")])
+        lines = [" " * width + " " + " ".join(
+            heading.rjust(max(len(heading), 8)) for _, heading, _ in FIELDS)]
+        for name in names:
+            lines.append(row(name, self.tasks[name]))
+        if len(names) > 1:
+            lines.append(row("total", self.totals()))
+        return "\n".join(lines)
+
+    def save(self, path):
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        f = open(tmp, "w")
+        try:
+            json.dump({"tasks": self.tasks, "total": self.totals()}, f,
+                      indent=1, sort_keys=True)
+        finally:
+            f.close()
+        os.rename(tmp, path)
@@ -0,0 +1,406 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Storage backends for the memoization tables.
+
+mem keeps two main tables: "deps" maps the hash of a task call to the
+dependencies it recorded, "results" maps the hash of the call plus the
+hashes of those dependencies to the pickled result. Backends only deal
+in keys and raw (already pickled) strings; Mem does the pickling.
+
+Two more tables serve the garbage collector: "refs" lists the blobs
+each result refers to, "blobs" holds the size of every file in the
+blob store. Every entry carries a stamp, the last time it was written
+or hit.
+"""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import util
+
+KINDS = ("deps", "results", "refs", "blobs")
+
+
+class Store(object):
+    """
+    Interface of a storage backend. get() raises KeyError for unknown
+    keys. Writes and touches may be buffered until flush(), which is
+    called once at the end of a build.
+    """
+    def get(self, kind, key):
+        raise NotImplementedError
+
+    def get_many(self, kind, keys):
+        """return a dict of all keys that are present"""
+        found = {}
+        for key in keys:
+            try:
+                found[key] = self.get(kind, key)
+            except KeyError:
+                pass
+        return found
+
+    def put(self, kind, key, data):
+        raise NotImplementedError
+
+    def touch(self, kind, key):
+        """mark key as used just now"""
+        raise NotImplementedError
+
+    def delete(self, kind, key):
+        raise NotImplementedError
+
+    def keys(self, kind, after=None, limit=None):
+        """
+        Return the keys of kind. With after or limit: the sorted list of
+        keys greater than after, at most limit of them.
+        """
+        raise NotImplementedError
+
+    def by_age(self, kind, limit=None):
+        """
+        return (key, stamp) tuples, least recently used first; at most
+        limit of them
+        """
+        raise NotImplementedError
+
+    def total(self, kind):
+        """sum of all values, which have to be numbers"""
+        keys = list(self.keys(kind))
+        return sum(int(v) for v in self.get_many(kind, keys).itervalues())
+
+    def flush(self):
+        pass
+
+
+class DirStore(Store):
+    """
+    The original layout: one file per entry, in .mem/deps/xx/yyyy and
+    .mem/results/xx/yyyy
+    """
+    def __init__(self, memdir):
+        self.memdir = memdir
+
+    def _path(self, kind, key):
+        return os.path.join(self.memdir, kind, key[:2], key[2:])
+
+    def exists(self):
+        for kind in KINDS:
+            if os.path.isdir(os.path.join(self.memdir, kind)):
+                return True
+        return False
+
+    def get(self, kind, key):
+        try:
+            f = open(self._path(kind, key), "rb")
+        except IOError:
+            raise KeyError(key)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def put(self, kind, key, data):
+        fp = self._path(kind, key)
+        util.ensure_file_dir(fp)
+        f = open(fp, "wb")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+    def touch(self, kind, key):
+        # the mtime of the entry serves as its stamp
+        try:
+            os.utime(self._path(kind, key), None)
+        except OSError:
+            pass
+
+    def delete(self, kind, key):
+        try:
+            os.unlink(self._path(kind, key))
+        except OSError:
+            pass
+
+    def _keys(self, kind):
+        top = os.path.join(self.memdir, kind)
+        if not os.path.isdir(top):
+            return
+        for prefix in os.listdir(top):
+            for rest in os.listdir(os.path.join(top, prefix)):
+                yield prefix + rest
+
+    # there is no index; pages are cut from everything, sorted
+
+    def keys(self, kind, after=None, limit=None):
+        if after is None and limit is None:
+            return self._keys(kind)
+        return sorted(k for k in self._keys(kind) if k > after)[:limit]
+
+    def by_age(self, kind, limit=None):
+        stamped = []
+        for key in self._keys(kind):
+            try:
+                stamped.append((os.stat(self._path(kind, key)).st_mtime, key))
+            except OSError:
+                pass
+        stamped.sort()
+        return [(key, stamp) for stamp, key in stamped[:limit]]
+
+    def remove(self):
+        for kind in KINDS:
+            shutil.rmtree(os.path.join(self.memdir, kind), True)
+
+
+class SqliteStore(Store):
+    """
+    Keeps all tables in a single sqlite database, .mem/store.db. Writes
+    are buffered in memory and go to disk in a single transaction when
+    the build finishes, so a build costs one commit no matter how many
+    tasks it ran, and the database is never locked for long.
+
+    The sum of the values of SUMMED tables is kept up to date in the
+    table "totals", so total() doesn't have to add them all up.
+    """
+    FILENAME = "store.db"
+    SUMMED = ("blobs",)
+
+    def __init__(self, memdir):
+        self.path = os.path.join(memdir, self.FILENAME)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.touched = {}
+        self.db = sqlite3.connect(self.path, timeout=60,
+                                  check_same_thread=False)
+        self.db.text_factory = str
+        for kind in KINDS:
+            self.db.execute("CREATE TABLE IF NOT EXISTS %s "
+                            "(key TEXT PRIMARY KEY, value BLOB, stamp REAL)" %
+                            kind)
+            columns = [row[1] for row in
+                       self.db.execute("PRAGMA table_info(%s)" % kind)]
+            if "stamp" not in columns:
+                self.db.execute("ALTER TABLE %s ADD COLUMN stamp REAL" % kind)
+                # from before entries were stamped; count them as used
+                # now rather than treating them apart forever
+                self.db.execute("UPDATE %s SET stamp = ?" % kind,
+                                (time.time(),))
+            self.db.execute("CREATE INDEX IF NOT EXISTS %s_stamp "
+                            "ON %s (stamp)" % (kind, kind))
+        self.db.execute("CREATE TABLE IF NOT EXISTS totals "
+                        "(kind TEXT PRIMARY KEY, total INTEGER)")
+        for kind in self.SUMMED:
+            if self._stored_total(kind) is None:
+                self.db.execute(
+                    "INSERT INTO totals (kind, total) "
+                    "SELECT ?, COALESCE(SUM(CAST(value AS INTEGER)), 0) "
+                    "FROM %s" % kind, (kind,))
+        self.db.commit()
+
+    def _stored_total(self, kind):
+        row = self.db.execute("SELECT total FROM totals WHERE kind = ?",
+                              (kind,)).fetchone()
+        return row and row[0]
+
+    def _sum_keys(self, kind, keys):
+        """the part of the database's sum of kind that keys make up"""
+        total = 0
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            row = self.db.execute(
+                "SELECT SUM(CAST(value AS INTEGER)) FROM %s "
+                "WHERE key IN (%s)" % (kind, ",".join("?" * len(chunk))),
+                chunk).fetchone()
+            total += row[0] or 0
+        return total
+
+    def _replace_in_total(self, kind, values):
+        """
+        Account for the keys of kind getting values (a dict of numbers)
+        instead of what they have in the database. The sum of the old
+        values is taken in the same write as the update, so that
+        another process's flush can't come in between.
+        """
+        keys = values.keys()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            self.db.execute(
+                "UPDATE totals SET total = total + ? - "
+                "(SELECT COALESCE(SUM(CAST(value AS INTEGER)), 0) FROM %s "
+                "WHERE key IN (%s)) WHERE kind = ?" %
+                (kind, ",".join("?" * len(chunk))),
+                [sum(values[k] for k in chunk)] + chunk + [kind])
+
+    def get(self, kind, key):
+        with self.lock:
+            try:
+                return self.pending[(kind, key)]
+            except KeyError:
+                pass
+            row = self.db.execute("SELECT value FROM %s WHERE key = ?" % kind,
+                                  (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return str(row[0])
+
+    def get_many(self, kind, keys):
+        found = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                try:
+                    found[key] = self.pending[(kind, key)]
+                except KeyError:
+                    missing.append(key)
+
+            # stay well below sqlite's limit on host parameters
+            for i in range(0, len(missing), 500):
+                chunk = missing[i:i + 500]
+                rows = self.db.execute(
+                    "SELECT key, value FROM %s WHERE key IN (%s)" %
+                    (kind, ",".join("?" * len(chunk))), chunk)
+                for key, value in rows:
+                    found[key] = str(value)
+        return found
+
+    def put(self, kind, key, data):
+        with self.lock:
+            self.pending[(kind, key)] = data
+            self.touched[(kind, key)] = time.time()
+
+    def touch(self, kind, key):
+        with self.lock:
+            self.touched[(kind, key)] = time.time()
+
+    def delete(self, kind, key):
+        with self.lock:
+            self.pending.pop((kind, key), None)
+            self.touched.pop((kind, key), None)
+            if kind in self.SUMMED:
+                self._replace_in_total(kind, {key: 0})
+            self.db.execute("DELETE FROM %s WHERE key = ?" % kind, (key,))
+
+    def keys(self, kind, after=None, limit=None):
+        with self.lock:
+            keys = set(k for (pkind, k) in self.pending if pkind == kind)
+            if after is None and limit is None:
+                keys.update(row[0] for row in
+                            self.db.execute("SELECT key FROM %s" % kind))
+                return iter(keys)
+            after = after or ""
+            keys = set(k for k in keys if k > after)
+            keys.update(row[0] for row in self.db.execute(
+                    "SELECT key FROM %s WHERE key > ? ORDER BY key "
+                    "LIMIT ?" % kind, (after, -1 if limit is None else limit)))
+        return sorted(keys)[:limit]
+
+    def by_age(self, kind, limit=None):
+        with self.lock:
+            stamps = dict(self.db.execute(
+                    "SELECT key, stamp FROM %s ORDER BY stamp LIMIT ?" % kind,
+                    (-1 if limit is None else limit,)))
+            # not flushed yet, but newer
+            stamps.update((key, stamp)
+                          for (tkind, key), stamp in self.touched.iteritems()
+                          if tkind == kind)
+        return sorted(stamps.iteritems(),
+                      key=lambda (key, stamp): stamp)[:limit]
+
+    def total(self, kind):
+        with self.lock:
+            pending = dict((key, int(data))
+                           for (pkind, key), data in self.pending.iteritems()
+                           if pkind == kind)
+            if kind in self.SUMMED:
+                total = self._stored_total(kind) or 0
+            else:
+                row = self.db.execute("SELECT SUM(CAST(value AS INTEGER)) "
+                                      "FROM %s" % kind).fetchone()
+                total = row[0] or 0
+            # pending entries replace what the database has for them
+            total += sum(pending.values())
+            total -= self._sum_keys(kind, pending.keys())
+        return total
+
+    def flush(self):
+        with self.lock:
+            for kind in KINDS:
+                if kind in self.SUMMED:
+                    self._replace_in_total(kind, dict(
+                            (key, int(data))
+                            for (pkind, key), data in self.pending.iteritems()
+                            if pkind == kind))
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO %s (key, value, stamp) "
+                    "VALUES (?, ?, ?)" % kind,
+                    [(key, sqlite3.Binary(data), self.touched.pop((kind, key)))
+                     for (pkind, key), data in self.pending.iteritems()
+                     if pkind == kind])
+                self.db.executemany(
+                    "UPDATE %s SET stamp = ? WHERE key = ?" % kind,
+                    [(stamp, key)
+                     for (tkind, key), stamp in self.touched.iteritems()
+                     if tkind == kind])
+            self.db.commit()
+            self.pending = {}
+            self.touched = {}
+
+
+STORES = {
+    "dir": DirStore,
+    "sqlite": SqliteStore,
+}
+
+
+def open_store(memdir, name=None):
+    """
+    Open the store backend called name (default: $MEM_STORE or
+    "sqlite") and migrate entries left over in the directory layout.
+    """
+    if name is None:
+        name = os.environ.get("MEM_STORE", "sqlite")
+    try:
+        store = STORES[name](memdir)
+    except KeyError:
+        raise ValueError("unknown store backend '%s'" % name)
+
+    if not isinstance(store, DirStore):
+        migrate(DirStore(memdir), store)
+    return store
+
+
+def migrate(src, dst):
+    """move all entries from the directory layout src into dst"""
+    if not src.exists():
+        return
+
+    print "Migrating %s into %s" % (src.memdir, dst.__class__.__name__)
+    for kind in KINDS:
+        for key in src.keys(kind):
+            dst.put(kind, key, src.get(kind, key))
+    dst.flush()
+    src.remove()
@@ -1 +1,35 @@
+"""
+The tasks that come with mem, one module each. A module is imported
+the first time it is used, be it through an import in a Memfile or
+like this:
 
+   import mem
+   mem.tasks.gcc.obj("hello.c")
+
+so a C project doesn't pay for the LaTeX and Cython support.
+"""
+
+import imp
+import sys
+import types
+
+
+class _Tasks(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        try:
+            imp.find_module(name, self.__path__)
+        except ImportError:
+            raise AttributeError("mem.tasks has no task module %r" % name)
+        __import__("%s.%s" % (self.__name__, name))
+        return sys.modules["%s.%s" % (self.__name__, name)]
+
+
+_tasks = _Tasks(__name__, __doc__)
+_tasks.__dict__.update(
+    (k, v) for k, v in globals().items() if k.startswith("__"))
+# python 2 clears the globals of a module that's gone, and the class
+# above needs them
+_tasks._module = sys.modules[__name__]
+sys.modules[__name__] = _tasks
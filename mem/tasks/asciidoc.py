@@ -30,7 +30,7 @@ scanner_re = re.compile("include::(.+)\[\]")
 
 def scan(file):
     path = os.path.dirname(file)
-    f = open(file, "r")
+    f = open(mem.path(file), "r")
     try:
         l = f.readline()
         incs = []
@@ -57,7 +57,7 @@ def t_asciidoc(target, source, ASCIIDOC_FLAGS):
     print " ".join(cmd)
 
     mem.util.ensure_file_dir(target)
-    if subprocess.call(cmd) != 0:
+    if mem.util.call(cmd, cwd=mem.Mem.instance().cwd) != 0:
         mem.fail()
 
     return mem.nodes.File(target)
@@ -70,12 +70,12 @@ def asciidoc(source, build_dir=None, env=None, ASCIIDOC_FLAGS=[]):
     sources = mem.util.flatten(source)
     BuildDir = mem.util.get_build_dir(env, build_dir)
 
-    out = []
+    futures = []
     for src in sources:
         (name, ext) = os.path.splitext(str(src))
         target = os.path.join(BuildDir, name + ".html")
 
-        out.append(t_asciidoc(target, src,
-                              env=env, ASCIIDOC_FLAGS=ASCIIDOC_FLAGS))
+        futures.append(mem.Mem.instance().submit(
+            t_asciidoc, target, src, env=env, ASCIIDOC_FLAGS=ASCIIDOC_FLAGS))
 
-    return out
+    return mem.Mem.instance().gather(futures)
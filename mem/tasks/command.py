@@ -18,7 +18,8 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import commands
+import subprocess
+
 import mem
 
 @mem.memoize
@@ -29,8 +30,15 @@ def command(cmd):
 def always_command(cmd):
     """ Runs the specified command """
     print cmd
-    (stat, out) = commands.getstatusoutput(cmd)
-    if stat:
+    p = mem.util.popen(cmd, shell=True, cwd=mem.Mem.instance().cwd,
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        out = p.communicate()[0]
+    finally:
+        mem.util.wait(p)
+    if out.endswith("\n"):
+        out = out[:-1]
+    if p.returncode:
         mem.fail(cmd + ":" + out)
 
     return None
@@ -22,6 +22,7 @@ import os
 import mem
 
 def symlink(target, sources):
+    target = mem.path(target)
     is_dir = os.path.isdir(target)
     for s in sources:
         if is_dir:
@@ -22,7 +22,6 @@ import os
 import subprocess
 from subprocess import PIPE
 import sys
-from threading import Thread
 
 import mem
 from mem._mem import Mem
@@ -153,26 +152,22 @@ def t_prog(target, objs, CC, CFLAGS, LIBS, LIBPATH, LINKFLAGS):
 
 
 def build_obj(target, source, ext, env=None, **kwargs):
+    """submit the build of an object, returns its future"""
     if ext == ".c":
-        t = util.Runable(t_c_obj, target, source, env=env, **kwargs)
-        t.start()
-        return t
-
+        return Mem.instance().submit(t_c_obj, target, source, env=env,
+                                     **kwargs)
     elif ext == ".cpp":
-        t = util.Runable(t_cpp_obj, target, source, env=env, **kwargs)
-        t.start()
-        return t
+        return Mem.instance().submit(t_cpp_obj, target, source, env=env,
+                                     **kwargs)
     else:
         Mem.instance().fail("Don't know how to build %s" % source)
 
-    return t
-
 
 def obj(source_list, target=None, env=None, build_dir=None, **kwargs):
     """ Take a list of sources and convert them to a correct object file """
 
     BuildDir = util.get_build_dir(env, build_dir)
-    threads = []
+    futures = []
 
     if not type(source_list) == list:
             source_list = [source_list]
@@ -185,7 +180,7 @@ def obj(source_list, target=None, env=None, build_dir=None, **kwargs):
         buildext = None
         new_source_list = []
         for source in nslist:
-            source = os.path.join(os.getcwd(), source)
+            source = Mem.instance().path(source)
             (name, ext) = os.path.splitext(str(source))
             if buildext == None:
                 buildext = ext
@@ -194,32 +189,27 @@ def obj(source_list, target=None, env=None, build_dir=None, **kwargs):
             new_source_list.append(source)
 
         t = os.path.join(BuildDir, str(target))
-        thread = build_obj(t, new_source_list, buildext, env, **kwargs)
-        thread.join()
-        return [thread.result]
+        return [build_obj(t, new_source_list, buildext, env,
+                          **kwargs).result()]
 
     # No target specified.  Build each object individually
     for source in nslist:
         (name, ext) = os.path.splitext(os.path.basename(str(source)))
         target = os.path.join(BuildDir,  name + ".o")
 
-        source = os.path.join(os.getcwd(), str(source))
+        source = Mem.instance().path(str(source))
         if not ext == ".h":
-            threads.append(build_obj(target, [source], ext, env, **kwargs))
+            futures.append(build_obj(target, [source], ext, env, **kwargs))
 
-    for t in threads:
-        if t:
-            t.join()
-
-    return [t.result for t in threads if t]
+    return Mem.instance().gather(futures)
 
 def prog(target, objs, env=None, build_dir = None, **kwargs):
     """ Convert the list of objects into a program given the cflags """
     nobjs = util.flatten(objs)
     BuildDir = util.get_build_dir(env, build_dir)
     ntarget = os.path.join(BuildDir, target)
-    t_prog(ntarget, nobjs, env=env, **kwargs)
-    return nodes.File(ntarget)
+    # the File t_prog() returned; a dry run may have nothing built
+    return t_prog(ntarget, nobjs, env=env, **kwargs)
 
 def shared_obj(target, objs, env=None, build_dir = None, **kwargs):
     """ Convert the list of objects into a program given the cflags """
@@ -235,6 +225,4 @@ def shared_obj(target, objs, env=None, build_dir = None, **kwargs):
 
     merged_CFLAGS.insert(0, "-shared")
 
-    t_prog(ntarget, nobjs, env=env, CFLAGS=merged_CFLAGS, **kwargs)
-
-    return nodes.File(ntarget)
+    return t_prog(ntarget, nobjs, env=env, CFLAGS=merged_CFLAGS, **kwargs)
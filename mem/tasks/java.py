@@ -19,7 +19,6 @@
 # SOFTWARE.
 
 import os
-import subprocess
 
 import mem
 from mem import nodes
@@ -33,7 +32,7 @@ def _compile(sources, JAVA_PACKAGE, JAVA_BUILD_DIR, JAVA_FLAGS):
     args = (["javac", "-d", JAVA_BUILD_DIR, "-cp", JAVA_BUILD_DIR] +
             JAVA_FLAGS + sources)
     print " ".join(args)
-    if subprocess.call(args) != 0:
+    if mem.util.call(args, cwd=mem.Mem.instance().cwd) != 0:
         mem.fail()
 
     def src_path_to_dest_file(p):
@@ -49,7 +48,7 @@ def compile(sources, env=None, **kwargs):
     if not type(sources) == list:
         sources = [sources]
     else:
-        sources = [os.path.join(os.getcwd(), str(source))
+        sources = [mem.path(str(source))
                    for source in mem.util.flatten(sources)]
         sources.sort()
 
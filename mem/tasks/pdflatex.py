@@ -1,4 +1,6 @@
 
+from __future__ import with_statement
+
 import os
 import subprocess
 from subprocess import PIPE
@@ -90,14 +92,14 @@ class PDFLatexBuilder(object):
         """
         # Search for graphic dependencies
         for fname in self._find_potential_graphic_deps(s):
-            if os.path.exists(fname) and fname not in self._deps:
+            if os.path.exists(mem.path(fname)) and fname not in self._deps:
                 self._deps.append(fname)
 
         # Find latex dependencies
         for fname in self._find_potential_latex_deps(s):
-            if os.path.exists(fname) and fname not in self._deps:
+            if os.path.exists(mem.path(fname)) and fname not in self._deps:
                 self._deps.append(fname)
-                self._find_dependencies(open(fname,"r").read())
+                self._find_dependencies(open(mem.path(fname),"r").read())
 
     def _validate_target(self, target):
         if os.path.splitext(target)[1].lower() != '.pdf':
@@ -126,7 +128,8 @@ class PDFLatexBuilder(object):
             raise RuntimeError("Only takes a single source tex file!")
 
         mem.add_dep(mem.util.convert_to_file(source))
-        self._find_dependencies(open(source, "r").read())
+        with mem.trace.span("LaTeX depends", "scan", source=source):
+            self._find_dependencies(open(mem.path(source), "r").read())
 
         # Add all the recursively found dependencies
         for d in self._deps:
@@ -5,6 +5,8 @@
 Support for building python extensions
 """
 
+from __future__ import with_statement
+
 # Sadly, we cannot extend shared_obj in a nice and proper way, since it isn't
 # a class. We therefore have to rip a leg out to do something in that order,
 # a lot of code duplication is not avoidable :(
@@ -115,9 +117,9 @@ class CythonBuilder(object):
                 # (which we currently do not track) or the file
                 # might not exist, which is not our problem, but cythons
                 for path in self.include_paths + ['']:
-                    filename = os.path.relpath(os.path.join(path, dep))
-                    if os.path.exists(filename):
-                        self._find_deps(open(filename,"r").read())
+                    filename = os.path.normpath(os.path.join(path, dep))
+                    if os.path.exists(util.in_cwd(filename)):
+                        self._find_deps(open(util.in_cwd(filename),"r").read())
                     self.deps.add(filename)
 
     def _find_deps_direct(self, s):
@@ -129,9 +131,9 @@ class CythonBuilder(object):
                 # (which we currently do not track) or the file
                 # might not exist, which is not our problem, but cythons
                 for path in self.include_paths + ['']:
-                    filename = os.path.relpath(os.path.join(path, dep))
-                    if os.path.exists(filename):
-                        self._find_deps(open(filename,"r").read())
+                    filename = os.path.normpath(os.path.join(path, dep))
+                    if os.path.exists(util.in_cwd(filename)):
+                        self._find_deps(open(util.in_cwd(filename),"r").read())
                     self.deps.add(filename)
 
     def _find_deps_cheader(self, s):
@@ -152,15 +154,16 @@ class CythonBuilder(object):
         # We might also depend on our definition file
         # if it exists
         pxd = os.path.splitext(source)[0] + '.pxd'
-        if os.path.exists(pxd):
-            self.deps.add(pxd)
-            self._find_deps(open(pxd, "r").read())
+        with mem.trace.span("Cython depends", "scan", source=source):
+            if os.path.exists(util.in_cwd(pxd)):
+                self.deps.add(pxd)
+                self._find_deps(open(util.in_cwd(pxd), "r").read())
 
-        self._find_deps(open(source,"r").read())
-        self.deps = [ d for d in self.deps if os.path.exists(d) ]
+            self._find_deps(open(util.in_cwd(source),"r").read())
+        self.deps = [ d for d in self.deps
+                      if os.path.exists(util.in_cwd(d)) ]
 
-        mem = Mem.instance()
-        mem.add_deps([ nodes.File(f) for f in self.deps ])
+        Mem.instance().add_deps([ nodes.File(f) for f in self.deps ])
 
         args = util.convert_cmd(["cython"] +
                 ['-I' + path for path in self.include_paths ] +
@@ -182,7 +185,7 @@ def _run_cython(cfile, source, CYTHON_INCLUDE):
 # Main Extension Dispatchers #
 ##############################
 def _python_obj(source, env, build_dir, **kwargs):
-    if not os.path.exists(str(source)):
+    if not os.path.exists(util.in_cwd(str(source))):
         Mem.instance().fail("%s does not exist" % source)
 
     target = os.path.join(build_dir, os.path.splitext(source)[0] + '.o')
@@ -225,15 +228,18 @@ def python_ext(target, sources, env={}, build_dir = "", inplace = False,
 
     build_dir = util.get_build_dir(env, build_dir)
 
-    all_objs = []
+    futures = []
     for source in util.flatten(sources):
         ext = os.path.splitext(source)[1].lower()
         if ext not in _EXTENSION_DISPATCH:
             raise ValueError("Don't know how to build extension from source %s"
                     % source)
 
-        objs = _EXTENSION_DISPATCH[ext](source, env or {}, build_dir, **kwargs)
+        futures.append(mem.submit(_EXTENSION_DISPATCH[ext], source, env or {},
+                                  build_dir, **kwargs))
 
+    all_objs = []
+    for objs in mem.gather(futures):
         all_objs.extend(objs)
 
     target += '.so'
@@ -78,17 +78,11 @@ def obj(sources, env=None, build_dir=None, **kwargs):
     sources = mem.util.flatten(sources)
     BuildDir = mem.util.get_build_dir(env, build_dir)
 
+    futures = [mem.Mem.instance().submit(generate, BuildDir, source, env=env)
+               for source in sources]
     targets = []
-    threads = []
-    for source in sources:
-        (name, ignore) = os.path.splitext(str(source))
-        t = mem.util.Runable(generate, BuildDir, source, env=env)
-        t.start()
-        threads.append(t)
-
-    for t in threads:
-        t.join()
-        targets.extend(t.result)
+    for result in mem.Mem.instance().gather(futures):
+        targets.extend(result)
 
     ntargets = []
     ctargets = []
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import shutil
+import tempfile
+
+import mem
+
+
+class TempRootTest(object):
+    """
+    Base for unit tests that need a live Mem singleton; creates a
+    throw-away build root and cleans up after itself.
+    """
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        os.chdir(self.root)
+        self.mem = mem.Mem(self.root)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        mem.Mem.destroy()
+        shutil.rmtree(self.root)
+
+    def restart(self):
+        """finish the current build and start a fresh one on the same root"""
+        self.mem.finish()
+        mem.Mem.destroy()
+        self.mem = mem.Mem(self.root)
+
+    def write(self, name, data, age=None):
+        path = os.path.join(self.root, name)
+        f = open(path, "wb")
+        f.write(data)
+        f.close()
+        if age is not None:
+            t = os.stat(path).st_mtime - age
+            os.utime(path, (t, t))
+        return path
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import signal
+import threading
+import time
+
+from mem import util
+from mem.executor import Executor
+
+from memtest import TempRootTest
+
+
+def _until(cond, timeout=5):
+    end = time.time() + timeout
+    while not cond():
+        ok_(time.time() < end)
+        time.sleep(0.01)
+
+
+class Test_Cancel(object):
+    def test_queued_dont_start(self):
+        ex = Executor(1)
+        release = threading.Event()
+        ran = []
+        blocker = ex.submit(release.wait)
+        _until(lambda: ex.running == 1)
+        queued = ex.submit(ran.append, 1)
+        ex.cancel()
+        release.set()
+        blocker.result()
+        assert_raises(SystemExit, queued.result)
+        eq_(ran, [])
+        eq_(ex.submit(lambda: 2).result(), 2)
+
+
+class Test_Abort(TempRootTest):
+    def test_fail_kills_subprocesses(self):
+        start = time.time()
+        futures = [self.mem.submit(util.call, "sleep 30; exit 0", shell=True)
+                   for _ in range(2)]
+        _until(lambda: len(util._processes) == 2)
+        assert_raises(SystemExit, self.mem.fail, "test")
+        eq_([f.result() for f in futures], [-15, -15])
+        ok_(time.time() - start < 10)
+        eq_(util._processes, {})
+
+    def test_sigterm_kills_subprocesses(self):
+        p = util.popen(["sleep", "30"])
+        eq_(os.getsid(p.pid), p.pid)
+        assert_raises(SystemExit, util._terminated, signal.SIGTERM, None)
+        eq_(util.wait(p), -15)
+
+    def test_queued_tasks_dont_start(self):
+        self.mem.concurrency(1)
+        release = threading.Event()
+        ran = []
+        blocker = self.mem.submit(release.wait)
+        _until(lambda: self.mem.executor.running == 1)
+        queued = self.mem.submit(ran.append, 1)
+        self.mem.abort()
+        release.set()
+        blocker.result()
+        assert_raises(SystemExit, queued.result)
+        eq_(ran, [])
+
+    def test_nothing_starts_after_failure(self):
+        self.mem.abort()
+        assert_raises(SystemExit, util.call, ["sleep", "30"])
+        eq_(util._processes, {})
+
+
+class _Process(object):
+    pid = -1
+
+    def __init__(self):
+        self.terminated = False
+
+    def terminate(self):
+        self.terminated = True
+
+
+def test_kill_without_process_groups():
+    name = os.name
+    os.name = "nt"
+    try:
+        p = _Process()
+        util._kill(p, signal.SIGTERM)
+        ok_(p.terminated)
+    finally:
+        os.name = name
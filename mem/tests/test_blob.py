@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+from mem import blob
+
+
+class Test_Materialize(object):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.dir, "src")
+        f = open(self.src, "wb")
+        f.write("x" * 100000)
+        f.close()
+        os.chmod(self.src, 0755)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _check(self, dst):
+        eq_(open(dst, "rb").read(), "x" * 100000)
+        eq_(stat.S_IMODE(os.stat(dst).st_mode),
+            stat.S_IMODE(os.stat(self.src).st_mode))
+
+    def test_each_strategy(self):
+        for strategy in (blob.KERNEL, blob.COPY):
+            dst = os.path.join(self.dir, strategy, "dst")
+            eq_(blob.materialize(self.src, dst, (strategy,)), strategy)
+            self._check(dst)
+
+    def test_default_never_links_writable_files(self):
+        dst = os.path.join(self.dir, "dst")
+        ok_(blob.materialize(self.src, dst) != blob.HARDLINK)
+        ok_(not os.path.samefile(self.src, dst))
+        self._check(dst)
+
+    def test_hardlink_read_only(self):
+        os.chmod(self.src, 0444)
+        t = time.time() - 100
+        os.utime(self.src, (t, t))
+        dst = os.path.join(self.dir, "dst")
+
+        eq_(blob.materialize(self.src, dst, (blob.HARDLINK, blob.COPY)),
+            blob.HARDLINK)
+        ok_(os.path.samefile(self.src, dst))
+        ok_(os.stat(dst).st_mtime > t + 50)
+
+    def test_replaces_existing(self):
+        dst = os.path.join(self.dir, "dst")
+        open(dst, "wb").write("old")
+        blob.materialize(self.src, dst)
+        self._check(dst)
+
+    def test_falls_back(self):
+        dst = os.path.join(self.dir, "dst")
+        eq_(blob.materialize(self.src, dst, (blob.HARDLINK, blob.COPY)),
+            blob.COPY)
+        self._check(dst)
+
+    def test_not_posix(self):
+        dst = os.path.join(self.dir, "dst")
+        name = os.name
+        os.name = "nt"
+        try:
+            eq_(blob.materialize(self.src, dst), blob.COPY)
+        finally:
+            os.name = name
+        self._check(dst)
+
+
+class Test_Compression(object):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.dir, "src")
+        f = open(self.src, "wb")
+        f.write("".join("line %d\n" % i for i in range(100000)))
+        f.close()
+        self.blob = os.path.join(self.dir, "blob", "ab")
+        self.dst = os.path.join(self.dir, "dst")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_roundtrip(self):
+        for codec in blob.CODECS:
+            eq_(blob.store(self.src, self.blob, codec=codec), codec)
+            eq_(blob.codec_of(self.blob), codec)
+            ok_(os.path.getsize(self.blob) < os.path.getsize(self.src) / 3)
+
+            eq_(blob.restore(self.blob, self.dst), codec)
+            eq_(open(self.dst, "rb").read(), open(self.src, "rb").read())
+
+    def test_small_files_stay_plain(self):
+        blob.store(self.src, self.blob, codec="zlib", min_size=1 << 30)
+        eq_(blob.codec_of(self.blob), None)
+        eq_(open(self.blob, "rb").read(), open(self.src, "rb").read())
+
+    def test_plain_blob_restores(self):
+        blob.store(self.src, self.blob)
+        ok_(blob.restore(self.blob, self.dst) in blob.DEFAULT_STRATEGIES)
+        eq_(open(self.dst, "rb").read(), open(self.src, "rb").read())
+
+    def test_unknown_codec(self):
+        assert_raises(ValueError, blob.store, self.src, self.blob,
+                      codec="nope")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import sys
+import threading
+import time
+from StringIO import StringIO
+
+from mem import buildclient, buildserver
+
+from memtest import TempRootTest
+
+
+def _until(condition):
+    while not condition():
+        time.sleep(0.001)
+
+
+class _Resident(object):
+    """does pretend builds"""
+    def __init__(self):
+        self.builds = []
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+
+    def poll(self):
+        pass
+
+    def build(self, argv, show_stats=True):
+        self.started.set()
+        self.release.wait()
+        self.builds.append(argv)
+        print "building", " ".join(argv)
+        sys.stderr.write("warning: %s\n" % os.environ.get("MEM_TEST_CC"))
+        return "fail" not in argv
+
+
+class Test_BuildServer(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        self.resident = _Resident()
+        self.server = buildserver.BuildServer(
+            buildclient.socket_path(self.root), self.resident,
+            __import__("mem")._option_parser())
+        self.thread = threading.Thread(target=self.server.run)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join()
+        self.server.close()
+        TempRootTest.tearDown(self)
+
+    def forward(self, argv):
+        out = StringIO()
+        err = StringIO()
+        code = buildclient.forward(self.root, argv, out, err)
+        return code, out.getvalue(), err.getvalue()
+
+    def test_forward(self):
+        os.environ["MEM_TEST_CC"] = "clang"
+        try:
+            eq_(self.forward(["--no-stats"]),
+                (0, "building --no-stats\n", "warning: clang\n"))
+        finally:
+            del os.environ["MEM_TEST_CC"]
+        ok_("MEM_TEST_CC" not in os.environ)
+
+    def test_bytes(self):
+        # gcc's quotes in UTF-8, and some Latin-1
+        os.environ["MEM_TEST_CC"] = "\xe2\x80\x98cc\xe2\x80\x99 \xe9"
+        try:
+            eq_(self.forward(["--no-stats", "\xff"]),
+                (0, "building --no-stats \xff\n",
+                 "warning: \xe2\x80\x98cc\xe2\x80\x99 \xe9\n"))
+        finally:
+            del os.environ["MEM_TEST_CC"]
+
+    def test_failure(self):
+        eq_(self.forward(["fail"])[0], 1)
+
+    def test_usage_error(self):
+        code, out, err = self.forward(["--bogus"])
+        eq_(code, 2)
+        ok_("--bogus" in err)
+        eq_(self.resident.builds, [])
+
+    def test_no_server(self):
+        self.server.close()
+        eq_(buildclient.forward(self.root, []), None)
+
+    def test_merge(self):
+        self.resident.release.clear()
+        running = threading.Thread(target=self.forward, args=(["--trace",
+                                                               "a"],))
+        running.start()
+        self.resident.started.wait()
+        results = []
+        clients = [threading.Thread(
+            target=lambda: results.append(self.forward(["--no-stats"])))
+                   for _ in range(3)]
+        for c in clients:
+            c.start()
+        _until(lambda: sum(len(b.clients) for b in self.server.queue) == 3)
+        eq_(len(self.server.queue), 1)
+        self.resident.release.set()
+        for c in clients + [running]:
+            c.join()
+        eq_(self.resident.builds, [["--trace", "a"], ["--no-stats"]])
+        eq_([r[0] for r in results], [0, 0, 0])
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import time
+
+import cPickle as pickle
+
+from mem import cachegc
+from mem.nodes import File
+
+from memtest import TempRootTest
+
+
+class Test_Parse(object):
+    def test_size(self):
+        eq_(cachegc.parse_size("100"), 100)
+        eq_(cachegc.parse_size("2k"), 2048)
+        eq_(cachegc.parse_size("1GB"), 1 << 30)
+        eq_(cachegc.parse_size(None), None)
+
+    def test_age(self):
+        eq_(cachegc.parse_age("90"), 90)
+        eq_(cachegc.parse_age("2h"), 7200)
+        eq_(cachegc.parse_age("1d"), 86400)
+
+
+class Test_Collect(TempRootTest):
+    def _result(self, name, data):
+        """pretend a task produced a file and was memoized"""
+        f = File(self.write(name, data))
+        blob = f.store()
+        self.mem.store.put("results", "r" + blob, pickle.dumps(f))
+        self.mem.store.put("refs", "r" + blob, blob)
+        self.mem.store.flush()
+        return blob
+
+    def _age(self, kind, key, age):
+        self.mem.store.db.execute("UPDATE %s SET stamp = ? WHERE key = ?" %
+                                  kind, (time.time() - age, key))
+
+    def test_nothing_to_do(self):
+        blob = self._result("a.o", "aaaa")
+        cachegc.collect(self.mem, max_bytes=1000)
+        ok_(os.path.exists(self.mem._blob_path(blob)))
+
+    def test_lru_blob_evicted_first(self):
+        old = self._result("a.o", "a" * 100)
+        new = self._result("b.o", "b" * 100)
+        self._age("blobs", old, 60)
+
+        removed = cachegc.collect(self.mem, max_bytes=150)
+
+        eq_(removed["blobs"], 1)
+        ok_(not os.path.exists(self.mem._blob_path(old)))
+        ok_(os.path.exists(self.mem._blob_path(new)))
+
+    def test_restored_blob_kept_by_build(self):
+        used = self._result("a.o", "a" * 100)
+        unused = self._result("b.o", "b" * 100)
+        self._age("blobs", used, 60)
+        self._age("blobs", unused, 30)
+        self.mem.store.db.commit()
+        target = os.path.join(self.root, "a.o")
+        os.unlink(target)
+        pickle.loads(self.mem.store.get("results", "r" + used)).restore()
+
+        self.mem.gc_policy(150)
+        self.mem.finish()
+
+        ok_(os.path.exists(self.mem._blob_path(used)))
+        ok_(not os.path.exists(self.mem._blob_path(unused)))
+
+    def test_dangling_result_dropped(self):
+        blob = self._result("a.o", "aaaa")
+        cachegc.collect(self.mem, max_bytes=0)
+
+        assert_raises(KeyError, self.mem.store.get, "results", "r" + blob)
+        assert_raises(KeyError, self.mem.store.get, "refs", "r" + blob)
+
+    def test_max_age(self):
+        self.mem.store.put("deps", "d1", "deps")
+        self.mem.store.put("deps", "d2", "deps")
+        self.mem.store.flush()
+        self._age("deps", "d1", 7200)
+
+        cachegc.collect(self.mem, max_age=3600)
+
+        eq_(list(self.mem.store.keys("deps")), ["d2"])
+
+    def test_pages(self):
+        blobs = [self._result("%d.o" % i, str(i) * 100) for i in range(5)]
+        for i, blob in enumerate(blobs):
+            self._age("blobs", blob, 100 - i)
+        page_size = cachegc.PAGE_SIZE
+        cachegc.PAGE_SIZE = 2
+        try:
+            removed = cachegc.collect(self.mem, max_bytes=100)
+        finally:
+            cachegc.PAGE_SIZE = page_size
+        eq_((removed["blobs"], removed["results"]), (4, 4))
+        eq_(list(self.mem.store.keys("refs")), ["r" + blobs[-1]])
+
+    def test_pass_reads_pages(self):
+        for i in range(5):
+            self._result("%d.o" % i, str(i) * 100)
+        store = self.mem.store
+        reads = []
+        def paged(method):
+            def read(kind, *args):
+                reads.append((method.__name__, args[-1:]))
+                return method(kind, *args)
+            return read
+        store.keys = paged(store.keys)
+        store.by_age = paged(store.by_age)
+
+        cachegc.collect(self.mem, max_bytes=1000, max_age=3600,
+                        time_limit=10)
+
+        ok_(reads)
+        eq_([r for r in reads if r[1] != (cachegc.PAGE_SIZE,)], [])
+
+    def test_full_indexes_old_results(self):
+        blob = self._result("a.o", "aaaa")
+        self.mem.store.delete("refs", "r" + blob)
+        self.mem.store.delete("blobs", blob)
+        self.mem.store.flush()
+
+        cachegc.collect(self.mem, full=True)
+
+        eq_(self.mem.store.get("refs", "r" + blob), blob)
+        eq_(self.mem.store.get("blobs", blob), "4")
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import StringIO
+
+import mem
+import mem.tasks.gcc
+from mem import dryrun, util
+from mem.nodes import File
+
+from memtest import TempRootTest
+
+
+_runs = []
+
+@mem.memoize
+def _obj(target, source):
+    _runs.append(target)
+    mem.add_dep(File(source))
+    f = open(target, "wb")
+    f.write("compiled " + open(source).read())
+    f.close()
+    return File(target)
+
+@mem.memoize
+def _prog(target, objs):
+    _runs.append(target)
+    f = open(target, "wb")
+    for o in objs:
+        f.write(open(o).read())
+    f.close()
+    return File(target)
+
+
+class Test_DryRun(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        self.write("a.c", "int a;\n")
+        self.write("b.c", "int b;\n")
+        self.build()
+        self.restart()
+        self.mem.dry_run = dryrun.Report(self.mem)
+        del _runs[:]
+
+    def build(self, sources=("a", "b")):
+        objs = [_obj(os.path.join(self.root, s + ".o"),
+                     os.path.join(self.root, s + ".c"))
+                for s in sources]
+        return _prog(os.path.join(self.root, "prog"), objs)
+
+    def entries(self):
+        return self.mem.dry_run.entries
+
+    def test_all_hits(self):
+        eq_(self.build(), os.path.join(self.root, "prog"))
+        eq_([e[0] for e in self.entries()], ["hit"] * 3)
+        eq_(_runs, [])
+
+    def test_changed(self):
+        self.write("a.c", "int aa;\n")
+        result = self.build()
+        ok_(isinstance(result, dryrun.Unknown))
+        eq_(self.entries(), [
+            ("miss", "_obj(a.o)", "changed: a.c"),
+            ("hit", "_obj(b.o)", ""),
+            ("unknown", "_prog(prog)", "needs the result of _obj(a.o)")])
+        eq_(_runs, [])
+        eq_(open(os.path.join(self.root, "a.o")).read(), "compiled int a;\n")
+
+    def test_new(self):
+        self.write("c.c", "int c;\n")
+        self.build(("a", "b", "c"))
+        eq_(self.entries()[2], ("miss", "_obj(c.o)", "new"))
+        eq_(self.entries()[3][0], "unknown")
+
+    def test_gone(self):
+        os.unlink(os.path.join(self.root, "b.c"))
+        self.build()
+        eq_(self.entries()[1], ("miss", "_obj(b.o)", "gone: b.c"))
+
+    def test_restore(self):
+        target = os.path.join(self.root, "a.o")
+        os.unlink(target)
+        self.build()
+        eq_(self.entries(), [
+            ("hit", "_obj(a.o)", "restores a.o"),
+            ("hit", "_obj(b.o)", ""),
+            ("hit", "_prog(prog)", "")])
+        ok_(not os.path.exists(target))
+
+    def test_once_per_call(self):
+        self.build()
+        self.build()
+        eq_(len(self.entries()), 3)
+
+    def test_commands_dont_run(self):
+        side_effect = os.path.join(self.root, "side-effect")
+        eq_(util.call(["touch", side_effect]), 0)
+        eq_(util._open_pipe_("touch " + side_effect, True), (0, "", ""))
+        ok_(not os.path.exists(side_effect))
+        eq_(self.entries()[0], ("skipped", "touch " + side_effect,
+                                "outside of memoized calls"))
+        eq_(util._processes, {})
+
+    def test_write(self):
+        self.write("a.c", "int aa;\n")
+        self.build()
+        out = StringIO.StringIO()
+        self.mem.dry_run.write(out)
+        lines = out.getvalue().splitlines()
+        eq_(lines[0], "miss     _obj(a.o)  (changed: a.c)")
+        eq_(lines[-1], "dry run: 1 up to date, 1 would run, 1 unknown")
+
+
+class Test_DryRunGcc(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        self.write("hello.c", "int main(void) { return 0; }\n")
+        self.env = util.Env(CFLAGS=[], BUILD_DIR="build")
+        self.target = os.path.join(self.root, "build", "hello")
+
+    def build(self):
+        objs = mem.tasks.gcc.obj(["hello.c"], env=self.env)
+        return mem.tasks.gcc.prog("hello", objs, env=self.env)
+
+    def dry_run(self):
+        self.mem.dry_run = dryrun.Report(self.mem)
+        return self.build()
+
+    def test_fresh_tree(self):
+        result = self.dry_run()
+        ok_(isinstance(result, dryrun.Unknown))
+        eq_([e[0] for e in self.mem.dry_run.entries], ["miss", "unknown"])
+        ok_(not os.path.exists(os.path.join(self.root, "build")))
+
+    def test_program_deleted(self):
+        self.build()
+        self.restart()
+        os.unlink(self.target)
+        eq_(self.dry_run(), self.target)
+        eq_(self.mem.dry_run.entries[-1][2], "restores build/hello")
+        ok_(not os.path.exists(self.target))
+
+    def test_object_deleted(self):
+        self.build()
+        self.restart()
+        obj = os.path.join(self.root, "build", "hello.o")
+        os.unlink(obj)
+        eq_(self.dry_run(), self.target)
+        eq_(self.mem.dry_run.entries, [
+            ("hit", "t_c_obj(build/hello.o)", "restores build/hello.o"),
+            ("hit", "t_prog(build/hello)", "")])
+        ok_(not os.path.exists(obj))
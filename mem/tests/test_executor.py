@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import threading
+import time
+
+import mem
+from mem.durations import task_key
+from mem.executor import Executor, TaskQueue
+
+from memtest import TempRootTest
+
+
+def _work(name, order):
+    order.append(name)
+
+
+@mem.memoize
+def _compile(target):
+    time.sleep(0.05)
+    return target
+
+
+_sharing = {}
+
+@mem.memoize
+def _shared(target):
+    if threading.currentThread().getName() == "owner":
+        # a task is to wait for this very call, then we need a slot
+        m = mem.Mem.instance()
+        _sharing["waiter"] = m.submit(_shared, target)
+        _sharing["waiting"].wait()
+        time.sleep(0.05)
+        m.submit(_work, target, []).result()
+    return target
+
+
+class Test_TaskQueue(object):
+    def test_priority_then_fifo(self):
+        q = TaskQueue()
+        for name, prio in [("a", 1), ("b", 5), ("c", 1), ("d", 3)]:
+            q.push(name, prio)
+        eq_([q.pop() for _ in range(len(q))], ["b", "d", "a", "c"])
+
+
+class Test_Executor(object):
+    def test_results_in_order(self):
+        ex = Executor(4)
+        futures = [ex.submit(lambda i: i * i, i) for i in range(20)]
+        eq_(ex.gather(futures), [i * i for i in range(20)])
+
+    def test_bounded(self):
+        ex = Executor(3)
+        lock = threading.Lock()
+        state = {"now": 0, "max": 0}
+
+        def task():
+            with lock:
+                state["now"] += 1
+                state["max"] = max(state["max"], state["now"])
+            time.sleep(0.01)
+            with lock:
+                state["now"] -= 1
+
+        ex.gather([ex.submit(task) for _ in range(30)])
+        ok_(state["max"] <= 3)
+        ok_(ex.threads <= 3)
+
+    def test_nested_waits_dont_deadlock(self):
+        ex = Executor(1)
+
+        def fib(n):
+            if n < 2:
+                return n
+            a = ex.submit(fib, n - 1)
+            b = ex.submit(fib, n - 2)
+            return a.result() + b.result()
+
+        eq_(ex.submit(fib, 10).result(), 55)
+
+    def test_exception(self):
+        ex = Executor(2)
+        def boom():
+            raise ValueError("boom")
+        f = ex.submit(boom)
+        assert_raises(ValueError, f.result)
+        ok_(isinstance(f.exception(), ValueError))
+
+    def test_one_idle_thread_takes_one_task(self):
+        ex = Executor(2)
+        ex.submit(lambda: None).result()
+        while ex.idle != 1:
+            time.sleep(0.01)
+        # both submitted before the idle thread wakes up
+        with ex.cond:
+            futures = [ex.submit(lambda: None) for _ in range(2)]
+            eq_(ex.threads, 2)
+        ex.gather(futures)
+
+    def test_waiter_runs_pending_task(self):
+        ex = Executor(1)
+        def outer():
+            me = threading.currentThread()
+            return ex.submit(threading.currentThread).result() is me
+        ok_(ex.submit(outer).result())
+        eq_(ex.threads, 1)
+
+    def test_shutdown_waits_for_idle_threads(self):
+        ex = Executor(2)
+        ex.gather([ex.submit(time.sleep, 0.01) for _ in range(2)])
+        before = threading.activeCount()
+        ex.shutdown()
+        eq_(ex.threads, 0)
+        eq_(threading.activeCount(), before - 2)
+        eq_(ex.submit(lambda: 2).result(), 2)
+
+
+class Test_MemSubmit(TempRootTest):
+    def test_submit(self):
+        f = self.mem.submit(lambda a, b=0: a + b, 1, b=2)
+        eq_(f.result(), 3)
+
+    def test_fresh_deps_stack(self):
+        outer = self.mem.deps_stack()
+        outer.deps.append(["x"])
+        inner = self.mem.submit(self.mem.deps_stack).result()
+        ok_(inner is not outer)
+        ok_(self.mem.deps_stack() is outer)
+
+    def test_longest_first(self):
+        self.mem.concurrency(1)
+        for name, seconds in [("short", 1), ("long", 10)]:
+            self.mem.durations.record(task_key(_work, (name, [])), seconds)
+        order = []
+        release = threading.Event()
+        blocker = self.mem.submit(release.wait)
+        while self.mem.executor.running == 0:
+            time.sleep(0.001)
+        futures = [self.mem.submit(_work, name, order)
+                   for name in ("short", "new", "long")]
+        release.set()
+        self.mem.gather(futures + [blocker])
+        eq_(order, ["new", "long", "short"])
+
+    def test_waiting_for_same_call_frees_slot(self):
+        self.mem.concurrency(1)
+        _sharing["waiting"] = waiting = threading.Event()
+        begin_call = self.mem._begin_call
+        def begin(tchash):
+            if threading.currentThread().getName() != "owner":
+                waiting.set()
+            return begin_call(tchash)
+        self.mem._begin_call = begin
+        owner = threading.Thread(target=_shared, name="owner",
+                                 args=("util.o",))
+        owner.setDaemon(True)
+        owner.start()
+        owner.join(5)
+        ok_(not owner.isAlive())
+        eq_(_sharing["waiter"].result(), "util.o")
+
+    def test_durations_survive_restart(self):
+        self.mem.submit(_compile, "a.o").result()
+        self.restart()
+        ok_(self.mem.durations.get(task_key(_compile, ("a.o",))) >= 0.05)
+
+    def test_hits_dont_count(self):
+        _compile("a.o")
+        self.restart()
+        key = task_key(_compile, ("a.o",))
+        self.mem.durations.record(key, 7)
+        self.mem.submit(_compile, "a.o").result()
+        eq_(self.mem.durations.get(key), 7)
+
+    def test_recorded_once(self):
+        recorded = []
+        record = self.mem.durations.record
+        self.mem.durations.record = lambda *a: recorded.append(a) or record(*a)
+        self.mem.submit(_compile, "a.o").result()
+        eq_([key for key, seconds in recorded], [task_key(_compile, ("a.o",))])
+
+    def test_key_is_the_target(self):
+        eq_(task_key(_compile, ("a.o", ["b.o"] * 100)),
+            task_key(_compile, ("a.o",)))
+        eq_(task_key(_compile, (mem.util.Env(CC="gcc"),)),
+            task_key(_compile, ()))
+
+    def test_unseen_tasks_forgotten(self):
+        self.mem.durations.record("gone", 3)
+        self.restart()
+        self.mem.submit(_compile, "a.o").result()
+        self.restart()
+        eq_(self.mem.durations.get("gone"), None)
+        ok_(self.mem.durations.get(task_key(_compile, ("a.o",))) >= 0.05)
+
+    def test_failed_build_forgets_nothing(self):
+        self.mem.durations.record("other", 3)
+        self.restart()
+        self.mem.failed = True
+        self.restart()
+        eq_(self.mem.durations.get("other"), 3)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import threading
+import time
+
+import mem
+from mem.nodes import File
+
+from memtest import TempRootTest
+
+
+class Test_HashCache(TempRootTest):
+    def test_survives_restart(self):
+        p = self.write("old.h", "int x;\n", age=10)
+        h = File(p).get_hash()
+        self.restart()
+
+        eq_(self.mem.hash_cache.lookup(p, os.stat(p)), h)
+
+    def test_trusted_hash_is_used(self):
+        p = self.write("old.h", "int x;\n", age=10)
+        File(p).get_hash()
+        self.restart()
+
+        # pretend the content hash of an unchanged file is something else;
+        # a cache hit must not read the file
+        self.mem.hash_cache.record(p, os.stat(p), "cached")
+        eq_(File(p).get_hash(), "cached")
+
+    def test_racy_file_not_remembered(self):
+        p = self.write("new.h", "int x;\n")
+        File(p).get_hash()
+        self.restart()
+
+        eq_(self.mem.hash_cache.lookup(p, os.stat(p)), None)
+
+    def test_changed_stat_misses(self):
+        p = self.write("old.h", "int x;\n", age=10)
+        File(p).get_hash()
+        self.restart()
+
+        self.write("old.h", "int xy;\n", age=10)
+        eq_(self.mem.hash_cache.lookup(p, os.stat(p)), None)
+
+    def test_missing_file(self):
+        p = self.write("gone.h", "int x;\n", age=10)
+        f = File(p)
+        os.unlink(p)
+        eq_(f._compute_hash(), "NOT FOUND")
+
+
+class Test_ConcurrentHashing(TempRootTest):
+    def test_each_file_hashed_once(self):
+        paths = [self.write("f%d.h" % i, "int x%d;\n" % i) for i in range(20)]
+        files = [File(p) for p in paths]
+        File._hash_cache.clear()
+
+        hashed = []
+        orig = File._compute_hash
+        def counting(f):
+            hashed.append(str(f))
+            time.sleep(0.01)
+            return orig(f)
+        File._compute_hash = counting
+        try:
+            threads = [threading.Thread(target=self.mem._validate_deps,
+                                        args=(files,))
+                       for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            File._compute_hash = orig
+
+        eq_(sorted(hashed), sorted(paths))
+
+    def test_missing_dependency_is_a_miss(self):
+        files = [File(self.write("f%d.h" % i, "x")) for i in range(3)]
+        File._hash_cache.clear()
+        os.unlink(files[1])
+
+        ok_(not self.mem._validate_deps(files))
+
+    def test_changed_dependency_is_not_decided(self):
+        files = [File(self.write("f%d.h" % i, "x")) for i in range(3)]
+        File._hash_cache.clear()
+        self.write("f1.h", "changed")
+
+        ok_(self.mem._validate_deps(files))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import cPickle as pickle
+
+from mem import hashing
+from mem.nodes import File
+from mem.util import Env, FrozenEnvError
+
+from memtest import TempRootTest
+
+
+def _task():
+    pass
+
+
+class Test_Hashing(TempRootTest):
+    def test_dict_order_independent(self):
+        a = {}
+        b = {}
+        keys = ["k%d" % i for i in range(50)]
+        for k in keys:
+            a[k] = k.upper()
+        for k in reversed(keys):
+            b[k] = k.upper()
+        eq_(hashing.digest(a), hashing.digest(b))
+
+    def test_unambiguous(self):
+        eq_(len(set(hashing.digest(o) for o in [
+            ("ab", "c"), ("a", "bc"), ["ab", "c"], "abc", u"abc",
+            1, True, "1", 1.0, None, "None", {"a": "b"}, [("a", "b")],
+            set(["a", "b"]), (), [], {}])), 17)
+
+    def test_nested_sets_and_dicts(self):
+        eq_(hashing.digest({"a": set([1, 2, 3]), "b": [{"x": 1, "y": 2}]}),
+            hashing.digest({"b": [{"y": 2, "x": 1}], "a": set([3, 2, 1])}))
+
+    def test_file_by_content(self):
+        p = self.write("a.c", "int x;\n")
+        h = hashing.digest([File(p)])
+        self.write("a.c", "int y;\n")
+        File._hash_cache.clear()
+        assert_not_equal(hashing.digest([File(p)]), h)
+
+    def test_function(self):
+        eq_(hashing.digest(_task), hashing.digest(_task))
+        assert_not_equal(hashing.digest(_task), hashing.digest(self.write))
+
+    def test_mem_get_hash(self):
+        eq_(self.mem.get_hash("f", "m", ("a",), {"x": 1, "y": 2}),
+            self.mem.get_hash("f", "m", ("a",), {"y": 2, "x": 1}))
+
+
+class Test_Env(TempRootTest):
+    def env(self):
+        return Env(CC="gcc", CFLAGS=["-O2", "-g"], CPPPATH=["include"])
+
+    def test_digest_by_content(self):
+        e = self.env()
+        eq_(hashing.digest(e), hashing.digest(self.env()))
+        e.CC = "clang"
+        assert_not_equal(hashing.digest(e), hashing.digest(self.env()))
+
+    def test_frozen_digest_is_cached(self):
+        e = self.env().freeze()
+        h = e.mem_digest()
+        # sneak past freezing; the cached digest must be used
+        dict.__setitem__(e, "CC", "clang")
+        eq_(e.mem_digest(), h)
+        eq_(h, self.env().mem_digest())
+
+    def test_frozen_cannot_change(self):
+        e = self.env().freeze()
+        assert_raises(FrozenEnvError, e.__setitem__, "CC", "clang")
+        assert_raises(FrozenEnvError, setattr, e, "CC", "clang")
+        assert_raises(FrozenEnvError, e.update, {"CC": "clang"})
+        assert_raises(FrozenEnvError, e.pop, "CC")
+        assert_raises(FrozenEnvError, e.replace, CC="clang")
+        eq_(e.CC, "gcc")
+
+    def test_frozen_values_cannot_change(self):
+        e = self.env().freeze()
+        h = e.mem_digest()
+        assert_raises(FrozenEnvError, e.CFLAGS.append, "-O0")
+        assert_raises(FrozenEnvError, e.CFLAGS.__setitem__, 0, "-O0")
+        e2 = Env(OPTS={"debug": ["yes"]}).freeze()
+        assert_raises(FrozenEnvError, e2.OPTS.__setitem__, "debug", "no")
+        assert_raises(FrozenEnvError, e2.OPTS["debug"].append, "no")
+        eq_(e.mem_digest(), h)
+        eq_(h, self.env().mem_digest())
+        eq_(["gcc"] + e.CFLAGS, ["gcc", "-O2", "-g"])
+
+    def test_copy_is_not_frozen(self):
+        e = self.env().freeze()
+        c = e.shallow_copy()
+        c.CC = "clang"
+        eq_(c.CC, "clang")
+        assert not c.is_frozen()
+        c.CFLAGS.append("-O0")
+        eq_(e.CFLAGS, ["-O2", "-g"])
+
+    def test_pickle(self):
+        e = self.env().freeze()
+        e.mem_digest()
+        for protocol in (0, 2):
+            c = pickle.loads(pickle.dumps(e, protocol))
+            eq_(c, e)
+            assert c.is_frozen()
+            eq_(c.mem_digest(), e.mem_digest())
+            assert_raises(FrozenEnvError, c.CFLAGS.append, "-O0")
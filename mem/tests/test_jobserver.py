@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import sys
+import threading
+import time
+
+from mem import jobserver, util
+
+from memtest import TempRootTest
+
+
+class Test_FromEnviron(object):
+    def setUp(self):
+        (self.r, self.w) = os.pipe()
+
+    def tearDown(self):
+        os.close(self.r)
+        os.close(self.w)
+
+    def test_none(self):
+        eq_(jobserver.from_environ({}), None)
+        eq_(jobserver.from_environ({"MAKEFLAGS": "ks -j"}), None)
+
+    def test_pipe(self):
+        for flag in ("auth", "fds"):
+            js = jobserver.from_environ({"MAKEFLAGS": " -j4 --jobserver-%s=%d,%d"
+                                         % (flag, self.r, self.w)})
+            eq_((js.read_fd, js.write_fd, js.owned), (self.r, self.w, False))
+
+    def test_closed_pipe(self):
+        (r, w) = os.pipe()
+        os.close(r)
+        os.close(w)
+        eq_(jobserver.from_environ(
+                {"MAKEFLAGS": "--jobserver-auth=%d,%d" % (r, w)}), None)
+
+    def test_fifo(self):
+        path = os.path.join(os.path.dirname(__file__), ".test-fifo")
+        os.mkfifo(path)
+        try:
+            js = jobserver.from_environ(
+                {"MAKEFLAGS": "--jobserver-auth=fifo:" + path})
+            ok_(js.owned)
+            js.close()
+        finally:
+            os.unlink(path)
+
+
+class Test_Tokens(object):
+    def test_acquire_release(self):
+        js = jobserver.create(2)
+        try:
+            first = js.acquire()
+            eq_(first, None)
+            second = js.acquire()
+            eq_(second, "+")
+            got = []
+            t = threading.Thread(target=lambda: got.append(js.acquire()))
+            t.setDaemon(True)
+            t.start()
+            t.join(0.1)
+            eq_(got, [])
+            js.release(second)
+            t.join(5)
+            eq_(got, ["+"])
+            js.release(first)
+            eq_(js.acquire(), None)
+        finally:
+            js.close()
+
+    def test_environ(self):
+        js = jobserver.create(3)
+        try:
+            env = js.environ({"MAKEFLAGS": "k -j8 --jobserver-auth=9,10"})
+            eq_(env["MAKEFLAGS"],
+                "k -j3 --jobserver-fds=%d,%d --jobserver-auth=%d,%d" %
+                ((js.read_fd, js.write_fd) * 2))
+        finally:
+            js.close()
+
+
+class Test_NotPosix(object):
+    def setUp(self):
+        self.name = os.name
+        os.name = "nt"
+
+    def tearDown(self):
+        os.name = self.name
+
+    def test_local(self):
+        eq_(jobserver.from_environ(
+                {"MAKEFLAGS": "--jobserver-auth=3,4"}), None)
+        js = jobserver.create(1)
+        ok_(isinstance(js, jobserver.LocalJobServer))
+        js.acquire()
+        ok_(not js.semaphore.acquire(False))
+        js.release(None)
+        eq_(js.environ({"MAKEFLAGS": "k"}), {"MAKEFLAGS": "k"})
+        js.close()
+
+    def test_local_resize(self):
+        js = jobserver.create(2)
+        js.acquire()
+        js.acquire()
+        # both jobs are running, the next one to end gives its up
+        js.resize(1)
+        js.release(None)
+        ok_(not js.semaphore.acquire(False))
+        js.release(None)
+        ok_(js.semaphore.acquire(False))
+        ok_(not js.semaphore.acquire(False))
+        js.resize(3)
+        ok_(js.semaphore.acquire(False))
+        ok_(js.semaphore.acquire(False))
+        ok_(not js.semaphore.acquire(False))
+
+
+class Test_Subprocesses(TempRootTest):
+    def sleeps(self):
+        """how long three 0.2s sleeps take"""
+        start = time.time()
+        self.mem.gather([self.mem.submit(util.call, ["sleep", "0.2"])
+                         for _ in range(3)])
+        return time.time() - start
+
+    def test_budget(self):
+        self.mem.concurrency(1)
+        self.mem.get_jobserver()
+        ok_(self.sleeps() >= 0.6)
+
+    def test_grows_with_concurrency(self):
+        self.mem.concurrency(1)
+        self.mem.get_jobserver()
+        self.mem.concurrency(4)
+        ok_(self.sleeps() < 0.5)
+
+    def test_shrinks_with_concurrency(self):
+        self.mem.concurrency(4)
+        self.mem.get_jobserver()
+        self.mem.concurrency(1)
+        self.mem.executor.resize(4)
+        ok_(self.sleeps() >= 0.6)
+
+    def test_children_get_a_token(self):
+        self.mem.concurrency(2)
+        cmd = [sys.executable, "-c",
+               "import os, re\n"
+               "r, w = re.search(r'-auth=(\\d+),(\\d+)', "
+               "os.environ['MAKEFLAGS']).groups()\n"
+               "t = os.read(int(r), 1)\n"
+               "os.write(int(w), t)\n"
+               "print t\n"]
+        (code, out, err) = util._open_pipe_(cmd)
+        eq_((code, out), (0, "+\n"))
+
+    def test_nested_make(self):
+        if not [d for d in os.environ.get("PATH", "").split(os.pathsep)
+                if os.path.exists(os.path.join(d, "make"))]:
+            return
+        self.write("Makefile", "all: a b c\n"
+                   "a b c:\n\t@sleep 0.2\n")
+        self.mem.concurrency(1)
+        start = time.time()
+        (code, out, err) = util._open_pipe_(["make", "-s"])
+        eq_(code, 0)
+        ok_(time.time() - start >= 0.6)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+
+import mem
+from mem import util
+
+from memtest import TempRootTest
+
+
+class Test_CodeCache(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        self.cache = util.CodeCache(os.path.join(self.root, ".mem", "code"))
+        self.compiled = []
+        def counting_compile(*args):
+            self.compiled.append(args[1])
+            return compile(*args)
+        util.compile = counting_compile
+
+    def tearDown(self):
+        del util.compile
+        TempRootTest.tearDown(self)
+
+    def test_compiled_once(self):
+        for _ in range(2):
+            code = self.cache.compile("x = 1\n", "Memfile")
+        eq_(self.compiled, ["Memfile"])
+        eq_(code.co_filename, "Memfile")
+        d = {}
+        exec code in d
+        eq_(d["x"], 1)
+
+    def test_changed_source(self):
+        self.cache.compile("x = 1\n", "Memfile")
+        d = {}
+        exec self.cache.compile("x = 2\n", "Memfile") in d
+        eq_(d["x"], 2)
+        eq_(len(self.compiled), 2)
+        # one file per Memfile, however often it changes
+        eq_(len(os.listdir(self.cache.directory)), 1)
+
+    def test_corrupt(self):
+        self.cache.compile("x = 1\n", "Memfile")
+        (name,) = os.listdir(self.cache.directory)
+        path = os.path.join(self.cache.directory, name)
+        data = open(path, "rb").read()
+        open(path, "wb").write(data[:-5])
+        self.cache.compile("x = 1\n", "Memfile")
+        eq_(len(self.compiled), 2)
+
+
+class Test_ImportMemfile(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        os.mkdir(os.path.join(self.root, "sub"))
+        self.memfile = self.write("sub/Memfile", "def build():\n"
+                                  "    return 1\n")
+
+    def test_imported_once(self):
+        a = mem.subdir("sub")
+        b = mem.subdir("sub")
+        ok_(a.mf is b.mf)
+        eq_(b.build(), 1)
+        ok_(self.memfile in util.imported_files)
+
+    def test_changed(self):
+        a = mem.subdir("sub")
+        self.write("sub/Memfile", "def build():\n"
+                   "    return 2\n")
+        b = mem.subdir("sub")
+        ok_(a.mf is not b.mf)
+        eq_(b.build(), 2)
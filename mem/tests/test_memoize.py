@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import threading
+import time
+
+import mem
+from mem.nodes import File
+
+from memtest import TempRootTest
+
+runs = []
+
+@mem.memoize
+def _slow_obj(target):
+    runs.append(target)
+    time.sleep(0.1)
+    f = open(target, "wb")
+    f.write("object code")
+    f.close()
+    return File(target)
+
+
+class Test_Memoize(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        del runs[:]
+        self.target = os.path.join(self.root, "util.o")
+
+    def test_cached_across_builds(self):
+        _slow_obj(self.target)
+        self.restart()
+        os.unlink(self.target)
+
+        eq_(_slow_obj(self.target), self.target)
+        eq_(len(runs), 1)
+        ok_(os.path.exists(self.target))
+
+    def test_identical_concurrent_calls_run_once(self):
+        threads = [mem.util.Runable(_slow_obj, self.target)
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        eq_(len(runs), 1)
+        eq_([t.result for t in threads], [self.target] * 4)
+
+    def test_repeated_call_skips_store(self):
+        _slow_obj(self.target)
+
+        def fail(*args):
+            raise AssertionError("store was asked")
+        self.mem.store.get = fail
+        eq_(_slow_obj(self.target), self.target)
+        eq_(len(runs), 1)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import time
+
+import mem
+from mem import noop, util
+from mem.nodes import File
+
+from memtest import TempRootTest
+
+
+@mem.memoize
+def _obj(target, source):
+    mem.add_dep(File(source))
+    f = open(target, "wb")
+    f.write("compiled " + open(source).read())
+    f.close()
+    return File(target)
+
+
+@mem.memoize
+def _touch(target):
+    util.call(["touch", target])
+    return File(target)
+
+
+class _Node(object):
+    def get_hash(self):
+        return "node"
+
+
+class Test_NoOp(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        self.source = self.write("a.c", "int x;\n", age=10)
+        self.target = os.path.join(self.root, "a.o")
+        _obj(self.target, self.source)
+        t = time.time() - 10
+        os.utime(self.target, (t, t))
+        ok_(noop.record(self.mem, ["--x"]))
+
+    def unchanged(self):
+        return noop.unchanged(self.mem.mem_dir, ["--x"])
+
+    def test_unchanged(self):
+        ok_(self.unchanged())
+
+    def test_changed_dependency(self):
+        self.write("a.c", "int y;\n", age=10)
+        ok_(not self.unchanged())
+
+    def test_touched_dependency(self):
+        os.utime(self.source, None)
+        ok_(self.unchanged())
+
+    def test_result_gone(self):
+        os.unlink(self.target)
+        ok_(not self.unchanged())
+
+    def test_other_arguments(self):
+        ok_(not noop.unchanged(self.mem.mem_dir, ["--y"]))
+
+    def test_environment(self):
+        os.environ["MEM_TEST_NOOP"] = "1"
+        try:
+            ok_(not self.unchanged())
+        finally:
+            del os.environ["MEM_TEST_NOOP"]
+
+    def test_make_jobserver(self):
+        os.environ["MAKEFLAGS"] = "s -j4 --jobserver-auth=fifo:/tmp/GMfifo1"
+        try:
+            ok_(noop.record(self.mem, ["--x"]))
+            os.environ["MAKEFLAGS"] = "s -j8 --jobserver-auth=fifo:/tmp/GMfifo2"
+            ok_(self.unchanged())
+            os.environ["MAKEFLAGS"] = "sk -j8 --jobserver-auth=fifo:/tmp/GMfifo3"
+            ok_(not self.unchanged())
+        finally:
+            del os.environ["MAKEFLAGS"]
+
+    def test_memfile(self):
+        memfile = self.write("Memfile", "def build(): pass\n", age=10)
+        ok_(noop.record(self.mem, ["--x"], [memfile]))
+        self.write("Memfile", "def build(): print 1\n", age=10)
+        ok_(not self.unchanged())
+
+    def test_forget(self):
+        noop.forget(self.mem.mem_dir)
+        ok_(not self.unchanged())
+
+    def test_other_nodes_disable(self):
+        self.mem._remember("x", [_Node()], None)
+        ok_(not noop.record(self.mem, ["--x"]))
+        ok_(not self.unchanged())
+
+    def test_new_file(self):
+        self.write("b.c", "int b;\n", age=10)
+        ok_(not self.unchanged())
+
+    def test_file_gone(self):
+        other = self.write("b.c", "int b;\n", age=10)
+        ok_(noop.record(self.mem, ["--x"]))
+        os.unlink(other)
+        ok_(not self.unchanged())
+
+    def test_memoized_process(self):
+        _touch(os.path.join(self.root, "b.o"))
+        ok_(noop.record(self.mem, ["--x"]))
+
+    def test_unmemoized_process(self):
+        util.call(["true"])
+        ok_(not noop.record(self.mem, ["--x"]))
+        ok_(not self.unchanged())
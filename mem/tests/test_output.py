@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import sys
+import threading
+import StringIO
+
+from mem import util
+
+from memtest import TempRootTest
+
+
+class Test_OpenPipe(TempRootTest):
+    def test_both_streams(self):
+        (code, out, err) = util._open_pipe_(
+            "echo out; echo err >&2; exit 3", True)
+        eq_((code, out, err), (3, "out\n", "err\n"))
+
+    def test_limit_spills_to_log(self):
+        # more than fits into a pipe, on both streams at once
+        cmd = ("yes line 2>/dev/null | head -n 100000; "
+               "yes error: 2>/dev/null | head -n 100000 >&2")
+        (code, out, err) = util._open_pipe_(cmd, True, 1000)
+        eq_(code, 0)
+        kept = out.splitlines(True)
+        ok_(all(l == "line\n" for l in kept[:-1]))
+        ok_(sum(len(l) for l in kept[:-1]) <= 1000)
+        log = kept[-1].split()[-1]
+        ok_(log.startswith(os.path.join(self.mem.mem_dir, "logs")))
+        eq_(os.path.getsize(log), 500000)
+        ok_(err.startswith("error:\n"))
+
+    def test_not_posix(self):
+        # both streams at once, more than fits into a pipe
+        cmd = ("yes line 2>/dev/null | head -n 100000 & "
+               "yes error: 2>/dev/null | head -n 100000 >&2; wait")
+        name = os.name
+        os.name = "nt"
+        try:
+            (code, out, err) = util._open_pipe_(cmd, True, None)
+        finally:
+            os.name = name
+        eq_((code, out, err), (0, "line\n" * 100000, "error:\n" * 100000))
+
+    def test_unlimited(self):
+        (code, out, err) = util._open_pipe_(
+            "yes line 2>/dev/null | head -n 1000", True, None)
+        eq_(out, "line\n" * 1000)
+
+
+class Test_Output(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        self.color = os.environ.get("MEM_COLOR_LEVEL")
+        os.environ["MEM_COLOR_LEVEL"] = "0"
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        if self.color is None:
+            del os.environ["MEM_COLOR_LEVEL"]
+        else:
+            os.environ["MEM_COLOR_LEVEL"] = self.color
+        TempRootTest.tearDown(self)
+
+    def test_tasks_dont_interleave(self):
+        def task(name):
+            util.run_return_output(
+                "test", name, util._open_pipe_,
+                "for i in 1 2 3; do echo %s; sleep 0.01; done" % name, True)
+        threads = [threading.Thread(target=task, args=(n,))
+                   for n in ("a", "b", "c")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        lines = sys.stdout.getvalue().splitlines()
+        eq_(len(lines), 12)
+        for i in range(0, 12, 4):
+            name = lines[i + 1]
+            eq_(lines[i:i + 4], [lines[i]] + [name] * 3)
+
+    def test_mark_per_line(self):
+        os.environ["MEM_COLOR_LEVEL"] = "1"
+        os.environ["TERM"], term = "xterm", os.environ.get("TERM")
+        try:
+            eq_(util._mark_output_("a.c:1: error: x\nWarning\n"),
+                "a.c:1: %serror:%s x\n%sWarning%s\n" %
+                (util.RED, util.RESET, util.YELLOW, util.RESET))
+        finally:
+            if term is None:
+                del os.environ["TERM"]
+            else:
+                os.environ["TERM"] = term
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import mem
+from mem import remote
+from mem.cacheserver import CacheServer
+from mem.nodes import File
+
+from memtest import TempRootTest
+
+runs = []
+
+SECRET = "team secret"
+
+@mem.memoize
+def _produce(target, content):
+    runs.append(target)
+    f = open(target, "wb")
+    f.write(content)
+    f.close()
+    return File(target)
+
+
+class _ServerTest(object):
+    def start_server(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.server = CacheServer(self.cache_dir, SECRET, quiet=True)
+        self.server.start()
+        self.client = remote.RemoteCache(self.server.url(), SECRET)
+
+    def stop_server(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+
+class Test_Protocol(_ServerTest):
+    def setUp(self):
+        self.start_server()
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.stop_server()
+        shutil.rmtree(self.tmp)
+
+    def test_missing(self):
+        assert_raises(KeyError, self.client.get, "deps", "abcdef")
+        ok_(not self.client.fetch_blob("abcdef",
+                                       os.path.join(self.tmp, "x")))
+
+    def test_roundtrip(self):
+        src = os.path.join(self.tmp, "src")
+        open(src, "wb").write("\0blob" * 1000)
+
+        self.client.upload([("abcdef", src)], [("deps", "012345", "\0deps")])
+        self.client.wait()
+
+        eq_(self.client.get("deps", "012345"), "\0deps")
+        dst = os.path.join(self.tmp, "sub", "dst")
+        eq_(self.client.fetch_blobs([("abcdef", dst)]), ["abcdef"])
+        eq_(open(dst, "rb").read(), "\0blob" * 1000)
+
+    def test_rejects_bad_paths(self):
+        r = self.client._request("GET", "deps", "../../etc")
+        r.read()
+        eq_(r.status, 400)
+
+    def test_rejects_unsigned_uploads(self):
+        data = remote.sign("not our secret", "deps", "012345", "\0deps")
+        r = self.client._request("PUT", "deps", "012345", data,
+                                 {"Content-Length": str(len(data))})
+        r.read()
+        eq_(r.status, 403)
+        forger = remote.RemoteCache(self.server.url(), "not our secret")
+        src = os.path.join(self.tmp, "src")
+        open(src, "wb").write("evil")
+        forger.upload([("abcdef", src)], [])
+        forger.wait()
+        ok_(forger.broken)
+        ok_(not self.client.fetch_blob("abcdef",
+                                       os.path.join(self.tmp, "x")))
+
+    def test_foreign_entry_is_a_miss(self):
+        # put there behind the server's back
+        os.makedirs(os.path.join(self.cache_dir, "deps", "01"))
+        open(os.path.join(self.cache_dir, "deps", "01", "2345"), "wb").write(
+            remote.sign("not our secret", "deps", "012345", "\0deps"))
+        assert_raises(KeyError, self.client.get, "deps", "012345")
+
+    def test_needs_a_key(self):
+        assert_raises(ValueError, remote.RemoteCache, self.server.url(), "")
+        assert_raises(ValueError, CacheServer, self.cache_dir, None)
+        eq_(self.server.server_address[0], "127.0.0.1")
+
+    def test_unreachable_server_is_a_miss(self):
+        c = remote.RemoteCache("http://127.0.0.1:1", SECRET)
+        assert_raises(KeyError, c.get, "deps", "abcdef")
+        ok_(c.broken)
+
+
+class Test_SharedBuild(TempRootTest, _ServerTest):
+    def setUp(self):
+        self.start_server()
+        TempRootTest.setUp(self)
+        self.mem.remote_cache(self.server.url(), secret=SECRET)
+        del runs[:]
+
+    def tearDown(self):
+        TempRootTest.tearDown(self)
+        self.stop_server()
+
+    def test_other_machine_gets_result(self):
+        target = os.path.join(self.root, "out.o")
+        _produce(target, "object code")
+        eq_(len(runs), 1)
+
+        # another machine: same sources, empty .mem
+        self.mem.finish()
+        mem.Mem.destroy()
+        shutil.rmtree(os.path.join(self.root, ".mem"))
+        os.unlink(target)
+        self.mem = mem.Mem(self.root)
+        self.mem.remote_cache(self.server.url(), secret=SECRET)
+
+        _produce(target, "object code")
+        eq_(len(runs), 1)
+        eq_(open(target).read(), "object code")
+
+    def test_corrupt_blob_is_a_miss(self):
+        target = os.path.join(self.root, "out.o")
+        _produce(target, "object code")
+        self.mem.finish()
+        for d, _, files in os.walk(os.path.join(self.cache_dir, "blob")):
+            for name in files:
+                open(os.path.join(d, name), "wb").write("garbage")
+
+        mem.Mem.destroy()
+        shutil.rmtree(os.path.join(self.root, ".mem"))
+        os.unlink(target)
+        self.mem = mem.Mem(self.root)
+        self.mem.remote_cache(self.server.url(), secret=SECRET)
+
+        _produce(target, "object code")
+        eq_(len(runs), 2)
+        eq_(open(target).read(), "object code")
+
+    def test_bounded_downloads(self):
+        for i in range(10):
+            _produce(os.path.join(self.root, "%d.o" % i), "code %d" % i)
+        self.mem.finish()
+        client = remote.RemoteCache(self.server.url(), SECRET, jobs=2)
+        blobs = [(h, os.path.join(self.root, "dl", h))
+                 for h in self.mem.store.keys("blobs")]
+        lock = threading.Lock()
+        state = {"now": 0, "max": 0, "threads": set()}
+        fetch_blob = client.fetch_blob
+        def counting(h, path):
+            with lock:
+                state["now"] += 1
+                state["max"] = max(state["max"], state["now"])
+                state["threads"].add(threading.currentThread())
+            time.sleep(0.01)
+            try:
+                return fetch_blob(h, path)
+            finally:
+                with lock:
+                    state["now"] -= 1
+        client.fetch_blob = counting
+
+        eq_(sorted(client.fetch_blobs(blobs)), sorted(h for h, path in blobs))
+        eq_((state["max"], len(state["threads"])), (2, 2))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import json
+import os
+
+import mem
+from mem.nodes import File
+from mem.stats import Stats, NO_TASK
+
+from memtest import TempRootTest
+
+
+@mem.memoize
+def _obj(target, source):
+    mem.add_dep(File(source))
+    f = open(target, "wb")
+    f.write(open(source).read() * 2)
+    f.close()
+    return File(target)
+
+
+class Test_Stats(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        self.source = self.write("a.c", "int x;\n")
+        self.target = os.path.join(self.root, "a.o")
+
+    def counter(self, field):
+        return self.mem.stats.get("_obj", field)
+
+    def test_new_miss_and_hit(self):
+        _obj(self.target, self.source)
+        _obj(self.target, self.source)
+        eq_(self.counter("lookups"), 2)
+        eq_(self.counter("misses_new"), 1)
+        eq_(self.counter("hits"), 1)
+        eq_(self.counter("bytes_stored"), 14)
+
+    def test_changed_miss(self):
+        _obj(self.target, self.source)
+        self.restart()
+        self.write("a.c", "int y;\n")
+        _obj(self.target, self.source)
+        eq_(self.counter("misses_changed"), 1)
+        eq_(self.counter("misses_new"), 0)
+
+    def test_restored(self):
+        _obj(self.target, self.source)
+        self.restart()
+        os.unlink(self.target)
+        _obj(self.target, self.source)
+        eq_(self.counter("hits"), 1)
+        eq_(self.counter("bytes_restored"), 14)
+
+    def test_outside_of_tasks(self):
+        self.mem.count("subprocess_time", 1.5)
+        eq_(self.mem.stats.get(NO_TASK, "subprocess_time"), 1.5)
+
+    def test_saved_by_finish(self):
+        _obj(self.target, self.source)
+        self.mem.finish()
+        saved = json.load(open(os.path.join(self.mem.mem_dir, "stats.json")))
+        eq_(saved["tasks"]["_obj"]["lookups"], 1)
+        eq_(saved["total"]["misses_new"], 1)
+
+
+def test_table():
+    s = Stats()
+    s.add("t_c_obj", "hits", 3)
+    s.add("t_c_obj", "bytes_stored", 3 << 20)
+    s.add("t_prog", "misses_new")
+    lines = s.table().splitlines()
+    eq_(len(lines), 4)
+    ok_(lines[0].split()[:2] == ["lookups", "hits"])
+    ok_(lines[1].startswith("t_c_obj"))
+    ok_("3.0M" in lines[1])
+    ok_(lines[3].startswith("total"))
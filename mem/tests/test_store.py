@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import shutil
+import tempfile
+import time
+
+from mem import store
+
+
+class _StoreTest(object):
+    def setUp(self):
+        self.memdir = tempfile.mkdtemp()
+        self.s = self.open()
+
+    def tearDown(self):
+        shutil.rmtree(self.memdir)
+
+    def test_missing(self):
+        assert_raises(KeyError, self.s.get, "deps", "abcdef")
+
+    def test_put_get(self):
+        self.s.put("deps", "abcdef", "\0data")
+        eq_(self.s.get("deps", "abcdef"), "\0data")
+        assert_raises(KeyError, self.s.get, "results", "abcdef")
+
+    def test_persists_after_flush(self):
+        self.s.put("results", "abcdef", "data")
+        self.s.flush()
+        eq_(self.open().get("results", "abcdef"), "data")
+
+    def test_get_many(self):
+        self.s.put("deps", "aa11", "1")
+        self.s.flush()
+        self.s.put("deps", "bb22", "2")
+        eq_(self.s.get_many("deps", ["aa11", "bb22", "cc33"]),
+            {"aa11": "1", "bb22": "2"})
+
+    def test_delete_and_keys(self):
+        self.s.put("deps", "aa11", "1")
+        self.s.put("deps", "bb22", "2")
+        self.s.flush()
+        self.s.delete("deps", "aa11")
+        self.s.flush()
+        eq_(sorted(self.s.keys("deps")), ["bb22"])
+
+    def test_pages(self):
+        for i, key in enumerate(["dd11", "aa11", "cc11", "bb11"]):
+            self.s.put("blobs", key, str(i))
+            self.s.flush()
+            self.s.touch("blobs", key)
+            self.s.flush()
+            time.sleep(0.01)
+        eq_(self.s.keys("blobs", None, 2), ["aa11", "bb11"])
+        eq_(self.s.keys("blobs", "bb11", 5), ["cc11", "dd11"])
+        eq_([key for key, stamp in self.s.by_age("blobs", 3)],
+            ["dd11", "aa11", "cc11"])
+
+    def test_total(self):
+        self.s.put("blobs", "aa11", "100")
+        self.s.put("blobs", "bb11", "20")
+        self.s.flush()
+        self.s.put("blobs", "aa11", "50")
+        self.s.delete("blobs", "bb11")
+        self.s.flush()
+        eq_(self.s.total("blobs"), 50)
+        eq_(self.open().total("blobs"), 50)
+
+
+class Test_DirStore(_StoreTest):
+    def open(self):
+        return store.DirStore(self.memdir)
+
+
+class Test_SqliteStore(_StoreTest):
+    def open(self):
+        return store.SqliteStore(self.memdir)
+
+    def test_unflushed_writes_are_not_on_disk(self):
+        self.s.put("deps", "abcdef", "data")
+        assert_raises(KeyError, self.open().get, "deps", "abcdef")
+
+    def test_by_age_sees_unflushed_stamps(self):
+        self.s.put("blobs", "a", "1")
+        self.s.put("blobs", "b", "1")
+        self.s.flush()
+        self.s.touch("blobs", "a")
+        eq_([key for key, stamp in self.s.by_age("blobs")], ["b", "a"])
+
+    def test_total_counts_keys_once(self):
+        self.s.put("blobs", "a", "100")
+        self.s.flush()
+        self.s.put("blobs", "a", "100")
+        self.s.put("blobs", "b", "20")
+        eq_(self.s.total("blobs"), 120)
+
+    def test_total_is_kept(self):
+        self.s.put("blobs", "a", "100")
+        self.s.flush()
+        sums = []
+        execute = self.s.db.execute
+        class Db(object):
+            def execute(self, sql, *args):
+                if "SUM" in sql and "WHERE" not in sql:
+                    sums.append(sql)
+                return execute(sql, *args)
+        self.s.db = Db()
+        eq_(self.s.total("blobs"), 100)
+        eq_(sums, [])
+
+
+class Test_Migration(object):
+    def setUp(self):
+        self.memdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.memdir)
+
+    def test_open_store_migrates_dir_layout(self):
+        legacy = store.DirStore(self.memdir)
+        legacy.put("deps", "abcdef", "deps")
+        legacy.put("results", "012345", "result")
+
+        s = store.open_store(self.memdir, "sqlite")
+        eq_(s.get("deps", "abcdef"), "deps")
+        eq_(s.get("results", "012345"), "result")
+        ok_(not legacy.exists())
+
+    def test_unknown_backend(self):
+        assert_raises(ValueError, store.open_store, self.memdir, "nope")
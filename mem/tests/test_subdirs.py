@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import threading
+
+import mem
+from mem import util
+
+from memtest import TempRootTest
+
+
+MEMFILE = """
+import os
+import mem
+from mem.nodes import File
+
+def build(meet=None):
+    met = meet is None or meet()
+    return File("a.c"), mem.Mem.instance().cwd, os.getcwd(), met
+"""
+
+
+class _Meet(object):
+    """lets n threads wait for each other, returns whether they all came"""
+    def __init__(self, n):
+        self.n = n
+        self.cond = threading.Condition()
+
+    def __call__(self):
+        with self.cond:
+            self.n -= 1
+            self.cond.notifyAll()
+            while self.n > 0:
+                self.cond.wait(5)
+                if self.n > 0:
+                    return False
+            return True
+
+
+class Test_Subdirs(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        for d in ("liba", "libb"):
+            os.mkdir(os.path.join(self.root, d))
+            self.write(d + "/Memfile", MEMFILE)
+            self.write(d + "/a.c", "int a;\n")
+
+    def test_subdir(self):
+        (f, cwd, process_cwd, met) = mem.subdir("liba").build()
+        sub = os.path.join(self.root, "liba")
+        eq_(f, os.path.join(sub, "a.c"))
+        eq_(cwd, sub)
+        eq_(process_cwd, self.root)
+        eq_(self.mem.cwd, self.root)
+
+    def test_missing_function(self):
+        assert_raises(AttributeError, getattr, mem.subdir("liba"), "test")
+
+    def test_subdirs_concurrently(self):
+        self.mem.concurrency(2)
+        results = mem.subdirs(["liba", "libb"]).build(_Meet(2))
+        eq_([r[1] for r in results],
+            [os.path.join(self.root, d) for d in ("liba", "libb")])
+        ok_(all(r[3] for r in results))
+        eq_(self.mem.cwd, self.root)
+
+
+class Test_Cwd(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        self.sub = os.path.join(self.root, "sub")
+        os.mkdir(self.sub)
+
+    def test_per_thread(self):
+        self.mem.cwd = self.sub
+        seen = []
+        t = threading.Thread(target=lambda: seen.append(self.mem.cwd))
+        t.start()
+        t.join()
+        eq_(seen, [self.root])
+        eq_(self.mem.path("a.c"), os.path.join(self.sub, "a.c"))
+
+    def test_submit_inherits(self):
+        self.mem.cwd = self.sub
+        eq_(self.mem.submit(lambda: self.mem.cwd).result(), self.sub)
+
+    def test_subprocess(self):
+        self.mem.cwd = self.sub
+        (code, out, err) = util._open_pipe_(["pwd"])
+        eq_(out.strip(), self.sub)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import subprocess
+import sys
+
+import mem
+
+REPO = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+def _modules_after(code):
+    """the mem.tasks modules a fresh python has loaded after code"""
+    env = os.environ.copy()
+    env["PYTHONPATH"] = REPO
+    out = subprocess.Popen(
+        [sys.executable, "-c", code + "; import sys; print ' '.join("
+         "sorted(m for m in sys.modules if m.startswith('mem.tasks.') "
+         "and sys.modules[m]))"],
+        env=env, stdout=subprocess.PIPE).communicate()[0]
+    return out.split()
+
+
+def test_not_imported_up_front():
+    eq_(_modules_after("import mem"), [])
+
+
+def test_imported_on_first_use():
+    eq_(_modules_after("import mem; mem.tasks.fs"), ["mem.tasks.fs"])
+
+
+def test_import_statement():
+    eq_(_modules_after("import mem.tasks.fs"), ["mem.tasks.fs"])
+
+
+def test_attribute_access():
+    ok_(mem.tasks.gcc.obj is sys.modules["mem.tasks.gcc"].obj)
+    from mem.tasks import fs
+    ok_(fs is mem.tasks.fs)
+
+
+def test_unknown():
+    assert_raises(AttributeError, getattr, mem.tasks, "no_such_task")
+    ok_(not hasattr(mem.tasks, "__no_such_thing__"))
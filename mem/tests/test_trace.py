@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import json
+import os
+import threading
+
+import mem
+from mem import trace
+from mem.nodes import File
+
+from memtest import TempRootTest
+
+
+@mem.memoize
+def _obj(target):
+    f = open(target, "wb")
+    f.write("object code")
+    f.close()
+    return File(target)
+
+
+class Test_Trace(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        self.path = os.path.join(self.root, "trace.json")
+        self.tracer = trace.start(self.path)
+
+    def tearDown(self):
+        trace.stop()
+        TempRootTest.tearDown(self)
+
+    def spans(self):
+        trace.stop()
+        events = json.load(open(self.path))["traceEvents"]
+        return [e for e in events if e["ph"] == "X"]
+
+    def test_span_args(self):
+        with trace.span("gcc -M", "scan", source="a.c") as s:
+            s["bytes"] = 10
+        (span,) = self.spans()
+        eq_(span["name"], "gcc -M")
+        eq_(span["cat"], "scan")
+        eq_(span["args"], {"source": "a.c", "bytes": 10})
+        ok_(span["dur"] >= 0)
+
+    def test_threads(self):
+        def work():
+            with trace.span("worker", "test"):
+                pass
+        t = threading.Thread(target=work)
+        with trace.span("main", "test"):
+            pass
+        t.start()
+        t.join()
+        eq_(len(set(s["tid"] for s in self.spans())), 2)
+
+    def test_error(self):
+        try:
+            with trace.span("boom", "test"):
+                raise ValueError()
+        except ValueError:
+            pass
+        eq_(self.spans()[0]["args"]["error"], "ValueError")
+
+    def test_memoize_hit_and_miss(self):
+        target = os.path.join(self.root, "a.o")
+        _obj(target)
+        _obj(target)
+        self.restart()
+        os.unlink(target)
+        _obj(target)
+
+        tasks = [s for s in self.spans() if s["cat"] == "task"]
+        eq_([s["args"]["cache"] for s in tasks], ["miss", "done", "hit"])
+        eq_(tasks[0]["args"]["target"], target)
+        ok_([s for s in self.spans() if s["cat"] == "blob"])
+
+    def test_disabled(self):
+        trace.stop()
+        ok_(not trace.enabled())
+        with trace.span("nothing", "test") as s:
+            s["bytes"] = 1
+        eq_(self.tracer.events, [])
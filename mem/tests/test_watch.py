@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from nose.tools import *
+
+import os
+import time
+
+import mem
+from mem import watch
+from mem.nodes import File
+
+from memtest import TempRootTest
+
+
+_runs = []
+
+@mem.memoize
+def _obj(target, source):
+    _runs.append(target)
+    mem.add_dep(File(source))
+    f = open(target, "wb")
+    f.write("compiled " + open(source).read())
+    f.close()
+    return File(target)
+
+
+class Test_Invalidate(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        self.a = self.write("a.c", "int a;\n")
+        self.b = self.write("b.c", "int b;\n")
+        self.runs = _runs
+        del self.runs[:]
+        self.build()
+
+    def build(self):
+        for name in ("a", "b"):
+            _obj(os.path.join(self.root, name + ".o"),
+                 os.path.join(self.root, name + ".c"))
+
+    def test_only_affected_calls(self):
+        self.write("a.c", "int aa;\n")
+        eq_(self.mem.invalidate([self.a]), 1)
+        self.mem.rebuild()
+        self.build()
+        eq_(self.runs, [os.path.join(self.root, x) for x in
+                        ("a.o", "b.o", "a.o")])
+        eq_(self.mem.stats.get("_obj", "hits"), 1)
+
+    def test_result_changed(self):
+        target = os.path.join(self.root, "b.o")
+        self.write("b.o", "garbage")
+        eq_(self.mem.invalidate([target]), 1)
+        self.build()
+        eq_(open(target).read(), "compiled int b;\n")
+        eq_(len(self.runs), 2)
+
+    def test_unchanged(self):
+        eq_(self.mem.invalidate([os.path.join(self.root, "c.c")]), 0)
+        self.build()
+        eq_(len(self.runs), 2)
+
+
+class Test_Snapshot(TempRootTest):
+    def setUp(self):
+        TempRootTest.setUp(self)
+        self.path = self.write("a.c", "int a;\n", age=10)
+        File(self.path)
+        self.snapshot = watch.Snapshot([self.path])
+
+    def test_touch_is_no_change(self):
+        os.utime(self.path, None)
+        eq_(self.snapshot.changed([self.path]), set())
+
+    def test_changed(self):
+        self.write("a.c", "int b;\n")
+        eq_(self.snapshot.changed([self.path]), set([self.path]))
+
+    def test_deleted(self):
+        os.unlink(self.path)
+        eq_(self.snapshot.changed([self.path]), set([self.path]))
+
+    def test_directory_listing(self):
+        snapshot = watch.Snapshot([self.path], [self.root])
+        self.write("a.c", "int b;\n", age=5)
+        eq_(snapshot.changed([self.root]), set())
+        self.write("b.c", "int b;\n")
+        eq_(snapshot.changed([self.root]), set([self.root]))
+        eq_(snapshot.changed([self.root]), set())
+        eq_(snapshot.edited(time.time() - 10), set())
+
+    def test_edited_during_build(self):
+        start = time.time() - 1
+        eq_(self.snapshot.edited(start), set())
+        self.write("a.c", "int b;\n")
+        eq_(watch.Snapshot([self.path]).edited(start), set([self.path]))
+
+
+class Test_Watcher(TempRootTest):
+    def test_inotify(self):
+        try:
+            w = watch.Inotify()
+        except (OSError, AttributeError):
+            return
+        path = self.write("a.c", "int a;\n")
+        other = self.write("b.c", "int b;\n")
+        w.watch([path])
+        try:
+            self.write("b.c", "int bb;\n")
+            eq_(w.wait(0.1), set())
+            self.write("a.c", "int aa;\n")
+            eq_(w.wait(1), set([path]))
+        finally:
+            w.close()
+
+    def test_inotify_new_file(self):
+        try:
+            w = watch.Inotify()
+        except (OSError, AttributeError):
+            return
+        path = self.write("a.c", "int a;\n")
+        w.watch([path], [self.root])
+        try:
+            self.write("b.c", "int b;\n")
+            eq_(w.wait(1), set([self.root]))
+            os.rename(os.path.join(self.root, "b.c"),
+                      os.path.join(self.root, "c.c"))
+            eq_(w.wait(1), set([self.root]))
+        finally:
+            w.close()
+
+    def test_inotify_directory_gone(self):
+        try:
+            w = watch.Inotify()
+        except (OSError, AttributeError):
+            return
+        os.mkdir(os.path.join(self.root, "build"))
+        path = self.write("build/a.o", "")
+        w.watch([path])
+        try:
+            os.unlink(path)
+            os.rmdir(os.path.dirname(path))
+            while w.wait(0.2):
+                pass
+            os.mkdir(os.path.dirname(path))
+            self.write("build/a.o", "")
+            eq_(w.wait(1), set([path]))
+        finally:
+            w.close()
+
+    def test_poller(self):
+        w = watch.Poller(0.01)
+        w.watch(["a", "b"], ["d"])
+        eq_(w.wait(), set(["a", "b", "d"]))
@@ -0,0 +1,154 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+A timeline of the build in Chrome's trace event format, to be loaded
+into chrome://tracing or https://ui.perfetto.dev:
+
+   $ runmem --trace build.json
+
+Code that does something worth seeing wraps it in a span:
+
+   with trace.span("gcc -M", "scan", source=source) as s:
+       ...
+       s["bytes"] = len(output)
+
+Spans are cheap no-ops unless a trace was started.
+"""
+
+from __future__ import with_statement
+
+import json
+import os
+import thread
+import threading
+import time
+
+
+class _NullSpan(dict):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setitem__(self, key, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(dict):
+    """a complete event; its items end up as the args of the event"""
+    def __init__(self, tracer, name, cat, args):
+        dict.__init__(self, args)
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self["error"] = exc_type.__name__
+        self.tracer._add(self, time.time())
+        return False
+
+
+class Tracer(object):
+    def __init__(self, path):
+        self.path = path
+        self.origin = time.time()
+        self.pid = os.getpid()
+        self.events = []
+        self.lock = threading.Lock()
+        self.threads = {}
+
+    def _tid(self):
+        ident = thread.get_ident()
+        try:
+            return self.threads[ident]
+        except KeyError:
+            with self.lock:
+                tid = self.threads[ident] = len(self.threads) + 1
+            self.events.append({
+                "name": "thread_name", "ph": "M", "pid": self.pid,
+                "tid": tid,
+                "args": {"name": threading.currentThread().getName()}})
+            return tid
+
+    def _us(self, t):
+        return int((t - self.origin) * 1e6)
+
+    def _add(self, span, end):
+        args = dict((k, v if isinstance(v, (int, long, float, bool))
+                     else str(v)) for k, v in span.iteritems())
+        self.events.append({
+            "name": span.name, "cat": span.cat, "ph": "X",
+            "ts": self._us(span.start),
+            "dur": self._us(end) - self._us(span.start),
+            "pid": self.pid, "tid": self._tid(), "args": args})
+
+    def span(self, name, cat, args):
+        return _Span(self, name, cat, args)
+
+    def write(self):
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        f = open(tmp, "w")
+        try:
+            json.dump({"traceEvents": self.events,
+                       "displayTimeUnit": "ms"}, f)
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
+
+
+_tracer = None
+
+
+def start(path):
+    """record spans from now on, to be written to path by stop()"""
+    global _tracer
+    _tracer = Tracer(path)
+    return _tracer
+
+
+def stop():
+    """write the trace started by start(), if any"""
+    global _tracer
+    if _tracer is not None:
+        _tracer.write()
+        _tracer = None
+
+
+def enabled():
+    return _tracer is not None
+
+
+def span(name, cat, **args):
+    """a context manager timing what it wraps; see the module docstring"""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, cat, args)
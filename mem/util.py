@@ -18,16 +18,28 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from __future__ import with_statement
+
 from string import split
 import os
+import hashlib
 import imp
+import marshal
 import sys
+import time
+import thread
+import threading
 from threading import Thread, Semaphore
 import subprocess
 import re
+import select
+import signal
+import errno
+import atexit
 
 from nodes import File
-from _mem import Mem
+from _mem import Mem, LOG_DIR
+import trace
 
 RED    = chr(27) + "[31m"
 GREEN  = chr(27) + "[32m"
@@ -71,39 +83,344 @@ def get_color_status(returncode):
 
     return status.rjust(16)
 
+_MARKS = re.compile("warning:|error:|Warning")
+_MARK_COLORS = {"warning:": YELLOW, "error:": RED, "Warning": YELLOW}
+
+def _mark_(m):
+    return "%s%s%s" % (_MARK_COLORS[m.group(0)], m.group(0), RESET)
+
 def _mark_output_(s):
     if _should_color_():
-        s = re.sub("warning:", "%swarning:%s" % (YELLOW, RESET), s)
-        s = re.sub("error:", "%serror:%s" % (RED, RESET), s)
-        s = re.sub("Warning", "%sWarning%s" % (YELLOW, RESET), s)
+        s = "".join(_MARKS.sub(_mark_, l) for l in s.splitlines(True))
 
     return s
 
-def _open_pipe_(args, shell=False):
-    p = subprocess.Popen(
-            args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=shell)
+# how much of each output stream of a subprocess is kept in memory (and
+# printed); the whole stream goes to a log file in .mem/logs beyond that
+OUTPUT_LIMIT = 1 << 20
 
-    (stdoutdata, stderrdata) = p.communicate()
+# output of one task is written at once, see write_output()
+output_lock = threading.Lock()
 
-    return (p.returncode, stdoutdata, stderrdata)
+def write_output(s):
+    """write s to stdout in one go, parallel tasks don't interleave"""
+    with output_lock:
+        sys.stdout.write(s)
+        sys.stdout.flush()
+
+class _Capture(object):
+    """
+    One output stream of a subprocess, fed as it comes. Up to limit
+    bytes are kept, cut at the end of a line; once the stream grows
+    beyond that, all of it goes to the log file instead.
+    """
+    def __init__(self, limit, log_path):
+        self.limit = limit
+        self.log_path = log_path
+        self.kept = []
+        self.size = 0
+        self.log = None
+
+    def feed(self, data):
+        kept = self.size
+        self.size += len(data)
+        if self.log is not None:
+            self.log.write(data)
+        elif self.limit is None or self.size <= self.limit:
+            self.kept.append(data)
+        else:
+            ensure_file_dir(self.log_path)
+            self.log = open(self.log_path, "wb")
+            self.log.writelines(self.kept)
+            self.log.write(data)
+            head = "".join(self.kept) + data[:self.limit - kept]
+            self.kept = [head[:head.rfind("\n") + 1 or len(head)]]
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+
+    def getvalue(self):
+        data = "".join(self.kept)
+        if self.log is None:
+            return data
+        return data + "... %d more bytes, the whole output is in %s\n" % (
+            self.size - len(data), self.log_path)
+
+def _log_path(args, stream):
+    """where output of args beyond OUTPUT_LIMIT goes; reruns overwrite it"""
+    mem = Mem.instance()
+    key = hashlib.sha1(repr((args, mem.cwd))).hexdigest()[:16]
+    return os.path.join(mem.mem_dir, LOG_DIR, "%s-%s.log" % (key, stream))
+
+# the subprocesses running right now, each in a process group of its
+# own, so that a build that fails or gets interrupted can kill them all
+# along with whatever they started; with the jobserver and the token
+# each holds
+_processes = {}
+_processes_lock = threading.Lock()
+
+# subprocess32 forks and execs in C, and start_new_session is the one
+# thing it does in between that we need: no Python code runs in a
+# child forked from a process full of threads. Without it the child
+# side of 2.7's subprocess is Python code anyway, calling os.setsid()
+# there as well adds nothing to go wrong.
+try:
+    import subprocess32
+except ImportError:
+    subprocess32 = None
+
+if os.name != "posix":
+    _Popen = subprocess.Popen
+    _NEW_GROUP = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+elif subprocess32 is not None:
+    _Popen = subprocess32.Popen
+    _NEW_GROUP = {"start_new_session": True}
+else:
+    _Popen = subprocess.Popen
+    _NEW_GROUP = {"preexec_fn": os.setsid}
+
+def popen(args, **kwargs):
+    """
+    subprocess.Popen(args, **kwargs) in a process group of its own, once
+    the jobserver handed out a token for it; it is registered until
+    wait() is done, see kill_processes(). Once the build failed no
+    process starts anymore.
+
+    A dry run starts none at all, it reports them and returns a
+    _NotRun instead.
+    """
+    mem = Mem.instance()
+    if mem.failed:
+        sys.exit(1)
+    if mem.dry_run is not None:
+        mem.dry_run.skip(args)
+        return _NotRun(kwargs)
+    if not mem.deps_stack().deps:
+        mem.unmemoized_processes = True
+    jobs = mem.get_jobserver()
+    token = jobs.acquire()
+    try:
+        # the token may have taken a while
+        if mem.failed:
+            sys.exit(1)
+        env = kwargs.get("env")
+        if env is None:
+            env = os.environ
+        kwargs["env"] = jobs.environ(env)
+        kwargs.update(_NEW_GROUP)
+        p = _Popen(args, **kwargs)
+    except:
+        jobs.release(token)
+        raise
+    with _processes_lock:
+        _processes[p] = (jobs, token)
+    # the build may have failed just now, missing p
+    if mem.failed:
+        _kill(p, signal.SIGTERM)
+    return p
+
+def wait(p):
+    """p.wait() for a process started by popen()"""
+    try:
+        return p.wait()
+    finally:
+        with _processes_lock:
+            (jobs, token) = _processes.pop(p, (None, None))
+        if jobs is not None:
+            jobs.release(token)
+
+class _NotRun(object):
+    """
+    What popen() returns for a process a dry run doesn't start: it
+    succeeds at once without any output.
+    """
+    pid = None
+    returncode = 0
+
+    def __init__(self, kwargs):
+        self.stdin = self.stdout = self.stderr = None
+        if kwargs.get("stdin") == subprocess.PIPE:
+            self.stdin = open(os.devnull, "wb")
+        if kwargs.get("stdout") == subprocess.PIPE:
+            self.stdout = open(os.devnull, "rb")
+        if kwargs.get("stderr") == subprocess.PIPE:
+            self.stderr = open(os.devnull, "rb")
+
+    def communicate(self, input=None):
+        for f in (self.stdin, self.stdout, self.stderr):
+            if f is not None:
+                f.close()
+        return (self.stdout and "", self.stderr and "")
+
+    def poll(self):
+        return 0
+
+    def wait(self):
+        return 0
+
+def call(args, **kwargs):
+    """subprocess.call(), but see popen()"""
+    return wait(popen(args, **kwargs))
+
+def _kill(p, sig):
+    try:
+        if os.name == "posix":
+            os.killpg(p.pid, sig)
+        else:
+            # no signals to send; this only gets p itself
+            p.terminate()
+    except OSError:
+        # all gone already
+        pass
+
+def kill_processes(sig=signal.SIGTERM):
+    """send sig to all processes started by popen(), returns how many"""
+    with _processes_lock:
+        processes = list(_processes)
+    for p in processes:
+        _kill(p, sig)
+    return len(processes)
+
+def kill_processes_on_exit():
+    """
+    Have kill_processes() run when we exit, and make SIGTERM exit
+    rather than die on the spot, unless someone handles it already;
+    nothing helps with SIGKILL. Call it from the main thread.
+    """
+    atexit.register(kill_processes)
+    if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, _terminated)
+
+def _terminated(signum, frame):
+    kill_processes()
+    sys.exit(128 + signum)
+
+def _read_(p, captures):
+    """read the pipes of p into their captures until all of them close"""
+    if os.name != "posix":
+        # select() only takes sockets there
+        return _read_threads(captures)
+    pending = list(captures)
+    while pending:
+        try:
+            (ready, _, _) = select.select(pending, [], [])
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for f in ready:
+            data = os.read(f.fileno(), 1 << 16)
+            if data:
+                captures[f].feed(data)
+            else:
+                pending.remove(f)
+                f.close()
+
+def _read_pipe(f, capture):
+    for data in iter(lambda: os.read(f.fileno(), 1 << 16), ""):
+        capture.feed(data)
+    f.close()
+
+def _read_threads(captures):
+    """_read_() with a thread per pipe"""
+    threads = [threading.Thread(target=_read_pipe, args=(f, capture))
+               for f, capture in captures.items()]
+    for t in threads:
+        t.setDaemon(True)
+        t.start()
+    for t in threads:
+        t.join()
+
+def _open_pipe_(args, shell=False, limit=OUTPUT_LIMIT):
+    """
+    Run args, returns (returncode, stdoutdata, stderrdata). Both streams
+    are read as they come, at most limit bytes of each are kept (None:
+    all of it); the rest is in a log file, see _Capture.
+    """
+    if isinstance(args, (str, unicode)):
+        cmd = args.split()[0]
+    else:
+        cmd = args[0]
+    start = time.time()
+    with trace.span(os.path.basename(cmd), "subprocess", args=args) as s:
+        p = popen(args,
+                  stdout=subprocess.PIPE,
+                  stderr=subprocess.PIPE,
+                  shell=shell,
+                  cwd=Mem.instance().cwd)
+
+        out = _Capture(limit, _log_path(args, "stdout"))
+        err = _Capture(limit, _log_path(args, "stderr"))
+        try:
+            _read_(p, {p.stdout: out, p.stderr: err})
+        finally:
+            out.close()
+            err.close()
+            wait(p)
+        s["returncode"] = p.returncode
+        s["bytes"] = out.size + err.size
+    Mem.instance().count("subprocess_time", time.time() - start)
+
+    return (p.returncode, out.getvalue(), err.getvalue())
 
 def make_depends(prefix, source, args):
-    (returncode, stdoutdata, stderrdata) = \
-        run_return_output_no_print(prefix, source, _open_pipe_, args)
+    with trace.span(prefix, "scan", source=source):
+        # all of stdout is needed, it's the list of dependencies
+        (returncode, stdoutdata, stderrdata) = \
+            _run_and_print(prefix, source, _open_pipe_, (args, False, None),
+                           {}, (2,))
 
     deps = stdoutdata.split()
 
-    sys.stdout.write(_mark_output_(stderrdata))
-
     if returncode != 0:
         Mem.instance().fail()
 
     deps = deps[1:] # first element is the target (eg ".c"), drop it
     return [dep for dep in deps if dep != '\\']
 
+def _status_line(prefix, source, fun, args, kwargs, returncode):
+    if quiet_level() > 0:
+        s = ""
+        if type(source) == list:
+            for src in source:
+                s += os.path.basename(src) + " "
+        else:
+            s = os.path.basename(source)
+        return "%s %s %s\n" % (get_color_status(returncode),
+                               prefix.rjust(25), s)
+    elif fun == _open_pipe_:
+        if isinstance(args[0], (str, unicode)):
+            return args[0] + "\n"
+        else:
+            return " ".join(args[0]) + "\n"
+    elif args or kwargs:
+        allargs = [repr(a) for a in args] + \
+            ["%s=%s" % (str(k), repr(v))
+             for k,v in kwargs.iteritems()]
+        return "%s(%s)\n" % (fun.__name__, ", ".join(allargs))
+    else:
+        return "%s()\n" % fun.__name__
+
+def _run_and_print(prefix, source, fun, args, kwargs, streams):
+    """
+    fun(*args, **kwargs), which returns (resultcode, stdoutdata,
+    stderrdata); then print the status line along with the outputs
+    whose index is in streams, all at once
+    """
+    returncode = "Fail"
+    result = None
+    try:
+        result = fun(*args, **kwargs)
+        returncode = result[0]
+    finally:
+        out = [_status_line(prefix, source, fun, args, kwargs, returncode)]
+        if result is not None:
+            out.extend(_mark_output_(result[i]) for i in streams)
+        write_output("".join(out))
+
+    return result
+
 def run_return_output_no_print(prefix, source, fun, *args, **kwargs):
     '''
     run commands specified in args (a sequence or string), optionally in a
@@ -113,34 +430,7 @@ def run_return_output_no_print(prefix, source, fun, *args, **kwargs):
     prefix will be truncated and right-justified to 25 characters
     source
     '''
-    e = None
-    returncode = "Fail"
-    try:
-        (returncode, stdoutdata, stderrdata) = fun(*args, **kwargs)
-    finally:
-        if quiet_level() > 0:
-            print get_color_status(returncode), prefix.rjust(25),
-            s = ""
-            if type(source) == list:
-                for src in source:
-                    s += os.path.basename(src) + " "
-            else:
-                s = os.path.basename(source)
-            print s
-        elif fun == _open_pipe_:
-            if isinstance(args[0], (str, unicode)):
-                print args[0]
-            else:
-                print " ".join(args[0])
-        elif args or kwargs:
-            allargs = [repr(a) for a in args] + \
-                ["%s=%s" % (str(k), repr(v))
-                 for k,v in kwargs.iteritems()]
-            print "%s(%s)" % (fun.__name__, ", ".join(allargs))
-        else:
-            print "%s()" % fun.__name__
-
-    return (returncode, stdoutdata, stderrdata)
+    return _run_and_print(prefix, source, fun, args, kwargs, ())
 
 def run_return_output(prefix, source, fun, *args):
     '''
@@ -155,9 +445,7 @@ def run_return_output(prefix, source, fun, *args):
     source
     '''
     (returncode, stdoutdata, stderrdata) = \
-        run_return_output_no_print(prefix, source, fun, *args)
-    sys.stdout.write(_mark_output_(stdoutdata))
-    sys.stdout.write(_mark_output_(stderrdata))
+        _run_and_print(prefix, source, fun, args, {}, (1, 2))
     if returncode != 0:
         Mem.instance().fail()
 
@@ -205,10 +493,12 @@ def get_build_dir(env, arg_func):
 
     dir = os.path.join(root, env.BUILD_DIR, sub_dir)
 
-    try:
-        os.makedirs(dir)
-    except OSError:
-        pass
+    # a dry run doesn't leave so much as an empty directory behind
+    if mem.dry_run is None:
+        try:
+            os.makedirs(dir)
+        except OSError:
+            pass
 
     return dir
 
@@ -278,27 +568,120 @@ def with_env(**kwargs):
                             fkwargs[k] = kwargs[k]
             return f(*args, **fkwargs)
         new_f.__module__ = f.__module__
+        new_f.__name__ = f.__name__
         return new_f
     return decorator
 
+def in_cwd(path):
+    """
+    path, a relative one being relative to the current directory of the
+    build (see Mem.cwd) or, outside of builds, of the process
+    """
+    mem = getattr(Mem, "__it__", None)
+    if mem is None or os.path.isabs(path):
+        return path
+    return mem.path(path)
+
 def ensure_file_dir(path):
     try:
-        os.makedirs(os.path.dirname(path))
+        os.makedirs(os.path.dirname(in_cwd(path)))
     except OSError:
         pass
 
 def ensure_dir(path):
     try:
-        os.makedirs(path)
+        os.makedirs(in_cwd(path))
     except OSError:
         pass
 
+# every file import_module() loaded, so a build can tell whether its
+# Memfiles changed
+imported_files = set()
+
+class CodeCache(object):
+    """
+    Compiled Memfiles, so they needn't be parsed and compiled again on
+    every run: one file in directory per Memfile, holding the hash of
+    the source it was compiled from and the marshalled code object.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def compile(self, source, fname):
+        key = imp.get_magic() + hashlib.sha1(fname + "\0" + source).digest()
+        path = os.path.join(self.directory, hashlib.sha1(
+            os.path.abspath(fname)).hexdigest())
+        try:
+            f = open(path, "rb")
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            if data.startswith(key):
+                return marshal.loads(data[len(key):])
+        except (IOError, EOFError, ValueError, TypeError):
+            pass
+
+        code = compile(source, fname, "exec")
+        tmp = "%s.%d.%d.tmp" % (path, os.getpid(), thread.get_ident())
+        try:
+            ensure_dir(self.directory)
+            f = open(tmp, "wb")
+            try:
+                f.write(key + marshal.dumps(code))
+            finally:
+                f.close()
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            # no cache is no reason to fail the build
+            pass
+        return code
+
+# set by runmem to the CodeCache in .mem
+code_cache = None
+
+def _read(fname):
+    f = open(fname, "rU")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def _exec_module(name, fname, source):
+    if code_cache is None:
+        code = compile(source, fname, "exec")
+    else:
+        code = code_cache.compile(source, fname)
+    m = imp.new_module(os.path.basename(name))
+    m.__file__ = fname
+    exec code in m.__dict__
+    return m
+
 def import_module(name, fname=None):
     if not fname:
         fname = name + ".py"
-    m = imp.new_module(os.path.basename(name))
-    m.__file__ = fname
-    execfile(fname, m.__dict__, m.__dict__)
+    imported_files.add(os.path.abspath(fname))
+    return _exec_module(name, fname, _read(fname))
+
+# the Memfiles this process imported: abspath -> (source, module)
+_memfiles = {}
+_memfiles_lock = threading.Lock()
+
+def import_memfile(fname):
+    """
+    Import the Memfile fname, or rather return the module it was
+    imported into before, unless it changed since.
+    """
+    path = os.path.abspath(fname)
+    imported_files.add(path)
+    source = _read(fname)
+    with _memfiles_lock:
+        cached = _memfiles.get(path)
+    if cached is not None and cached[0] == source:
+        return cached[1]
+    m = _exec_module(fname, fname, source)
+    with _memfiles_lock:
+        _memfiles[path] = (source, m)
     return m
 
 def replace_ext(file, new, old=None):
@@ -307,40 +690,104 @@ def replace_ext(file, new, old=None):
         assert(e == old)
     return n + new
 
-class Runable(Thread):
+class Runable(object):
+    """
+    The old thread-per-task interface, now a thin wrapper around
+    Mem.submit(); new code should use that directly.
+    """
     def __init__(self, f, *args, **kwargs):
-        Thread.__init__(self)
         self.f = f
         self.args = args
         self.kwargs = kwargs
+        self.future = None
 
-    def run(self):
-        mem = Mem.instance()
+    def start(self):
+        self.future = Mem.instance().submit(self.f, *self.args, **self.kwargs)
 
-        if not mem.thread_limit == None:
-            mem.thread_limit.acquire()
+    def join(self):
+        self.result = self.future.result()
 
-        if mem.failed:
-            sys.exit(1)
 
-        self.result = self.f(*(self.args), **(self.kwargs))
+class FrozenEnvError(TypeError):
+    pass
 
-        if not mem.thread_limit == None:
-            mem.thread_limit.release()
 
-    def join(self):
-        mem = Mem.instance()
+def _mutator(name):
+    method = getattr(dict, name)
+    def mutate(self, *args, **kwargs):
+        if self.__dict__.get("_frozen"):
+            raise FrozenEnvError("Env is frozen, use shallow_copy()")
+        self.__dict__.pop("_digest", None)
+        return method(self, *args, **kwargs)
+    mutate.__name__ = name
+    return mutate
 
-        if mem.failed:
-            sys.exit(1)
 
-        Thread.join(self)
+def _refuse(self, *args, **kwargs):
+    raise FrozenEnvError("values of a frozen Env can't change")
 
-        if mem.failed:
-            sys.exit(1)
+
+class _FrozenList(list):
+    """a list in a frozen Env; hashes and compares like any list"""
+    __slots__ = ()
+
+    append = extend = insert = pop = remove = reverse = sort = _refuse
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _refuse
+    __iadd__ = __imul__ = _refuse
+
+    def __reduce__(self):
+        return (_FrozenList, (list(self),))
+
+
+class _FrozenDict(dict):
+    """a dict in a frozen Env"""
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = clear = pop = popitem = _refuse
+    setdefault = update = _refuse
+
+    def __reduce__(self):
+        return (_FrozenDict, (dict(self),))
+
+
+def _deep_freeze(value):
+    if isinstance(value, Env):
+        return value.freeze()
+    if type(value) in (list, _FrozenList):
+        return _FrozenList(_deep_freeze(v) for v in value)
+    if type(value) is tuple:
+        return tuple(_deep_freeze(v) for v in value)
+    if type(value) in (dict, _FrozenDict):
+        return _FrozenDict((k, _deep_freeze(v)) for k, v in value.iteritems())
+    if type(value) is set:
+        return frozenset(value)
+    return value
+
+
+def _thaw(value):
+    if type(value) is _FrozenList:
+        return list(value)
+    if type(value) is _FrozenDict:
+        return dict(value)
+    return value
 
 
 class Env(dict):
+    """
+    A dict whose keys can be used as attributes. An Env that gets
+    passed to many memoized calls should be frozen: neither it nor the
+    lists and dicts in it can be changed any more, and its hash is
+    computed only once.
+    """
+
+    __setitem__ = _mutator("__setitem__")
+    __delitem__ = _mutator("__delitem__")
+    clear = _mutator("clear")
+    pop = _mutator("pop")
+    popitem = _mutator("popitem")
+    setdefault = _mutator("setdefault")
+    update = _mutator("update")
+
     def __getattr__(self, key):
         try:
             return self[key]
@@ -350,6 +797,28 @@ class Env(dict):
     def __setattr__(self, key, val):
 	self[key] = val
 
+    def freeze(self):
+        if not self.is_frozen():
+            for key, value in dict.items(self):
+                dict.__setitem__(self, key, _deep_freeze(value))
+            self.__dict__.pop("_digest", None)
+            self.__dict__["_frozen"] = True
+        return self
+
+    def is_frozen(self):
+        return self.__dict__.get("_frozen", False)
+
+    def mem_digest(self):
+        """the hash of the contents, cached while frozen"""
+        try:
+            return self.__dict__["_digest"]
+        except KeyError:
+            import hashing
+            h = hashing.digest(dict(self))
+            if self.is_frozen():
+                self.__dict__["_digest"] = h
+            return h
+
     def __repr__(self):
         return "Env(" + " ".join("%s=%s" % (k, repr(v))
                                  for k,v in self.items()) + ")"
@@ -358,7 +827,7 @@ class Env(dict):
         return repr(self)
 
     def shallow_copy(self):
-        return Env(dict.copy(self))
+        return Env((k, _thaw(v)) for k, v in dict.iteritems(self))
 
     def replace(self, **kwargs):
         for key, value in kwargs.items():
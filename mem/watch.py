@@ -0,0 +1,471 @@
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+'runmem --watch': build, wait for a file to change, build again.
+
+The Mem stays resident between builds and so does everything it
+learned: the hashes of all files and the memoized calls that were done.
+When files change only the calls that depend on (or produced) one of
+them are forgotten; build() then runs as usual, but every other call
+is done already and costs nothing more than a dictionary lookup.
+
+The files are watched with inotify on Linux. Elsewhere they are polled
+every POLL_INTERVAL seconds, which costs a stat() per file. So are the
+directories they are in: a file that comes or goes there (think
+glob.glob() in a Memfile) makes for a new build too, as it does for
+the no-op fast path.
+"""
+
+from __future__ import with_statement
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+import traceback
+
+import nodes
+import noop
+import util
+
+from _mem import Mem
+
+# how long to wait for more changes once a file changed; editors and
+# checkouts tend to touch many files in a row
+SETTLE_TIME = 0.1
+POLL_INTERVAL = 1.0
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+         IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+         IN_MOVE_SELF | IN_ONLYDIR)
+# everything that happens to a directory as a whole
+_DIR_EVENTS = IN_ISDIR | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+# what changes a directory's listing
+_LISTING_EVENTS = IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM
+
+# struct inotify_event, without the name that follows it
+_EVENT = struct.Struct("iIII")
+
+
+def _existing_dir(path):
+    """the directory path is in or, if that's gone, its closest ancestor"""
+    d = os.path.dirname(path)
+    while not os.path.isdir(d) and d != os.path.dirname(d):
+        d = os.path.dirname(d)
+    return d
+
+
+class Inotify(object):
+    """
+    Watches the directories of a set of paths, and the listings of a
+    set of directories, with Linux' inotify, through ctypes. Raises
+    OSError (or AttributeError if the C library has no inotify at all)
+    when it can't.
+    """
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, "inotify_init: %s" % os.strerror(e))
+        self.dirs = {}
+        self.wds = {}
+        self.paths = set()
+        self.listed = set()
+
+    def watch(self, paths, dirs=()):
+        """watch paths and what is in dirs (and nothing else) from now on"""
+        self.paths = set(paths)
+        self.listed = set(dirs)
+        wanted = set(_existing_dir(p) for p in self.paths)
+        wanted.update(d for d in self.listed if os.path.isdir(d))
+        for d in wanted:
+            if d in self.wds:
+                continue
+            wd = self._add_watch(self.fd, d, _MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                raise OSError(e, "inotify_add_watch %s: %s" %
+                              (d, os.strerror(e)))
+            self.dirs[wd] = d
+            self.wds[d] = wd
+
+    def _under(self, d):
+        prefix = d + os.sep
+        return set(p for p in self.paths.union(self.listed)
+                   if p == d or p.startswith(prefix))
+
+    def wait(self, timeout=None):
+        """
+        Wait until something happened to the watched paths or in the
+        watched directories, or timeout seconds, and return the paths
+        and directories it happened to. They didn't necessarily change,
+        a file may just have been opened for writing.
+        """
+        found = set()
+        while self._ready(timeout):
+            found.update(self._read())
+            # whatever else is queued already
+            timeout = 0
+        return found
+
+    def _ready(self, timeout):
+        try:
+            return select.select([self.fd], [], [], timeout)[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def _read(self):
+        data = os.read(self.fd, 1 << 16)
+        found = set()
+        dirs_changed = False
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos:pos + length].rstrip("\0")
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                # the kernel dropped events, anything could have changed
+                return self.paths.union(self.listed)
+            d = self.dirs.get(wd)
+            if d is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.dirs[wd]
+                del self.wds[d]
+            path = name and os.path.join(d, name) or d
+            if name and mask & _LISTING_EVENTS and d in self.listed:
+                found.add(d)
+            if mask & _DIR_EVENTS:
+                found.update(self._under(path))
+                dirs_changed = True
+            elif path in self.paths:
+                found.add(path)
+        if dirs_changed:
+            # directories came or went, watch the ones there are now
+            self.watch(self.paths, self.listed)
+        return found
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller(object):
+    """for want of inotify: every so often, all paths might have changed"""
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.paths = set()
+
+    def watch(self, paths, dirs=()):
+        self.paths = set(paths).union(dirs)
+
+    def wait(self, timeout=None):
+        if timeout is None or timeout > self.interval:
+            timeout = self.interval
+        time.sleep(timeout)
+        return set(self.paths)
+
+    def close(self):
+        pass
+
+
+def open_watcher():
+    try:
+        return Inotify()
+    except (OSError, AttributeError):
+        return Poller()
+
+
+def _stat_key(path):
+    try:
+        return noop._stat_key(os.stat(path))
+    except OSError:
+        return None
+
+
+def _listing(path):
+    try:
+        return noop._listing(path)
+    except OSError:
+        return None
+
+
+class Snapshot(object):
+    """
+    The watched files and directories as they were at the end of a
+    build.
+    """
+    def __init__(self, paths, dirs=()):
+        self.keys = dict((p, _stat_key(p)) for p in paths)
+        self.listings = dict((d, _listing(d)) for d in dirs)
+        self.keys.update((d, _stat_key(d)) for d in dirs)
+
+    def _same_content(self, path):
+        """whether path still has the hash the build saw, if it saw one"""
+        h = nodes.File._hash_cache.get(path)
+        if h is None:
+            return False
+        try:
+            return nodes.hash_contents(path, os.stat(path)) == h
+        except (OSError, IOError):
+            return h == nodes.NOT_FOUND
+
+    def edited(self, since):
+        """the files that changed while the build (started at since) ran"""
+        edited = set()
+        for p, key in self.keys.items():
+            # directories, the build writes into them itself
+            if p in self.listings:
+                continue
+            if key is not None and key[2] >= since and \
+                    not self._same_content(p):
+                edited.add(p)
+        return edited
+
+    def changed(self, paths):
+        """those of paths that changed since the snapshot was taken"""
+        changed = set()
+        for p in paths:
+            key = _stat_key(p)
+            if key == self.keys.get(p):
+                continue
+            # a touch or an editor saving the same content doesn't count
+            self.keys[p] = key
+            if p in self.listings:
+                # nor does a file in a directory changing
+                listing = _listing(p)
+                if listing != self.listings[p]:
+                    self.listings[p] = listing
+                    changed.add(p)
+            elif not self._same_content(p):
+                changed.add(p)
+        return changed
+
+
+def _call_files(mem):
+    files = set()
+    with mem.calls_lock:
+        calls = mem.calls.values()
+    for deps, result in calls:
+        for o in (deps, result):
+            for f in _files(o):
+                files.add(f)
+    return files
+
+
+def watched_files(mem):
+    """everything the last build depended on, made or was loaded from"""
+    return _call_files(mem).union(util.imported_files).union(
+        noop.module_files())
+
+
+def watched_dirs(mem):
+    """the directories those files are in, python modules' aside"""
+    return set(os.path.dirname(f) for f in
+               _call_files(mem).union(util.imported_files))
+
+
+def _files(o):
+    if isinstance(o, nodes.File):
+        yield str(o)
+    elif hasattr(o, "__iter__") and not hasattr(o, "get_hash"):
+        for el in o:
+            for f in _files(el):
+                yield f
+
+
+def _build(mem, build):
+    """one build() by the resident mem; returns whether it succeeded"""
+    os.chdir(mem.root)
+    mem.cwd = mem.root
+    try:
+        try:
+            build()
+        except SystemExit:
+            # mem.fail(); anything else is meant to end runmem
+            if not mem.failed:
+                raise
+        except KeyboardInterrupt:
+            mem.abort()
+            raise
+        except Exception:
+            traceback.print_exc()
+            print "-" * 50
+            print "build failed."
+            mem.failed = True
+    finally:
+        mem.finish()
+    return not mem.failed
+
+
+def _load(load_root):
+    """the build() of the MemfileRoot, one that fails if it has errors"""
+    try:
+        return load_root().build
+    except Exception:
+        traceback.print_exc()
+        def build():
+            Mem.instance().fail("the MemfileRoot can't be loaded")
+        return build
+
+
+def _describe(paths, root):
+    names = sorted(os.path.relpath(p, root) for p in paths)
+    if len(names) > 5:
+        names = names[:5] + ["and %d more" % (len(names) - 5)]
+    return ", ".join(names)
+
+
+class Resident(object):
+    """
+    A Mem that stays around for many builds, each of them only looking
+    again at what changed since the one before. load_root() imports the
+    MemfileRoot and returns it.
+    """
+    def __init__(self, root, load_root):
+        self.root = root
+        self.load_root = load_root
+        # what it takes to start over
+        self.cwd = os.getcwd()
+        self.argv = [os.path.abspath(sys.argv[0])] + sys.argv[1:]
+
+        self.watcher = open_watcher()
+        self.build_root = _load(load_root)
+        os.chdir(root)
+        self.mem = Mem(root)
+        self.files = set()
+        self.dirs = set()
+        self.snapshot = Snapshot(())
+        self.changed = set()
+
+    def build(self, argv, show_stats=True):
+        """build once, argv being runmem's arguments; returns success"""
+        self._forget_changes()
+        start = time.time()
+        ok = _build(self.mem, self.build_root)
+        if ok:
+            # for the runmem after us, which won't be watching
+            noop.record(self.mem, [a for a in argv if a != "--watch"],
+                        util.imported_files)
+        if show_stats:
+            print "-" * 50
+            print self.mem.stats.table()
+
+        self.files = watched_files(self.mem)
+        self.dirs = watched_dirs(self.mem)
+        self.snapshot = Snapshot(self.files, self.dirs)
+        try:
+            self.watcher.watch(self.files, self.dirs)
+        except OSError, e:
+            print "%s; polling for changes instead." % e
+            self.watcher.close()
+            self.watcher = Poller()
+            self.watcher.watch(self.files, self.dirs)
+        self.changed = self.snapshot.edited(start)
+        return ok
+
+    def wait(self):
+        """wait until some of the files the last build used changed"""
+        while not self.changed:
+            self.changed = self.snapshot.changed(self.watcher.wait())
+        while True:
+            more = self.snapshot.changed(self.watcher.wait(SETTLE_TIME))
+            if not more:
+                return
+            self.changed.update(more)
+
+    def poll(self):
+        """notice the changes there were so far, without waiting"""
+        self.changed.update(self.snapshot.changed(self.watcher.wait(0)))
+
+    def _forget_changes(self):
+        if not self.changed:
+            return
+        python = noop.module_files().difference(util.imported_files)
+        if not python.isdisjoint(self.changed):
+            self.restart()
+        if os.path.join(self.root, "MemfileRoot") in self.changed:
+            self.build_root = _load(self.load_root)
+
+        print "=" * 50
+        print "changed: %s" % _describe(self.changed, self.root)
+        self.mem.invalidate(self.changed)
+        self.mem.rebuild()
+        self.changed = set()
+
+    def restart(self):
+        """start over in a fresh process, the code that's loaded is stale"""
+        print "python modules changed, restarting."
+        sys.stdout.flush()
+        self.close()
+        os.chdir(self.cwd)
+        os.execv(sys.executable, [sys.executable] + self.argv)
+
+    def close(self):
+        self.mem.finish()
+        self.watcher.close()
+
+
+def run(root, load_root, argv, show_stats=True):
+    """build in root until interrupted, see Resident"""
+    resident = Resident(root, load_root)
+    try:
+        while True:
+            try:
+                resident.build(argv, show_stats)
+            except KeyboardInterrupt:
+                print "-" * 50
+                print "build interrupted."
+                return 1
+            if not resident.changed:
+                print "-" * 50
+                print "watching %d files for changes." % len(resident.files)
+                sys.stdout.flush()
+                try:
+                    resident.wait()
+                except KeyboardInterrupt:
+                    return 0
+    finally:
+        resident.watcher.close()